@@ -2,13 +2,25 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request
 from app import db
 from app.models.user_models import User
-from werkzeug.security import check_password_hash
+from app.services.suggest_service import suggest_index
+from app.services.user_service import create_user, taken_field
+from app.utils.passwords import password_hasher, needs_rehash, HasherBusy
+from app.utils.rate_limit import rate_limiter
 from flask_login import login_user, login_required, logout_user
 
 auth = Blueprint('auth', __name__)
 
 from . import routes
 
+
+# Response when every password hashing slot is taken
+def hasher_busy():
+    return 'Too many sign-ins at the moment, please try again shortly.', 503, {'Retry-After': '1'}
+
+# Response when a client has used up its attempts
+def too_many_attempts(retry_after):
+    return 'Too many attempts, please try again later.', 429, {'Retry-After': str(retry_after)}
+
 # Route for the registration page
 @auth.route('/register', methods=['GET', 'POST'])
 def register():
@@ -18,29 +30,33 @@ def register():
         password = request.form['password']
         password_confirm = request.form['password_confirm']
 
+        # Throttle before any lookup or hashing
+        retry_after = rate_limiter.check('register', ip=request.remote_addr)
+        if retry_after:
+            return too_many_attempts(retry_after)
+
         # Check if passwords match
         if password != password_confirm:
             flash('Passwords must match!', 'danger')
             return redirect(url_for('auth.register'))
 
-        # Check if username or email already exists
-        existing_user = User.query.filter_by(username=username).first()
-        if existing_user:
+        # Turn taken names away before spending a hash on them, then hash on
+        # the bounded pool and insert once: the unique constraints catch a
+        # name taken in between
+        duplicate = taken_field(username, email)
+        if duplicate is None:
+            try:
+                password_hash = password_hasher.hash(password)
+            except HasherBusy:
+                return hasher_busy()
+            user_id, duplicate = create_user(username, email, password_hash)
+        if duplicate == 'username':
             flash('Username already exists, please choose a different one.', 'danger')
             return redirect(url_for('auth.register'))
-
-        existing_email = User.query.filter_by(email=email).first()
-        if existing_email:
+        if duplicate == 'email':
             flash('Email already registered, please use a different one.', 'danger')
             return redirect(url_for('auth.register'))
-
-        # Create a new user and set the password
-        user = User(username=username, email=email)
-        user.set_password(password)
-
-        # Add user to the database and commit
-        db.session.add(user)
-        db.session.commit()
+        suggest_index.add('user', user_id, username)
 
         flash('Registration successful! Please log in.', 'success')
         return redirect(url_for('auth.login'))
@@ -55,11 +71,30 @@ def login():
         username = request.form['username']
         password = request.form['password']
 
+        # Throttle before any lookup or hashing
+        retry_after = rate_limiter.check('login', ip=request.remote_addr, username=username.lower())
+        if retry_after:
+            return too_many_attempts(retry_after)
+
         # Look for the user by username
         user = User.query.filter_by(username=username).first()
 
         # Check if user exists and the password is correct
-        if user and user.check_password(password):
+        try:
+            valid = user is not None and password_hasher.verify(user.password_hash, password)
+        except HasherBusy:
+            return hasher_busy()
+
+        if valid:
+            if needs_rehash(user.password_hash):
+                # Stored with an older method or cost: upgrade it while we have
+                # the password, unless every hashing worker is busy (a later
+                # login upgrades it instead)
+                password_hash = password_hasher.rehash(password)
+                if password_hash:
+                    user.password_hash = password_hash
+                    db.session.commit()
+
             # Log the user in
             login_user(user)
             flash('Login successful!', 'success')
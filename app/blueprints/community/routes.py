@@ -1,26 +1,80 @@
-from flask import Blueprint, render_template, redirect, url_for, request, flash
+from flask import Blueprint, Response, abort, render_template, redirect, url_for, request, flash, current_app, jsonify
 from flask_login import login_required, current_user
-from sqlalchemy.orm import aliased
+from sqlalchemy import func
+from sqlalchemy.orm import aliased, joinedload
 from app import db
-from app.models.user_models import Like, Follow, User
-from app.models.post_models import Post, Comment
+from app.models.user_models import Like, Follow, User, RewardTransaction
+from app.models.post_models import Post, Comment, EXCERPT_LENGTH
 from app.blueprints.community.forms import PostForm, CommentForm  # Assuming you have WTForms for validation
 from app.services.reward_service import add_reward_points, get_user_rewards
+from app.services.ledger_service import inclusion_proof
+from app.services.leaderboard_service import leaderboard
+from app.services.search_service import index_post, remove_post, cached_search_posts, search_cache
+from app.services.suggest_service import suggest_index
+from app.services.stream_service import notification_broker, StreamLimitReached
+from app.services.timeline_service import fan_out_post, backfill_follow, remove_author, remove_from_timelines, timeline_page, pulled_cache
+from app.services.follow_service import is_following, adjust_follow_counts
+from app.services.user_service import user_cache, invalidate_users
+from app.services.comment_service import comments_page, comment_thread, has_replies, reply_fields, reply_target
+from app.services.counter_service import adjust_post_count
+from app.utils.helpers import notify_like, notify_follow, notifications_page, mark_notification_read, mark_all_notifications_read
+from app.utils.db_utils import insert_ignore_one
+from app.utils.pagination import keyset_page
 
 
 community = Blueprint('community', __name__)
 
 
-# Home route to display all posts
-@community.route('/')
+# Top of the leaderboard plus the current user's rank, with usernames filled in
+def leaderboard_context(limit):
+    top = leaderboard.top(limit)
+    names = dict(db.session.query(User.id, User.username).filter(User.id.in_([user_id for _, user_id, _ in top])))
+    entries = [{'rank': rank, 'user_id': user_id, 'username': names.get(user_id), 'points': points}
+               for rank, user_id, points in top]
+    me = None
+    if current_user.is_authenticated:
+        my_rank = leaderboard.rank(current_user.id)
+        if my_rank:
+            me = {'rank': my_rank[0], 'user_id': current_user.id, 'points': my_rank[1]}
+    return {'leaderboard': entries, 'me': me, 'total': len(leaderboard)}
+
+
+# Query for posts that loads each author's id and username in the same SELECT,
+# so templates can read post.user without one extra query per post
+def posts_with_authors():
+    return Post.query.options(joinedload(Post.user).load_only(User.id, User.username))
+
+
+# Lightweight rows for list views: only the columns the list templates render,
+# with the author joined in, instead of whole Post objects and their bodies.
+# Posts written before the excerpt column existed fall back to a substring.
+def post_rows():
+    return db.session.query(
+        Post.id,
+        Post.title,
+        func.coalesce(Post.excerpt, func.substr(Post.content, 1, EXCERPT_LENGTH)).label('excerpt'),
+        Post.created_at,
+        Post.like_count,
+        Post.comment_count,
+        User.id.label('author_id'),
+        User.username.label('author_username'),
+    ).outerjoin(User, Post.user_id == User.id)
+
+
+# Home route to display the latest posts, one page at a time
+@community.route('/', strict_slashes=False)
 def home():
     print("Rendering index.html")
     # try:
     #    return render_template('community/index.html')
     # except TemplateNotFound as e:
     #    return f"Template not found: {str(e)}"
-    posts = Post.query.all()  # Retrieve all posts from the database
-    return render_template('community/index.html', posts=posts)
+    posts, next_cursor = keyset_page(
+        post_rows(), Post.id,
+        before=request.args.get('before', type=int),
+        per_page=current_app.config['POSTS_PER_PAGE'],
+    )
+    return render_template('community/index.html', posts=posts, next_cursor=next_cursor)
 
 
 # Route for login (just a placeholder for now)
@@ -40,19 +94,130 @@ def profile():
     rewards = get_user_rewards(current_user)  # Get the total reward points for the user
     return render_template('community/profile.html', rewards=rewards)
 
-# Route for displaying all posts
+# Route for another user's public profile and their latest posts
+@community.route('/users/<int:user_id>')
+def user_profile(user_id):
+    user = User.query.get_or_404(user_id)
+    following = current_user.is_authenticated and is_following(current_user.id, user.id)
+    posts, next_cursor = keyset_page(
+        post_rows().filter(Post.user_id == user.id), Post.id,
+        before=request.args.get('before', type=int),
+        per_page=current_app.config['POSTS_PER_PAGE'],
+    )
+    return render_template('community/view_user_profile.html', user=user, is_following=following,
+                           posts=posts, next_cursor=next_cursor)
+
+# Route for the user's dashboard: notifications, newest first, one page at a time
+@community.route('/dashboard')
+@login_required
+def dashboard():
+    notifications, next_cursor = notifications_page(
+        current_user.id,
+        before=request.args.get('before'),
+        per_page=current_app.config['NOTIFICATIONS_PER_PAGE'],
+    )
+    # Load the actors' names and the posts' titles for the whole page at once
+    actor_ids = {n.actor_id for n in notifications if n.actor_id}
+    post_ids = {n.target_id for n in notifications if n.target_type == 'post'}
+    actors = dict(db.session.query(User.id, User.username).filter(User.id.in_(actor_ids))) if actor_ids else {}
+    post_titles = dict(db.session.query(Post.id, Post.title).filter(Post.id.in_(post_ids))) if post_ids else {}
+    return render_template('community/dashboard.html', notifications=notifications, next_cursor=next_cursor,
+                           actors=actors, post_titles=post_titles)
+
+# Route for marking one notification as read
+@community.route('/notifications/<int:notification_id>/read', methods=['POST'])
+@login_required
+def read_notification(notification_id):
+    mark_notification_read(current_user.id, notification_id)
+    return redirect(request.referrer or url_for('community.dashboard'))
+
+# Route for marking every notification as read
+@community.route('/notifications/read_all', methods=['POST'])
+@login_required
+def read_all_notifications():
+    mark_all_notifications_read(current_user.id)
+    flash('All notifications marked as read.', 'success')
+    return redirect(url_for('community.dashboard'))
+
+# Server-Sent Events stream of the current user's new notifications, so open
+# pages update their badge without polling the dashboard. Off unless
+# NOTIFICATION_STREAM_ENABLED, see its note in create_app.
+@community.route('/notifications/stream')
+@login_required
+def notification_stream():
+    if not current_app.config['NOTIFICATION_STREAM_ENABLED']:
+        abort(404)
+    user_id = current_user.id
+    try:
+        events = notification_broker.subscribe(user_id)
+    except StreamLimitReached:
+        return Response('Too many open notification streams.', status=503, headers={'Retry-After': '30'})
+    return Response(notification_broker.stream(user_id, events), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',  # Don't let nginx buffer the stream
+    })
+
+# Home timeline: posts by the current user and the people they follow
+@community.route('/timeline')
+@login_required
+def timeline():
+    post_ids, next_cursor = timeline_page(
+        current_user.id,
+        before=request.args.get('before', type=int),
+        per_page=current_app.config['POSTS_PER_PAGE'],
+    )
+    rows = {row.id: row for row in post_rows().filter(Post.id.in_(post_ids))} if post_ids else {}
+    posts = [rows[post_id] for post_id in post_ids if post_id in rows]
+    return render_template('community/timeline.html', posts=posts, next_cursor=next_cursor)
+
+# Route for displaying all posts (newest first, paginated with ?before=<post id>)
 @community.route('/posts')
 def post_list():
-    posts = Post.query.all()  # Get all posts from the database
-    return render_template('community/post_list.html', posts=posts)
+    posts, next_cursor = keyset_page(
+        post_rows(), Post.id,
+        before=request.args.get('before', type=int),
+        per_page=current_app.config['POSTS_PER_PAGE'],
+    )
+    return render_template('community/post_list.html', posts=posts, next_cursor=next_cursor)
 
 # Route for displaying a single post and its comments
 @community.route('/posts/<int:post_id>')
 def post_detail(post_id):
-    post = Post.query.get_or_404(post_id)  # Get a specific post by ID
-    comments = Comment.query.filter_by(post_id=post.id).all()  # Get comments for that post
+    post = posts_with_authors().filter(Post.id == post_id).first_or_404()  # Get a specific post by ID
+    comments, next_cursor = comments_page(post.id, per_page=current_app.config['COMMENTS_PER_PAGE'],
+                                          max_depth=current_app.config['COMMENT_DISPLAY_DEPTH'],
+                                          reply_limit=current_app.config['COMMENT_REPLY_LIMIT'])
+    already_liked = current_user.is_authenticated and db.session.query(
+        Like.query.filter_by(user_id=current_user.id, post_id=post.id).exists()).scalar()
     form = CommentForm()
-    return render_template('community/post_detail.html', post=post, comments=comments,form=form)
+    return render_template('community/post_detail.html', post=post, comments=comments, next_cursor=next_cursor,
+                           already_liked=already_liked, form=form)
+
+# "Load more" for a post's comments: the page after the ?after=<comment id> cursor, as JSON
+@community.route('/posts/<int:post_id>/comments')
+def post_comments(post_id):
+    comments, next_cursor = comments_page(
+        post_id,
+        after=request.args.get('after', type=int),
+        per_page=current_app.config['COMMENTS_PER_PAGE'],
+        max_depth=current_app.config['COMMENT_DISPLAY_DEPTH'],
+        reply_limit=current_app.config['COMMENT_REPLY_LIMIT'],
+    )
+    return jsonify({'comments': comments, 'next_cursor': next_cursor})
+
+# "Continue this thread": one comment and a page of the replies below it
+# (after the ?after=<reply id> cursor), as JSON
+@community.route('/comments/<int:comment_id>/thread')
+def comment_thread_json(comment_id):
+    comment = Comment.query.get_or_404(comment_id)
+    thread, next_cursor = comment_thread(
+        comment,
+        after=request.args.get('after', type=int),
+        per_page=current_app.config['COMMENTS_PER_PAGE'],
+        max_depth=current_app.config['COMMENT_DISPLAY_DEPTH'],
+        reply_limit=current_app.config['COMMENT_REPLY_LIMIT'],
+    )
+    return jsonify({'comment': thread, 'next_cursor': next_cursor})
 
 # Route for creating a new post
 @community.route('/posts/new', methods=['GET', 'POST'])
@@ -63,10 +228,17 @@ def new_post():
     if form.validate_on_submit():
         post = Post(title=form.title.data, content=form.content.data, user_id=current_user.id)
         db.session.add(post)
+        db.session.flush()  # Assign the post id so it can be indexed in the same commit
+        index_post(post)
+        switched = fan_out_post(post)
         db.session.commit()
+        search_cache.bump()
+        if switched:
+            pulled_cache.bump()
+        suggest_index.add('post', post.id, post.title)
 
         # Add reward points after the post is created
-        add_reward_points(current_user, 10)  # Award 10 points for creating a post
+        add_reward_points(current_user, 10, 'post', post)  # Award 10 points for creating a post
 
         flash('Your post has been created!', 'success')
         return redirect(url_for('community.post_list'))
@@ -88,9 +260,14 @@ def edit_post(post_id):
         return redirect(url_for('community.post_list'))
     
     if request.method == 'POST':
+        old_title = post.title
         post.title = request.form['title']
         post.content = request.form['content']
+        index_post(post)
         db.session.commit()
+        search_cache.bump()
+        suggest_index.remove('post', post.id, old_title)
+        suggest_index.add('post', post.id, post.title)
         flash('Your post has been updated!', 'success')
         return redirect(url_for('community.post_detail', post_id=post.id, form=comment_form))
     
@@ -110,8 +287,13 @@ def delete_post(post_id):
         flash('You are not authorized to delete this post.', 'danger')
         return redirect(url_for('community.post_list'))
     
+    post_id, title = post.id, post.title
+    remove_post(post_id)
+    remove_from_timelines(post_id)
     db.session.delete(post)
     db.session.commit()
+    search_cache.bump()
+    suggest_index.remove('post', post_id, title)
     flash('Your post has been deleted!', 'success')
     return redirect(url_for('community.post_list'))
 
@@ -121,23 +303,25 @@ def delete_post(post_id):
 def like_post(post_id):
     post = Post.query.get_or_404(post_id)
     
-    # Check if the user already liked the post
-    existing_like = Like.query.filter_by(user_id=current_user.id, post_id=post_id).first()
+    # One idempotent INSERT: the unique constraint decides whether this is a new like
+    like_id = insert_ignore_one(Like, {'user_id': current_user.id, 'post_id': post.id})
     
-    if not existing_like:
-        # Create a new like
-        like = Like(user_id=current_user.id, post_id=post.id)
-        db.session.add(like)
+    if like_id:
+        adjust_post_count(post.id, Post.like_count, 1)
         db.session.commit()
 
         # Add reward points for liking the post
-        add_reward_points(current_user, 5)  # Award 5 points for liking a post
+        like = Like(id=like_id, user_id=current_user.id, post_id=post.id)
+        add_reward_points(current_user, 5, 'like', like)  # Award 5 points for liking a post
+        if post.user_id and post.user_id != current_user.id:
+            notify_like(post.user_id, post.id, current_user.id)
 
         flash('Post liked!', 'success')
     else:
+        db.session.rollback()
         flash('You have already liked this post.', 'warning')
     
-    return redirect(url_for('community.view_post', post_id=post.id))
+    return redirect(url_for('community.post_detail', post_id=post.id))
 
 
 # Route for creating a new comment on a post
@@ -149,10 +333,11 @@ def new_comment(post_id):
     if form.validate_on_submit():
         comment = Comment(content=form.content.data, user_id=current_user.id, post_id=post_id)
         db.session.add(comment)
+        adjust_post_count(post_id, Post.comment_count, 1)
         db.session.commit()
 
         # Add reward points for commenting on a post
-        add_reward_points(current_user, 3)  # Award 3 points for posting a comment
+        add_reward_points(current_user, 3, 'comment', comment)  # Award 3 points for posting a comment
 
         flash('Your comment has been added!', 'success')
         return redirect(url_for('community.post_detail', post_id=post_id))
@@ -161,6 +346,26 @@ def new_comment(post_id):
 
 
 
+# Route for replying to a comment
+@community.route('/comments/<int:comment_id>/reply', methods=['POST'])
+@login_required
+def reply_comment(comment_id):
+    parent = reply_target(Comment.query.get_or_404(comment_id), current_app.config['COMMENT_MAX_DEPTH'])
+    form = CommentForm()
+
+    if form.validate_on_submit():
+        # The path is copied from the parent, so a reply is a single INSERT
+        reply = Comment(content=form.content.data, user_id=current_user.id, **reply_fields(parent))
+        db.session.add(reply)
+        adjust_post_count(parent.post_id, Post.comment_count, 1)
+        db.session.commit()
+
+        add_reward_points(current_user, 3, 'comment', reply)  # Replies earn the same as comments
+        flash('Your reply has been added!', 'success')
+    else:
+        flash('A reply cannot be empty.', 'warning')
+    return redirect(url_for('community.post_detail', post_id=parent.post_id))
+
 # Route for deleting a comment
 @community.route('/comments/<int:comment_id>/delete', methods=['POST'])
 @login_required
@@ -172,7 +377,13 @@ def delete_comment(comment_id):
         flash('You are not authorized to delete this comment.', 'danger')
         return redirect(url_for('community.post_detail', post_id=comment.post_id))
     
-    db.session.delete(comment)
+    if has_replies(comment):
+        # Keep the row so the replies below it stay in place
+        comment.content = '[deleted]'
+        comment.user_id = None
+    else:
+        db.session.delete(comment)
+        adjust_post_count(comment.post_id, Post.comment_count, -1)
     db.session.commit()
     flash('Your comment has been deleted!', 'success')
     return redirect(url_for('community.post_detail', post_id=comment.post_id))
@@ -202,7 +413,7 @@ def view_flagged_posts():
         flash('You are not authorized to view flagged posts.', 'danger')
         return redirect(url_for('community.post_list'))
     
-    flagged_posts = Post.query.filter_by(is_flagged=True).all()
+    flagged_posts = posts_with_authors().filter_by(is_flagged=True).all()
     return render_template('community/flagged_posts.html', posts=flagged_posts)
 
 # Route for admin to moderate a flagged post (approve or delete)
@@ -220,10 +431,15 @@ def moderate_flagged_post(post_id):
     if action == 'approve':
         post.is_flagged = False
         db.session.commit()
+        search_cache.bump()
         flash('The post has been approved and unflagged.', 'success')
     elif action == 'delete':
+        post_id, title = post.id, post.title
+        remove_post(post_id)
         db.session.delete(post)
         db.session.commit()
+        search_cache.bump()
+        suggest_index.remove('post', post_id, title)
         flash('The flagged post has been deleted.', 'danger')
     
     return redirect(url_for('community.view_flagged_posts'))
@@ -235,34 +451,99 @@ def moderate_flagged_post(post_id):
 def follow_user(user_id):
     user_to_follow = User.query.get_or_404(user_id)
     
-    # Check if the user is already following the target user
-    existing_follow = Follow.query.filter_by(follower_id=current_user.id, followed_id=user_id).first()
+    # One idempotent INSERT: the unique constraint decides whether this is a new follow
+    follow_id = insert_ignore_one(Follow, {'follower_id': current_user.id, 'followed_id': user_to_follow.id})
     
-    if not existing_follow:
-        # Create a new follow
-        follow = Follow(follower_id=current_user.id, followed_id=user_to_follow.id)
-        db.session.add(follow)
+    if follow_id:
+        adjust_follow_counts(current_user.id, user_to_follow.id, 1)
+        backfill_follow(current_user.id, user_to_follow.id)
         db.session.commit()
+        invalidate_users(current_user.id, user_to_follow.id)
+        pulled_cache.invalidate(current_user.id)
 
         # Add reward points for following a user
-        add_reward_points(current_user, 2)  # Award 2 points for following a user
+        follow = Follow(id=follow_id, follower_id=current_user.id, followed_id=user_to_follow.id)
+        add_reward_points(current_user, 2, 'follow', follow)  # Award 2 points for following a user
+        notify_follow(user_to_follow.id, current_user.id)
 
         flash(f'You are now following {user_to_follow.username}!', 'success')
     else:
+        db.session.rollback()
         flash(f'You are already following {user_to_follow.username}.', 'warning')
     
-    return redirect(url_for('community.profile', user_id=user_to_follow.id))
+    return redirect(url_for('community.user_profile', user_id=user_to_follow.id))
+
+# Route for unfollowing a user
+@community.route('/unfollow_user/<int:user_id>', methods=['POST'])
+@login_required
+def unfollow_user(user_id):
+    user_to_unfollow = User.query.get_or_404(user_id)
+
+    removed = Follow.query.filter_by(follower_id=current_user.id, followed_id=user_id).delete(synchronize_session=False)
+    if removed:
+        adjust_follow_counts(current_user.id, user_id, -removed)
+        remove_author(current_user.id, user_id)
+        db.session.commit()
+        invalidate_users(current_user.id, user_id)
+        pulled_cache.invalidate(current_user.id)
+        flash(f'You have unfollowed {user_to_unfollow.username}.', 'success')
+    else:
+        flash(f'You are not following {user_to_unfollow.username}.', 'warning')
+
+    return redirect(url_for('community.user_profile', user_id=user_id))
 
 @community.route('/search', methods=['GET', 'POST'])
 def search():
     query = request.args.get('q', '')  # Get the search query from the URL parameter
+    next_cursor = None
 
     if query:
-        # Perform search by title or content
-        posts = Post.query.filter(
-            (Post.title.ilike(f'%{query}%')) | (Post.content.ilike(f'%{query}%'))
-        ).all()
+        # Rank matching posts through the inverted index, then load just this page
+        post_ids, next_cursor = cached_search_posts(query, request.args.get('before'),
+                                                    current_app.config['SEARCH_RESULTS_PER_PAGE'])
+        rows = {row.id: row for row in post_rows().filter(Post.id.in_(post_ids))} if post_ids else {}
+        posts = [rows[post_id] for post_id in post_ids if post_id in rows]
     else:
         posts = []  # No query, return an empty list or you could return all posts
 
-    return render_template('community/search.html', posts=posts, query=query)
+    return render_template('community/search.html', posts=posts, query=query, next_cursor=next_cursor)
+
+
+# Route for the reward leaderboard page
+@community.route('/leaderboard')
+def leaderboard_page():
+    context = leaderboard_context(current_app.config['LEADERBOARD_SIZE'])
+    return render_template('community/leaderboard.html', **context)
+
+
+# Leaderboard API: top N users by points and the current user's rank
+@community.route('/api/leaderboard')
+def leaderboard_api():
+    limit = min(request.args.get('limit', 10, type=int), current_app.config['LEADERBOARD_SIZE'])
+    return jsonify(leaderboard_context(max(limit, 1)))
+
+
+# Merkle inclusion proof for one of the current user's reward ledger entries
+@community.route('/rewards/transactions/<int:transaction_id>/proof')
+@login_required
+def reward_transaction_proof(transaction_id):
+    transaction = RewardTransaction.query.filter_by(id=transaction_id, user_id=current_user.id).first_or_404()
+    proof = inclusion_proof(transaction)
+    if proof is None:
+        return jsonify({'error': 'This transaction has not been sealed into a checkpoint yet.'}), 409
+    return jsonify(proof)
+
+
+# Type-ahead suggestions for the search box, matching post titles and usernames by prefix
+@community.route('/search/suggest')
+def search_suggest():
+    query = request.args.get('q', '')
+    limit = min(request.args.get('limit', 10, type=int), 20)
+    return jsonify({'query': query, 'suggestions': suggest_index.lookup(query, limit)})
+
+
+# Route exposing hit/miss counters of the in-process caches, for sizing them
+@community.route('/cache/stats')
+@login_required
+def cache_stats():
+    return jsonify({'search': search_cache.stats(), 'users': user_cache.stats()})
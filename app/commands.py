@@ -0,0 +1,88 @@
+# app/commands.py
+import click
+from flask.cli import AppGroup
+
+# `flask search ...` maintenance commands
+search_cli = AppGroup('search', help='Manage the post search index.')
+
+
+@search_cli.command('reindex')
+@click.option('--batch-size', default=500, show_default=True, help='Posts indexed per commit.')
+def reindex(batch_size):
+    """Rebuild the search index from every post."""
+    from app.services.search_service import rebuild_index
+    count = rebuild_index(batch_size=batch_size)
+    click.echo(f'Indexed {count} posts.')
+
+
+# `flask rewards ...` ledger maintenance commands
+rewards_cli = AppGroup('rewards', help='Maintain the reward ledger.')
+
+
+@rewards_cli.command('snapshot')
+def snapshot():
+    """Fold new ledger entries into the stored reward balances."""
+    from app.services.reward_service import snapshot_balances
+    count = snapshot_balances()
+    click.echo(f'Updated {count} balances.')
+
+
+@rewards_cli.command('seal')
+def seal():
+    """Hash-chain new ledger entries and write Merkle checkpoints."""
+    from flask import current_app
+    from app.services.ledger_service import seal_ledger
+    count = seal_ledger(batch_size=current_app.config['LEDGER_CHECKPOINT_SIZE'],
+                        gap_timeout=current_app.config['LEDGER_GAP_TIMEOUT'])
+    click.echo(f'Wrote {count} checkpoints.')
+
+
+@rewards_cli.command('verify')
+@click.option('--chunk-size', default=10000, show_default=True, help='Ledger rows read per query.')
+def verify(chunk_size):
+    """Check the hash chain and Merkle checkpoints of the whole ledger."""
+    from app.services.ledger_service import verify_ledger
+    ok, message = verify_ledger(chunk_size=chunk_size)
+    click.echo(message)
+    if not ok:
+        raise SystemExit(1)
+
+
+# `flask counters ...` commands for the denormalized counters
+counters_cli = AppGroup('counters', help='Maintain denormalized counters.')
+
+
+@counters_cli.command('reconcile')
+@click.option('--batch-size', default=1000, show_default=True, help='Rows recomputed per statement.')
+def reconcile(batch_size):
+    """Recompute like, comment, follow and unread counters from their source rows."""
+    from app.services.counter_service import reconcile_counters
+    for table, count in reconcile_counters(batch_size=batch_size).items():
+        click.echo(f'Corrected {count} {table} rows.')
+
+
+# `flask users ...` account administration commands
+users_cli = AppGroup('users', help='Administer user accounts.')
+
+
+@users_cli.command('import')
+@click.argument('path', type=click.File('r', encoding='utf-8'))
+@click.option('--batch-size', default=1000, show_default=True, help='Users inserted per commit.')
+@click.option('--workers', type=int, default=None, help='Hashing processes (default: one per CPU).')
+def import_users(path, batch_size, workers):
+    """Create users from a CSV file with username, email and password columns.
+
+    Running servers pick the imported users up in their type-ahead
+    suggestions at the next SUGGEST_REFRESH_INTERVAL re-read.
+    """
+    import csv
+    from app.services.user_service import import_users as run_import
+    imported, skipped = run_import(csv.DictReader(path), batch_size=batch_size, workers=workers)
+    click.echo(f'Imported {imported} users, skipped {skipped}.')
+
+
+def register_commands(app):
+    app.cli.add_command(search_cli)
+    app.cli.add_command(rewards_cli)
+    app.cli.add_command(counters_cli)
+    app.cli.add_command(users_cli)
@@ -1,3 +1,4 @@
+from datetime import datetime
 from app import db
 
 class Notification(db.Model):
@@ -6,6 +7,17 @@ class Notification(db.Model):
     action = db.Column(db.String(50), nullable=False)
     target_id = db.Column(db.Integer, nullable=False)
     target_type = db.Column(db.String(50), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    actor_id = db.Column(db.Integer, db.ForeignKey('user.id'))  # Most recent user behind the event
+    actor_count = db.Column(db.Integer, nullable=False, default=1)  # Events coalesced into this row
+    is_read = db.Column(db.Boolean, nullable=False, default=False)
+    window_start = db.Column(db.DateTime, default=datetime.utcnow)  # When this group of events opened
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)  # Latest event in the group
 
-    user = db.relationship('User', backref='notifications', lazy=True)
+    user = db.relationship('User', foreign_keys=[user_id], backref='notifications', lazy=True)
+
+    __table_args__ = (
+        # Newest-first dashboard pages
+        db.Index('ix_notification_user_id_created_at', 'user_id', 'created_at'),
+        # Finding the open group to coalesce a new event into
+        db.Index('ix_notification_coalesce', 'user_id', 'action', 'target_type', 'target_id', 'window_start'),
+    )
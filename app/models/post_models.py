@@ -1,20 +1,54 @@
 # app/models/post_models.py
+from datetime import datetime
+from sqlalchemy.orm import validates
 from app import db  # Import db from the app module
 
+EXCERPT_LENGTH = 200  # Characters of the body shown in list views
+
+def make_excerpt(content):
+    """Return the preview of a post body that list views display."""
+    return (content or '')[:EXCERPT_LENGTH]
+
 class Post(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(150), nullable=False)
     content = db.Column(db.Text, nullable=False)
+    excerpt = db.Column(db.String(EXCERPT_LENGTH))  # Stored preview, so feeds never load the full body
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     is_flagged = db.Column(db.Boolean, default=False)  # Flag for moderation
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    like_count = db.Column(db.Integer, nullable=False, default=0)  # Denormalized from Like
+    comment_count = db.Column(db.Integer, nullable=False, default=0)  # Denormalized from Comment
 
     user = db.relationship('User', backref='posts', lazy=True)
 
+    # Newest posts of one author, read by the timeline merge
+    __table_args__ = (db.Index('ix_post_user_id_id', 'user_id', 'id'),)
+
+    # Keep the excerpt in step with the body whenever the content is written
+    @validates('content')
+    def update_excerpt(self, key, content):
+        self.excerpt = make_excerpt(content)
+        return content
+
 class Comment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.Text, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     post_id = db.Column(db.Integer, db.ForeignKey('post.id'))
+    parent_id = db.Column(db.Integer, db.ForeignKey('comment.id'))  # None for top-level comments
+    # Materialized path: the ids of all ancestors, root first, as fixed-width
+    # segments ("0000000012/0000000345/"), so a subtree is one path range
+    path = db.Column(db.String(255), nullable=False, default='')
+    depth = db.Column(db.Integer, nullable=False, default=0)  # Number of ancestors
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     user = db.relationship('User', backref='comments', lazy=True)
     post = db.relationship('Post', backref='comments', lazy=True)
+
+    __table_args__ = (
+        # A page of a post's top-level comments is one range scan
+        db.Index('ix_comment_post_id_id', 'post_id', 'id'),
+        # ...and so are all the replies below them
+        db.Index('ix_comment_post_id_path', 'post_id', 'path'),
+    )
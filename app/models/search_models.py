@@ -0,0 +1,26 @@
+# app/models/search_models.py
+from sqlalchemy.dialects import mysql
+from app import db
+
+# Inverted index over post titles and bodies, maintained by
+# app/services/search_service.py
+
+# Terms are compared byte for byte. Under MySQL's default case- and
+# accent-insensitive collation, distinct tokens such as "cafe" and "café"
+# would be the same primary key.
+TERM_TYPE = db.String(64).with_variant(mysql.VARCHAR(64, collation='utf8mb4_bin'), 'mysql')
+
+class SearchTerm(db.Model):
+    term = db.Column(TERM_TYPE, primary_key=True)
+    doc_freq = db.Column(db.Integer, nullable=False, default=0)  # Number of posts containing the term
+
+class SearchPosting(db.Model):
+    term = db.Column(TERM_TYPE, primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), primary_key=True, index=True)
+    term_freq = db.Column(db.Integer, nullable=False)
+    doc_length = db.Column(db.Integer, nullable=False)  # Copied here so ranking needs no join
+
+class SearchStats(db.Model):
+    id = db.Column(db.Integer, primary_key=True)  # Shard number; the totals are the sum of all rows
+    doc_count = db.Column(db.Integer, nullable=False, default=0)
+    total_length = db.Column(db.Integer, nullable=False, default=0)
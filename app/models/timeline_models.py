@@ -0,0 +1,15 @@
+# app/models/timeline_models.py
+from app import db
+
+# Materialized home timelines, filled by app/services/timeline_service.py when
+# a post is written (fan-out on write)
+
+class TimelineEntry(db.Model):
+    # The primary key doubles as the read index: a page of a timeline is one
+    # range scan over (user_id, post_id)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)  # Timeline owner
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), primary_key=True, index=True)
+    author_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+
+    # Dropping an author's posts from one timeline (unfollow)
+    __table_args__ = (db.Index('ix_timeline_entry_user_id_author_id', 'user_id', 'author_id'),)
@@ -1,7 +1,7 @@
 # Importing necessary modules from the app and werkzeug
 from app import db  # Importing the database instance from the app module
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash  # Functions for password hashing
+from app.utils.passwords import hash_password, verify_password  # Hashing with the configured method and cost
 
 # Define the User class as a model for the 'users' table in the database
 class User(db.Model):
@@ -10,19 +10,24 @@ class User(db.Model):
     username = db.Column(db.String(120), unique=True, nullable=False)  # Username must be unique and cannot be null
     email = db.Column(db.String(120), unique=True, nullable=False)  # Email must be unique and cannot be null
     password_hash = db.Column(db.String(128))  # Stores the hashed password, not the plain password
+    unread_notification_count = db.Column(db.Integer, nullable=False, default=0)  # Kept in step with Notification.is_read
+    fanout_on_read = db.Column(db.Boolean, nullable=False, default=False)  # Posts are merged into timelines on read
+    follower_count = db.Column(db.Integer, nullable=False, default=0)  # Denormalized from Follow
+    following_count = db.Column(db.Integer, nullable=False, default=0)  # Denormalized from Follow
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     # Relationship with Reward model
     rewards = db.relationship('Reward', backref='reward_owner', lazy=True)
 
     # Method to set the user's password (by hashing it before storing)
     def set_password(self, password):
-        # Use werkzeug's generate_password_hash function to securely hash the password
-        self.password_hash = generate_password_hash(password)
+        # Hash with PASSWORD_HASH_METHOD at the configured cost
+        self.password_hash = hash_password(password)
 
     # Method to check if a provided password matches the stored hash
     def check_password(self, password):
-        # Use werkzeug's check_password_hash function to compare the provided password with the stored hash
-        return check_password_hash(self.password_hash, password)
+        # Accepts bcrypt hashes and werkzeug's older pbkdf2 ones
+        return verify_password(self.password_hash, password)
 
     # Flask-Login required methods
     def is_authenticated(self):
@@ -56,6 +61,9 @@ class Like(db.Model):
     user = db.relationship('User', backref='likes', lazy=True)
     post = db.relationship('Post', backref='likes', lazy=True)
 
+    # One like per user and post; also serves "has this user liked the post?"
+    __table_args__ = (db.UniqueConstraint('user_id', 'post_id', name='uq_like_user_id_post_id'),)
+
 # Follow Model (User following another user)
 class Follow(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -66,14 +74,59 @@ class Follow(db.Model):
     follower = db.relationship('User', foreign_keys=[follower_id], backref='following', lazy=True)
     followed = db.relationship('User', foreign_keys=[followed_id], backref='followers', lazy=True)
 
+    __table_args__ = (
+        # One follow per pair; also serves "am I following X?" and unfollowing
+        db.UniqueConstraint('follower_id', 'followed_id', name='uq_follow_follower_id_followed_id'),
+        # Fan-out selects an author's followers
+        db.Index('ix_follow_followed_id', 'followed_id'),
+    )
+
 class Reward(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    points = db.Column(db.Integer, default=0)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, unique=True)  # One balance row per user
+    points = db.Column(db.Integer, default=0)  # Sum of the ledger entries folded in by snapshots
 
     user = db.relationship('User', backref=db.backref('user_rewards', lazy=True))
 
     def __repr__(self):
         return f"<Reward(user_id={self.user_id}, points={self.points})>"
 
+# Append-only ledger of every reward point change (the audit trail of the community currency)
+class RewardTransaction(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    delta = db.Column(db.Integer, nullable=False)  # Positive for rewards, negative for deductions
+    reason = db.Column(db.String(50), nullable=False)  # e.g. 'post', 'like', 'comment', 'follow'
+    source_type = db.Column(db.String(50))  # Table of the object that caused the change
+    source_id = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    entry_hash = db.Column(db.String(64))  # Hash chained to the previous entry, set when its batch is sealed
+    event_id = db.Column(db.String(32), unique=True)  # Set on buffered writes so a replayed journal can't apply twice
+    snapshot_id = db.Column(db.Integer, db.ForeignKey('reward_snapshot.id'))  # Snapshot that folded it into Reward.points
+
+    __table_args__ = (
+        db.Index('ix_reward_transaction_user_id_id', 'user_id', 'id'),
+        # Balance reads sum a user's entries no snapshot has folded in yet
+        db.Index('ix_reward_transaction_snapshot_id_user_id', 'snapshot_id', 'user_id'),
+    )
+
+    def __repr__(self):
+        return f"<RewardTransaction(user_id={self.user_id}, delta={self.delta}, reason={self.reason})>"
+
+# Merkle checkpoint over one sealed batch of consecutive ledger entries
+class LedgerCheckpoint(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    first_transaction_id = db.Column(db.Integer, nullable=False)
+    last_transaction_id = db.Column(db.Integer, nullable=False, unique=True)
+    size = db.Column(db.Integer, nullable=False)  # Number of entries in the batch
+    merkle_root = db.Column(db.String(64), nullable=False)
+    chain_hash = db.Column(db.String(64), nullable=False)  # entry_hash of the batch's last entry
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+# One row per run of the balance snapshot job
+class RewardSnapshot(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    last_transaction_id = db.Column(db.Integer, nullable=False)  # Highest ledger entry this snapshot folded in
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 
@@ -0,0 +1,166 @@
+# app/services/comment_service.py
+
+from app import db
+from app.models.post_models import Comment
+from app.models.user_models import User
+from app.utils.pagination import keyset_page_after
+
+# Comments form trees stored as materialized paths (see Comment.path). All
+# descendants of a comment share the path prefix made of its own path plus its
+# id, so the replies under a page of top-level comments, or under any single
+# comment, are one range scan over the (post_id, path) index. Ancestors sort
+# before their descendants, so the tree is assembled in one pass.
+
+_SEGMENT = '{:010d}/'
+_MAX_PATH_DEPTH = 23  # Segments that fit in Comment.path
+
+
+def reply_fields(parent):
+    """Column values that place a new comment under ``parent``."""
+    return {
+        'post_id': parent.post_id,
+        'parent_id': parent.id,
+        'path': parent.path + _SEGMENT.format(parent.id),
+        'depth': parent.depth + 1,
+    }
+
+
+def reply_target(parent, max_depth):
+    """The comment a reply to ``parent`` is attached to.
+
+    Threads are nested at most ``max_depth`` levels deep; replies below that
+    go next to ``parent`` instead of under it.
+    """
+    if parent.depth + 1 > min(max_depth, _MAX_PATH_DEPTH):
+        return Comment.query.get(parent.parent_id)
+    return parent
+
+
+def _prefix_range(first_prefix, last_prefix):
+    # Every path starting with a prefix from first_prefix to last_prefix; the
+    # upper bound is the last prefix with its trailing '/' bumped to '0'
+    return Comment.path >= first_prefix, Comment.path < last_prefix[:-1] + '0'
+
+
+def has_replies(comment):
+    prefix = comment.path + _SEGMENT.format(comment.id)
+    return db.session.query(
+        Comment.query.filter(Comment.post_id == comment.post_id, *_prefix_range(prefix, prefix)).exists()
+    ).scalar()
+
+
+_COLUMNS = (Comment.id, Comment.content, Comment.user_id, Comment.parent_id, Comment.path, Comment.depth,
+            Comment.created_at)
+
+
+def _node(row, usernames):
+    return {
+        'id': row.id,
+        'content': row.content,
+        'user_id': row.user_id,
+        'username': usernames.get(row.user_id),
+        'parent_id': row.parent_id,
+        'depth': row.depth,
+        'created_at': row.created_at.isoformat() if row.created_at else None,
+        'replies': [],
+        'more_replies': False,
+    }
+
+
+def _build_tree(post_id, tops, descendants, max_depth, cut=None):
+    # One pass in path order: every parent is placed before its replies.
+    # Replies one level below max_depth were only read to flag their parents.
+    user_ids = {row.user_id for row in tops + descendants if row.user_id}
+    usernames = dict(db.session.query(User.id, User.username).filter(User.id.in_(user_ids))) if user_ids else {}
+
+    rows = {row.id: row for row in tops}
+    nodes = {row.id: _node(row, usernames) for row in tops}
+    for row in descendants:
+        parent = nodes.get(row.parent_id)
+        if parent is None:
+            continue
+        if row.depth > max_depth:
+            parent['more_replies'] = True
+            continue
+        rows[row.id] = row
+        nodes[row.id] = _node(row, usernames)
+        parent['replies'].append(nodes[row.id])
+
+    if cut is not None:
+        # The replies were cut off at ``cut``: its parent has more, and so may
+        # every comment whose replies sort after it; ask which ones do
+        maybe = []
+        for comment_id, row in rows.items():
+            prefix = row.path + _SEGMENT.format(comment_id)
+            if prefix == cut.path:
+                nodes[comment_id]['more_replies'] = True
+            elif prefix > cut.path:
+                maybe.append(comment_id)
+        if maybe:
+            for parent_id, in (db.session.query(Comment.parent_id)
+                               .filter(Comment.post_id == post_id, Comment.parent_id.in_(maybe)).distinct()):
+                nodes[parent_id]['more_replies'] = True
+    return [nodes[row.id] for row in tops]
+
+
+def _replies_page(post_id, prefix, after, per_page, max_depth, reply_limit):
+    # A page of the comments directly under ``prefix`` ('' for top-level ones),
+    # with at most ``reply_limit`` replies below them, read in path order. When
+    # the replies run over, the page ends before the comment they ran into, so
+    # it comes whole on the next page; if that is the page's first comment, it
+    # is kept with the replies read so far and "continue this thread" on the
+    # flagged ones loads the rest.
+    children, next_cursor = keyset_page_after(
+        db.session.query(*_COLUMNS).filter(Comment.post_id == post_id, Comment.path == prefix),
+        Comment.id, after=after, per_page=per_page)
+    if not children:
+        return [], next_cursor
+    descendants = (db.session.query(*_COLUMNS)
+                   .filter(Comment.post_id == post_id, Comment.depth <= max_depth + 1,
+                           *_prefix_range(prefix + _SEGMENT.format(children[0].id),
+                                          prefix + _SEGMENT.format(children[-1].id)))
+                   .order_by(Comment.path, Comment.id)
+                   .limit(reply_limit + 1).all())
+    cut = None
+    if len(descendants) > reply_limit:
+        cut = descendants[reply_limit]
+        cut_child = int(cut.path[len(prefix):len(prefix) + 10])
+        descendants = descendants[:reply_limit]
+        if cut_child != children[0].id:
+            end = prefix + _SEGMENT.format(cut_child)
+            descendants = [row for row in descendants if row.path < end]
+            children = [row for row in children if row.id < cut_child]
+            next_cursor = children[-1].id
+            cut = None
+        elif len(children) > 1 or next_cursor is not None:
+            children = children[:1]
+            next_cursor = children[0].id
+    return _build_tree(post_id, children, descendants, max_depth, cut), next_cursor
+
+
+def comments_page(post_id, after=None, per_page=50, max_depth=5, reply_limit=500):
+    """One page of a post's comment tree, oldest top-level comment first.
+
+    Returns ``(comments, next_cursor)``. Each comment is a dict with its
+    ``replies`` nested down to ``max_depth``; comments whose replies were cut
+    off, by depth or by ``reply_limit``, have ``more_replies`` set. Each query
+    is a bounded range scan: the top-level comments, at most ``reply_limit +
+    1`` replies below them, their authors, and, when the replies were cut
+    off, which of the comments after the cut have replies.
+    """
+    return _replies_page(post_id, '', after, per_page, max_depth, reply_limit)
+
+
+def comment_thread(comment, after=None, per_page=50, max_depth=5, reply_limit=500):
+    """``comment`` with a page of its direct replies, each nested ``max_depth``
+    levels below it, bounded like ``comments_page``.
+
+    Returns ``(thread, next_cursor)``; the cursor pages through the direct
+    replies after the last one in ``thread['replies']``.
+    """
+    usernames = {comment.user_id: comment.user.username} if comment.user else {}
+    thread = _node(comment, usernames)
+    thread['replies'], next_cursor = _replies_page(
+        comment.post_id, comment.path + _SEGMENT.format(comment.id), after, per_page,
+        comment.depth + max_depth, reply_limit)
+    return thread, next_cursor
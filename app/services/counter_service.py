@@ -0,0 +1,49 @@
+# app/services/counter_service.py
+
+from sqlalchemy import func, or_, select
+from app import db
+from app.models.notification_models import Notification
+from app.models.post_models import Post, Comment
+from app.models.user_models import Follow, Like, User
+
+# Counters denormalized onto Post and User are kept current by relative
+# UPDATEs in the routes. reconcile_counters() recomputes them from the source
+# tables, for data written before a counter existed or after a manual fix.
+
+
+def adjust_post_count(post_id, column, delta):
+    """Add ``delta`` to one of a post's counters. The caller commits."""
+    Post.query.filter_by(id=post_id).update({column: column + delta}, synchronize_session=False)
+
+
+def _count(column, key):
+    return select(func.count()).where(column == key).scalar_subquery()
+
+
+def _reconcile(model, counters, batch_size):
+    # One correlated UPDATE per id range, touching only rows that are off
+    fixed = 0
+    last_id = db.session.query(func.max(model.id)).scalar() or 0
+    for start in range(0, last_id, batch_size):
+        fixed += model.query.filter(
+            model.id > start, model.id <= start + batch_size,
+            or_(*(column != expected for column, expected in counters.items())),
+        ).update(counters, synchronize_session=False)
+        db.session.commit()
+    return fixed
+
+
+def reconcile_counters(batch_size=1000):
+    """Recompute every denormalized counter. Returns ``{table: rows corrected}``."""
+    return {
+        'post': _reconcile(Post, {
+            Post.like_count: _count(Like.post_id, Post.id),
+            Post.comment_count: _count(Comment.post_id, Post.id),
+        }, batch_size),
+        'user': _reconcile(User, {
+            User.follower_count: _count(Follow.followed_id, User.id),
+            User.following_count: _count(Follow.follower_id, User.id),
+            User.unread_notification_count: select(func.count()).where(
+                Notification.user_id == User.id, Notification.is_read.is_(False)).scalar_subquery(),
+        }, batch_size),
+    }
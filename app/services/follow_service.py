@@ -0,0 +1,23 @@
+# app/services/follow_service.py
+
+from app import db
+from app.models.user_models import Follow, User
+
+# User.follower_count / User.following_count are denormalized from the Follow
+# table so profiles never count or load follow rows. They are changed with
+# relative UPDATEs in the same transaction as the Follow row itself.
+
+
+def is_following(follower_id, followed_id):
+    """Whether ``follower_id`` follows ``followed_id``: one indexed EXISTS query."""
+    return db.session.query(
+        Follow.query.filter_by(follower_id=follower_id, followed_id=followed_id).exists()
+    ).scalar()
+
+
+def adjust_follow_counts(follower_id, followed_id, delta):
+    """Add ``delta`` to both sides' counters. The caller commits."""
+    User.query.filter_by(id=followed_id).update(
+        {User.follower_count: User.follower_count + delta}, synchronize_session=False)
+    User.query.filter_by(id=follower_id).update(
+        {User.following_count: User.following_count + delta}, synchronize_session=False)
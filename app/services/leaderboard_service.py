@@ -0,0 +1,90 @@
+# app/services/leaderboard_service.py
+
+import threading
+from sqlalchemy import func
+from app import db
+from app.models.user_models import Reward, RewardTransaction
+from app.utils.sorted_list import SortedList
+
+
+class Leaderboard:
+    """In-process ranking of users by reward points.
+
+    Users are kept in a SortedList of ``(-points, user_id)`` keys, so the top
+    N is a prefix, a user's rank is a binary search, and a reward change
+    (``update``) only reorders one short sublist. Users with equal points
+    share the rank of the first of them, in ``top`` and ``rank`` alike.
+
+    Every worker keeps its own board. It applies its own reward changes at
+    once, and init_worker reloads it from the database every
+    ``LEADERBOARD_REFRESH_INTERVAL`` seconds, so other workers' changes show
+    up within that interval. The same reload corrects a change that raced
+    with the previous reload.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys = SortedList()
+        self._points = {}
+        self.loaded = False
+
+    def clear(self):
+        with self._lock:
+            self._keys = SortedList()
+            self._points = {}
+            self.loaded = False
+
+    def load(self, balances):
+        """Replace the ranking with ``(user_id, points)`` pairs."""
+        points = dict(balances)
+        with self._lock:
+            self._points = points
+            self._keys = SortedList((-p, user_id) for user_id, p in points.items())
+            self.loaded = True
+
+    def update(self, user_id, delta):
+        """Apply a change of ``delta`` points to a user's balance."""
+        with self._lock:
+            if not self.loaded:
+                return  # The next load reads the change from the database
+            old = self._points.get(user_id)
+            if old is not None:
+                self._keys.remove((-old, user_id))
+            new = (old or 0) + delta
+            self._points[user_id] = new
+            self._keys.add((-new, user_id))
+
+    def top(self, n):
+        """The ``n`` highest balances as ``(rank, user_id, points)``."""
+        entries = []
+        with self._lock:
+            for i, (neg, user_id) in enumerate(self._keys.head(n)):
+                if not entries or neg != -entries[-1][2]:
+                    rank = i + 1  # Position of the first user with these points
+                entries.append((rank, user_id, -neg))
+        return entries
+
+    def rank(self, user_id):
+        """``(rank, points)`` for a user, or None if they have no points yet."""
+        with self._lock:
+            points = self._points.get(user_id)
+            if points is None:
+                return None
+            return self._keys.bisect_left((-points,)) + 1, points
+
+    def __len__(self):
+        return len(self._keys)
+
+
+leaderboard = Leaderboard()
+
+
+def warm_leaderboard():
+    """Rebuild ``leaderboard`` from the Reward snapshots plus the ledger tails."""
+    balances = dict(db.session.query(Reward.user_id, Reward.points))
+    tails = (db.session.query(RewardTransaction.user_id, func.sum(RewardTransaction.delta))
+             .filter(RewardTransaction.snapshot_id.is_(None))
+             .group_by(RewardTransaction.user_id))
+    for user_id, delta in tails:
+        balances[user_id] = (balances.get(user_id) or 0) + delta
+    leaderboard.load((user_id, points or 0) for user_id, points in balances.items())
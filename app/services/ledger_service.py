@@ -0,0 +1,184 @@
+# app/services/ledger_service.py
+
+import hashlib
+from datetime import datetime, timedelta
+from app import db
+from app.models.user_models import RewardTransaction, LedgerCheckpoint
+
+# Tamper evidence for the reward ledger. Entries are appended without hashes
+# (so writers never wait on each other); seal_ledger() later chains them in id
+# order, entry_hash = H(previous entry_hash | entry), and stores a Merkle root
+# for every full batch of entries, so hashing is done once per batch.
+
+GENESIS_HASH = '0' * 64
+
+TRANSACTION_COLUMNS = (
+    RewardTransaction.id, RewardTransaction.user_id, RewardTransaction.delta,
+    RewardTransaction.reason, RewardTransaction.source_type, RewardTransaction.source_id,
+    RewardTransaction.created_at, RewardTransaction.entry_hash,
+)
+
+
+def chain_hash(prev_hash, tx):
+    """Hash of a ledger entry chained to the hash of the entry before it."""
+    fields = (tx.id, tx.user_id, tx.delta, tx.reason, tx.source_type or '', tx.source_id or '',
+              tx.created_at.isoformat() if tx.created_at else '')
+    payload = prev_hash + '|' + '|'.join(str(field) for field in fields)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _leaf(entry_hash):
+    return hashlib.sha256(b'\x00' + bytes.fromhex(entry_hash)).digest()
+
+
+def _node(left, right):
+    return hashlib.sha256(b'\x01' + left + right).digest()
+
+
+def _next_level(level):
+    # An odd node at the end is promoted unchanged rather than duplicated
+    return [_node(level[i], level[i + 1]) if i + 1 < len(level) else level[i]
+            for i in range(0, len(level), 2)]
+
+
+def merkle_root(entry_hashes):
+    """Merkle root (hex) over a batch of entry hashes."""
+    level = [_leaf(h) for h in entry_hashes]
+    while len(level) > 1:
+        level = _next_level(level)
+    return level[0].hex()
+
+
+def merkle_proof(entry_hashes, index):
+    """Sibling path from leaf ``index`` up to the root, as ``(side, hex hash)`` pairs."""
+    level = [_leaf(h) for h in entry_hashes]
+    path = []
+    while len(level) > 1:
+        sibling = index ^ 1
+        if sibling < len(level):
+            path.append(('left' if sibling < index else 'right', level[sibling].hex()))
+        level = _next_level(level)
+        index //= 2
+    return path
+
+
+def verify_proof(entry_hash, path, root):
+    """Check that ``entry_hash`` is included under ``root`` via ``path``."""
+    node = _leaf(entry_hash)
+    for side, sibling in path:
+        sibling = bytes.fromhex(sibling)
+        node = _node(sibling, node) if side == 'left' else _node(node, sibling)
+    return node.hex() == root
+
+
+def _iter_rows(query, column, chunk_size):
+    # Keyset-paginated scan that never holds more than one chunk in memory
+    last_id = 0
+    while True:
+        rows = query.filter(column > last_id).order_by(column).limit(chunk_size).all()
+        if not rows:
+            return
+        yield from rows
+        last_id = rows[-1].id
+
+
+def seal_ledger(batch_size=1024, gap_timeout=60):
+    """Chain and checkpoint every full batch of unsealed ledger entries.
+
+    Entries are sealed in id order up to a gap-free watermark. A missing id
+    belongs to a transaction that has not committed yet, so sealing stops
+    there rather than chaining past it and leaving it out for good. Once the
+    entries after a gap are older than ``gap_timeout`` seconds, the missing
+    ids are taken as rolled back and skipped. Returns the number of
+    checkpoints written.
+    """
+    last = LedgerCheckpoint.query.order_by(LedgerCheckpoint.last_transaction_id.desc()).first()
+    prev_hash = last.chain_hash if last else GENESIS_HASH
+    after_id = last.last_transaction_id if last else 0
+    cutoff = datetime.utcnow() - timedelta(seconds=gap_timeout)
+
+    sealed = 0
+    while True:
+        batch = (db.session.query(*TRANSACTION_COLUMNS)
+                 .filter(RewardTransaction.id > after_id)
+                 .order_by(RewardTransaction.id).limit(batch_size).all())
+        next_id = after_id + 1
+        for i, tx in enumerate(batch):
+            if tx.id != next_id and tx.created_at is not None and tx.created_at > cutoff:
+                batch = batch[:i]  # An earlier id may still commit: the watermark stops here
+                break
+            next_id = tx.id + 1
+        if len(batch) < batch_size:
+            return sealed
+
+        hashes = []
+        for tx in batch:
+            prev_hash = chain_hash(prev_hash, tx)
+            hashes.append(prev_hash)
+        db.session.bulk_update_mappings(RewardTransaction, [
+            {'id': tx.id, 'entry_hash': entry_hash} for tx, entry_hash in zip(batch, hashes)
+        ])
+        db.session.add(LedgerCheckpoint(
+            first_transaction_id=batch[0].id,
+            last_transaction_id=batch[-1].id,
+            size=len(batch),
+            merkle_root=merkle_root(hashes),
+            chain_hash=prev_hash,
+        ))
+        db.session.commit()
+        after_id = batch[-1].id
+        sealed += 1
+
+
+def verify_ledger(chunk_size=10000):
+    """Stream the sealed ledger and check every hash link and Merkle root.
+
+    Memory use is bounded by ``chunk_size`` plus one checkpoint batch.
+    Returns ``(ok, message)``.
+    """
+    checkpoints = _iter_rows(LedgerCheckpoint.query, LedgerCheckpoint.id, chunk_size)
+    transactions = _iter_rows(db.session.query(*TRANSACTION_COLUMNS), RewardTransaction.id, chunk_size)
+    prev_hash = GENESIS_HASH
+    verified = 0
+
+    for checkpoint in checkpoints:
+        batch = []
+        for tx in transactions:
+            expected = chain_hash(prev_hash, tx)
+            if tx.entry_hash != expected:
+                return False, f'Transaction {tx.id} does not match the hash chain.'
+            prev_hash = expected
+            batch.append(expected)
+            if tx.id >= checkpoint.last_transaction_id:
+                break
+        if (not batch or len(batch) != checkpoint.size
+                or batch[-1] != checkpoint.chain_hash
+                or merkle_root(batch) != checkpoint.merkle_root):
+            return False, f'Checkpoint {checkpoint.id} does not match its transactions.'
+        db.session.expunge(checkpoint)
+        verified += len(batch)
+
+    return True, f'Verified {verified} sealed transactions.'
+
+
+def inclusion_proof(transaction):
+    """Merkle inclusion proof for a sealed ledger entry, or None if it is not sealed yet."""
+    checkpoint = LedgerCheckpoint.query.filter(
+        LedgerCheckpoint.first_transaction_id <= transaction.id,
+        LedgerCheckpoint.last_transaction_id >= transaction.id,
+    ).first()
+    if checkpoint is None or transaction.entry_hash is None:
+        return None
+
+    batch = db.session.query(RewardTransaction.id, RewardTransaction.entry_hash).filter(
+        RewardTransaction.id.between(checkpoint.first_transaction_id, checkpoint.last_transaction_id)
+    ).order_by(RewardTransaction.id).all()
+    index = [tx_id for tx_id, _ in batch].index(transaction.id)
+    path = merkle_proof([entry_hash for _, entry_hash in batch], index)
+    return {
+        'transaction_id': transaction.id,
+        'entry_hash': transaction.entry_hash,
+        'checkpoint_id': checkpoint.id,
+        'merkle_root': checkpoint.merkle_root,
+        'path': [{'side': side, 'hash': h} for side, h in path],
+    }
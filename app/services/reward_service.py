@@ -1,29 +1,311 @@
 # app/services/reward_service.py
 
-from app.models.user_models import Reward
+import atexit
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from sqlalchemy import func
+from app.models.user_models import Reward, RewardTransaction, RewardSnapshot
 from app import db
+from app.services.leaderboard_service import leaderboard
+from app.utils.db_utils import insert_ignore, upsert_add
 
-def add_reward_points(user, points):
+# Every change of a user's points is appended to the RewardTransaction ledger.
+# Reward holds the sum of the entries that snapshots have folded in (marked
+# with their snapshot_id), so a balance is Reward.points plus the (short) tail
+# of the user's entries that are still unmarked.
+
+def _transaction_row(user, delta, reason, source):
+    return {
+        'user_id': user.id,
+        'delta': delta,
+        'reason': reason,
+        'source_type': source.__tablename__ if source is not None else None,
+        'source_id': source.id if source is not None else None,
+    }
+
+def _append_transaction(user, delta, reason, source):
+    db.session.add(RewardTransaction(**_transaction_row(user, delta, reason, source)))
+
+
+class RewardBuffer:
+    """Opt-in write-behind buffer for reward ledger entries (``REWARD_WRITE_BEHIND``).
+
+    Rewards are queued in process and a background thread writes everything
+    that is waiting with one multi-row INSERT and one commit, every
+    ``REWARD_FLUSH_INTERVAL_MS`` or as soon as ``REWARD_FLUSH_MAX_EVENTS`` are
+    queued, and once more at shutdown. ``REWARD_DURABILITY`` decides what a
+    crash can lose: with 'memory' the queued rewards, with 'journal' nothing
+    once the OS has the write, with 'fsync' nothing once the disk has it.
+
+    Every process journals to its own file in ``REWARD_JOURNAL_DIR`` and holds
+    an exclusive lock on a companion ``.lock`` file while it runs. On start, a
+    process adopts the journals whose lock it can take, i.e. those of workers
+    that died without flushing: their entries are copied into its own journal
+    and queued. Each entry carries an event_id, so entries that were committed
+    just before a crash are not applied twice.
+
+    Only serving processes buffer: ``init_app`` reads the configuration and
+    ``start`` (called by init_worker) opens the journal and starts the
+    thread, so `flask` commands and pre-fork masters write rewards directly.
+    Queued points are visible only to the process that queued them. Other
+    workers' balance reads miss them until the next flush, at most
+    ``REWARD_FLUSH_INTERVAL_MS`` later, which is why deduct_reward_points
+    re-checks a short balance after that long before refusing.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._journal = None
+        self._journal_lock = None
+        self._pending = []
+        self._pending_points = defaultdict(int)  # user_id -> points queued but not written yet
+        atexit.register(self.shutdown)
+
+    def init_app(self, app):
+        self.shutdown()
+        self.app = app
+        self.enabled = app.config['REWARD_WRITE_BEHIND']
+        self.flush_interval = app.config['REWARD_FLUSH_INTERVAL_MS'] / 1000
+        self.max_events = app.config['REWARD_FLUSH_MAX_EVENTS']
+        self.durability = app.config['REWARD_DURABILITY']
+        self.journal_dir = app.config['REWARD_JOURNAL_DIR']
+        self._pending = []
+        self._pending_points = defaultdict(int)
+
+    def start(self):
+        """Start buffering in this process, if ``REWARD_WRITE_BEHIND`` is on."""
+        if not self.enabled or self._thread is not None:
+            return
+        if self.durability != 'memory':
+            self._open_journal()
+            self._adopt_orphaned_journals()
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='reward-write-behind', daemon=True)
+        self._thread.start()
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def _open_journal(self):
+        # The lock is taken before the journal exists, so no other process
+        # can mistake the new journal for an orphan
+        os.makedirs(self.journal_dir, exist_ok=True)
+        name = os.path.join(self.journal_dir, f'{os.getpid()}-{uuid.uuid4().hex[:8]}')
+        self._journal_lock = open(name + '.lock', 'w')
+        fcntl.flock(self._journal_lock, fcntl.LOCK_EX)
+        self.journal_path = name + '.jsonl'
+        self._journal = open(self.journal_path, 'a', encoding='utf-8')
+
+    def _adopt_orphaned_journals(self):
+        for lock_path in glob.glob(os.path.join(self.journal_dir, '*.lock')):
+            journal_path = lock_path[:-len('.lock')] + '.jsonl'
+            if journal_path == self.journal_path:
+                continue
+            try:
+                lock = open(lock_path, 'r')
+            except FileNotFoundError:
+                continue  # Adopted by another process meanwhile
+            with lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue  # Its process is alive
+                if not os.path.exists(journal_path):
+                    continue
+                with open(journal_path, encoding='utf-8') as orphan:
+                    # A line without its newline was torn by the crash and never acknowledged
+                    rows = [json.loads(line) for line in orphan if line.endswith('\n') and line.strip()]
+                for row in rows:
+                    self._write_journal(row)
+                    self._queue(row)
+                os.remove(journal_path)
+                if os.path.exists(journal_path + '.tmp'):
+                    os.remove(journal_path + '.tmp')  # Left by a truncation the crash interrupted
+                os.remove(lock_path)
+
+    def _write_journal(self, row):
+        self._journal.write(json.dumps(row) + '\n')
+        self._journal.flush()
+        if self.durability == 'fsync':
+            os.fsync(self._journal.fileno())
+
+    def _queue(self, row):
+        self._pending.append(row)
+        self._pending_points[row['user_id']] += row['delta']
+
+    def add(self, row):
+        """Queue one ledger row for the next flush."""
+        row = dict(row, event_id=uuid.uuid4().hex)
+        with self._lock:
+            if self._journal is not None:
+                self._write_journal(row)
+            self._queue(row)
+            full = len(self._pending) >= self.max_events
+        if full:
+            self._wakeup.set()
+
+    def pending_points(self, user_id):
+        """Points queued for ``user_id`` that are not in the database yet."""
+        with self._lock:
+            return self._pending_points.get(user_id, 0)
+
+    def flush(self):
+        """Write every queued row in one INSERT and commit. Returns the number of rows."""
+        with self._flush_lock:
+            with self._lock:
+                rows, self._pending = self._pending, []
+                journal_offset = self._journal.tell() if self._journal is not None else None
+                # Stop counting the rows as pending before they are committed, so a
+                # balance read in between can come out low but never counts them twice
+                self._pending_points = defaultdict(int)
+            if not rows:
+                return 0
+
+            with self.app.app_context():
+                try:
+                    insert_ignore(RewardTransaction, rows)
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    with self._lock:
+                        self._pending[:0] = rows
+                        for row in rows:
+                            self._pending_points[row['user_id']] += row['delta']
+                    self.app.logger.exception('Flushing %d buffered rewards failed; will retry', len(rows))
+                    return 0
+                finally:
+                    db.session.remove()
+
+            if self._journal is not None:
+                with self._lock:
+                    self._truncate_journal(journal_offset)
+            return len(rows)
+
+    def _truncate_journal(self, offset):
+        # Keep only the entries queued while the flush was running. Only this
+        # process writes the file, and its lock lives in the separate .lock
+        # file, so replacing the journal is safe.
+        self._journal.close()
+        with open(self.journal_path, encoding='utf-8') as journal:
+            journal.seek(offset)
+            remaining = journal.read()
+        tmp_path = self.journal_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as tmp:
+            tmp.write(remaining)
+            tmp.flush()
+            os.fsync(tmp.fileno())
+        os.replace(tmp_path, self.journal_path)
+        self._journal = open(self.journal_path, 'a', encoding='utf-8')
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def shutdown(self):
+        """Stop the flush thread and write whatever is still queued."""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._wakeup.set()
+        self._thread.join()
+        self._thread = None
+        self.flush()
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+            if not self._pending:
+                # Nothing left to replay; otherwise the next process adopts the file
+                os.remove(self.journal_path)
+                os.remove(self._journal_lock.name)
+            self._journal_lock.close()
+            self._journal_lock = None
+
+
+reward_buffer = RewardBuffer()
+
+def _ledger_tail(user_id):
+    return db.session.query(func.coalesce(func.sum(RewardTransaction.delta), 0)).filter(
+        RewardTransaction.snapshot_id.is_(None), RewardTransaction.user_id == user_id).scalar()
+
+def add_reward_points(user, points, reason='reward', source=None):
     """Add reward points to a user."""
-    reward = Reward.query.filter_by(user_id=user.id).first()
-    if reward:
-        reward.points += points
+    if reward_buffer.running:
+        reward_buffer.add(_transaction_row(user, points, reason, source))
     else:
-        reward = Reward(user_id=user.id, points=points)
-        db.session.add(reward)
-    db.session.commit()
+        # A plain INSERT into the ledger, so busy users never contend on one row
+        _append_transaction(user, points, reason, source)
+        db.session.commit()
+    leaderboard.update(user.id, points)
 
-def deduct_reward_points(user, points):
+def deduct_reward_points(user, points, reason='deduction', source=None):
     """Deduct reward points from a user."""
-    reward = Reward.query.filter_by(user_id=user.id).first()
-    if reward and reward.points >= points:
-        reward.points -= points
-        db.session.commit()
-    else:
-        return False  # Insufficient points
+    for attempt in range(2):
+        # Deductions lock the user's balance row so two of them can't both spend the same points
+        upsert_add(Reward, [{'user_id': user.id, 'points': 0}], ['user_id'], ['points'])
+        reward = Reward.query.filter_by(user_id=user.id).with_for_update().one()
+        balance = reward.points + _ledger_tail(user.id) + reward_buffer.pending_points(user.id)
+        if balance >= points:
+            break
+        db.session.rollback()
+        if attempt or not reward_buffer.enabled:
+            return False  # Insufficient points
+        # Other workers may hold points for this user that they have not
+        # flushed yet; by two flush intervals from now they all have
+        time.sleep(2 * reward_buffer.flush_interval)
+    _append_transaction(user, -points, reason, source)
+    db.session.commit()
+    leaderboard.update(user.id, -points)
     return True
 
 def get_user_rewards(user):
     """Retrieve the user's total reward points."""
     reward = Reward.query.filter_by(user_id=user.id).first()
-    return reward.points if reward else 0
+    pending = reward_buffer.pending_points(user.id)
+    return (reward.points if reward else 0) + _ledger_tail(user.id) + pending
+
+def snapshot_balances(batch_size=1000):
+    """Fold the ledger entries no snapshot has folded yet into Reward balances.
+
+    Runs are serialized by a lock on the latest snapshot row. Each run marks
+    the entries it folds with its snapshot id in one UPDATE ... WHERE
+    snapshot_id IS NULL and then sums exactly the entries it marked, so an
+    entry that commits late is folded by the next run, whatever its id, and
+    no entry is ever counted twice. Returns the number of users whose
+    balance changed.
+    """
+    db.session.query(RewardSnapshot.id).order_by(RewardSnapshot.id.desc()).limit(1).with_for_update().all()
+    snapshot = RewardSnapshot(last_transaction_id=0)
+    db.session.add(snapshot)
+    db.session.flush()
+    marked = RewardTransaction.query.filter(RewardTransaction.snapshot_id.is_(None)).update(
+        {RewardTransaction.snapshot_id: snapshot.id}, synchronize_session=False)
+    if not marked:
+        db.session.rollback()
+        return 0
+
+    folded = RewardTransaction.snapshot_id == snapshot.id
+    totals = db.session.query(RewardTransaction.user_id, func.sum(RewardTransaction.delta)).filter(
+        folded).group_by(RewardTransaction.user_id).all()
+    for i in range(0, len(totals), batch_size):
+        upsert_add(Reward, [
+            {'user_id': user_id, 'points': total}
+            for user_id, total in totals[i:i + batch_size]
+        ], ['user_id'], ['points'])
+    snapshot.last_transaction_id = db.session.query(func.max(RewardTransaction.id)).filter(folded).scalar()
+    db.session.commit()
+    return len(totals)
@@ -0,0 +1,168 @@
+# app/services/search_service.py
+
+import math
+import re
+from collections import Counter
+from sqlalchemy import and_, case, func, or_
+from app import db
+from app.models.post_models import Post
+from app.models.search_models import SearchTerm, SearchPosting, SearchStats
+from app.utils.cache import TTLCache
+from app.utils.db_utils import upsert_add
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+TITLE_BOOST = 2  # Title tokens count this many times towards the term frequency
+MAX_TERM_LENGTH = 64
+
+# The collection statistics are spread over this many SearchStats rows, picked
+# by post id, so concurrent post writes don't all queue on one row lock.
+# Readers sum the rows.
+STATS_SHARDS = 16
+
+# Han, kana and hangul runs are split into overlapping bigrams; everything else
+# is split into lowercase words of letters and digits
+CJK_CHARS = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff'
+TOKEN_RE = re.compile(f'([{CJK_CHARS}]+)|([^\\W_{CJK_CHARS}]+)')
+
+# Ranked id lists keyed by normalized query and cursor. Routes call
+# search_cache.bump() after every post write, which invalidates all entries.
+search_cache = TTLCache()
+
+
+def tokenize(text):
+    """Split text into index terms: words for alphabetic scripts, bigrams for CJK."""
+    tokens = []
+    for cjk, word in TOKEN_RE.findall((text or '').lower()):
+        if word:
+            tokens.append(word[:MAX_TERM_LENGTH])
+        elif len(cjk) == 1:
+            tokens.append(cjk)
+        else:
+            tokens.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+    return tokens
+
+
+def _stats_shard(post_id):
+    return post_id % STATS_SHARDS + 1
+
+
+def remove_post(post_id):
+    """Drop a post's postings and take it out of the collection statistics."""
+    postings = db.session.query(SearchPosting.term, SearchPosting.doc_length).filter_by(post_id=post_id).all()
+    if not postings:
+        return
+    terms = [term for term, _ in postings]
+    SearchTerm.query.filter(SearchTerm.term.in_(terms)).update(
+        {SearchTerm.doc_freq: SearchTerm.doc_freq - 1}, synchronize_session=False)
+    SearchStats.query.filter_by(id=_stats_shard(post_id)).update({
+        SearchStats.doc_count: SearchStats.doc_count - 1,
+        SearchStats.total_length: SearchStats.total_length - postings[0].doc_length,
+    }, synchronize_session=False)
+    SearchPosting.query.filter_by(post_id=post_id).delete(synchronize_session=False)
+
+
+def index_post(post):
+    """(Re)build a post's postings. The caller commits; the post must have an id."""
+    remove_post(post.id)
+    counts = Counter(tokenize(post.title) * TITLE_BOOST + tokenize(post.content))
+    if not counts:
+        return
+    doc_length = sum(counts.values())
+
+    db.session.bulk_insert_mappings(SearchPosting, [
+        {'term': term, 'post_id': post.id, 'term_freq': tf, 'doc_length': doc_length}
+        for term, tf in counts.items()
+    ])
+    upsert_add(SearchTerm, [{'term': term, 'doc_freq': 1} for term in counts], ['term'], ['doc_freq'])
+    upsert_add(SearchStats, [{'id': _stats_shard(post.id), 'doc_count': 1, 'total_length': doc_length}],
+               ['id'], ['doc_count', 'total_length'])
+
+
+def search_posts(query, before=None, per_page=20):
+    """Rank posts matching ``query`` with BM25.
+
+    Returns ``(post_ids, next_cursor)`` for one page, best match first. The
+    cursor is "<score>_<post id>" of the last result; pass it back as
+    ``before`` for the next page, which then starts just below it instead of
+    skipping an OFFSET. The scoring is a single grouped query over the
+    postings of the query terms, so its cost depends on how common the terms
+    are, not on the number of posts.
+    """
+    terms = set(tokenize(query))
+    doc_count, total_length = db.session.query(
+        func.sum(SearchStats.doc_count), func.sum(SearchStats.total_length)).one()
+    if not terms or not doc_count or doc_count <= 0:
+        return [], None
+
+    doc_freqs = db.session.query(SearchTerm.term, SearchTerm.doc_freq).filter(
+        SearchTerm.term.in_(terms), SearchTerm.doc_freq > 0)
+    idf = {
+        term: math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+        for term, df in doc_freqs
+    }
+    if not idf:
+        return [], None
+
+    avg_length = total_length / doc_count
+    tf = SearchPosting.term_freq
+    score = func.sum(
+        case(idf, value=SearchPosting.term) * tf * (K1 + 1)
+        / (tf + K1 * (1 - B + B * SearchPosting.doc_length / avg_length))
+    )
+
+    rows = (db.session.query(SearchPosting.post_id, score.label('score'))
+            .filter(SearchPosting.term.in_(idf))
+            .group_by(SearchPosting.post_id))
+    try:
+        before_score, before_id = before.rsplit('_', 1)
+        before_score, before_id = float(before_score), int(before_id)
+    except (AttributeError, ValueError):
+        before = None  # Missing or malformed cursor: start from the best match
+    if before:
+        rows = rows.having(or_(score < before_score,
+                               and_(score == before_score, SearchPosting.post_id < before_id)))
+    rows = rows.order_by(score.desc(), SearchPosting.post_id.desc()).limit(per_page + 1).all()
+
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = f'{rows[-1].score!r}_{rows[-1].post_id}'
+    return [row.post_id for row in rows], next_cursor
+
+
+def cached_search_posts(query, before=None, per_page=20):
+    """``search_posts`` with results memoized in ``search_cache``."""
+    # Queries with the same set of terms rank identically, so share one entry
+    key = (' '.join(sorted(set(tokenize(query)))), before, per_page)
+    result = search_cache.get(key)
+    if result is None:
+        token = search_cache.token(key)
+        result = search_posts(query, before, per_page)
+        search_cache.set(key, result, token)
+    return result
+
+
+def rebuild_index(batch_size=500):
+    """Rebuild the whole index from the post table, one batch at a time."""
+    SearchPosting.query.delete()
+    SearchTerm.query.delete()
+    SearchStats.query.delete()
+    db.session.commit()
+
+    indexed = 0
+    last_id = 0
+    while True:
+        posts = Post.query.filter(Post.id > last_id).order_by(Post.id).limit(batch_size).all()
+        if not posts:
+            break
+        for post in posts:
+            index_post(post)
+        indexed += len(posts)
+        last_id = posts[-1].id
+        db.session.commit()
+        db.session.expunge_all()
+    search_cache.bump()
+    return indexed
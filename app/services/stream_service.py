@@ -0,0 +1,214 @@
+# app/services/stream_service.py
+
+import json
+import queue
+import threading
+import time
+from collections import defaultdict
+from app.utils.periodic import run_periodically
+
+_CLOSE = object()
+
+
+class StreamLimitReached(Exception):
+    """Raised when a worker already serves ``NOTIFICATION_STREAM_MAX`` streams."""
+
+
+class NotificationBroker:
+    """Pub/sub that feeds the notification event streams.
+
+    Every open stream owns a bounded queue of ``NOTIFICATION_STREAM_BUFFER``
+    events. Publishing never blocks: when a slow client's queue is full, its
+    oldest event is dropped. Each event carries the user's current unread
+    count, so a client that missed events still ends up showing the right
+    badge. Without a relay, events only reach streams held by the process
+    that wrote them. With one (RedisRelay), every event goes through the
+    relay to all started brokers, and each delivers it to the streams it
+    holds, so a stream sees events written by any worker.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+        self._count = 0
+        self.relay = None
+        self._presence = None
+        self.configure()
+
+    def init_app(self, app):
+        backend = app.config['NOTIFICATION_STREAM_BACKEND']
+        heartbeat = app.config['NOTIFICATION_STREAM_HEARTBEAT']
+        if backend == 'memory':
+            relay = None
+        elif backend == 'redis':
+            relay = RedisRelay(app.config['NOTIFICATION_STREAM_REDIS_URL'], ttl=3 * heartbeat)
+        else:
+            relay = backend  # Any object with the RedisRelay methods
+        self.configure(app.config['NOTIFICATION_STREAM_MAX'], app.config['NOTIFICATION_STREAM_BUFFER'],
+                       heartbeat, relay)
+
+    def configure(self, max_streams=100, buffer_size=20, heartbeat=15, relay=None):
+        """Set the limits and relay, and close every open stream."""
+        self.close_all()
+        self.stop()
+        self.max_streams = max_streams
+        self.buffer_size = buffer_size
+        self.heartbeat = heartbeat
+        self.relay = relay
+
+    def start(self, app):
+        """Receive the relay's events and keep this worker's listeners visible
+        to the others. Only serving processes call this (see init_worker)."""
+        if self.relay is None or self._presence is not None:
+            return
+        self.relay.start(self._deliver)
+        self._presence = run_periodically(app, self.heartbeat, self._touch, 'stream-presence')
+
+    def stop(self):
+        if self._presence is not None:
+            self._presence.set()
+            self._presence = None
+            self.relay.stop()
+
+    def _touch(self):
+        with self._lock:
+            user_ids = set(self._subscribers)
+        if user_ids:
+            self.relay.touch(user_ids)
+
+    def subscribe(self, user_id):
+        """Open a stream for ``user_id`` and return its queue."""
+        events = queue.Queue(maxsize=self.buffer_size)
+        with self._lock:
+            if self._count >= self.max_streams:
+                raise StreamLimitReached()
+            self._subscribers[user_id].add(events)
+            self._count += 1
+        if self.relay is not None:
+            self.relay.touch({user_id})
+        return events
+
+    def unsubscribe(self, user_id, events):
+        with self._lock:
+            streams = self._subscribers.get(user_id)
+            if streams is None or events not in streams:
+                return
+            streams.discard(events)
+            if not streams:
+                del self._subscribers[user_id]
+            self._count -= 1
+
+    def has_subscribers(self, user_ids):
+        """The subset of ``user_ids`` with at least one open stream, here or
+        (with a relay) on any worker."""
+        with self._lock:
+            listening = {user_id for user_id in user_ids if user_id in self._subscribers}
+        if self.relay is not None and len(listening) < len(user_ids):
+            listening |= self.relay.listening(set(user_ids) - listening)
+        return listening
+
+    def publish(self, user_id, event):
+        if self.relay is None:
+            self._deliver(user_id, event)
+        else:
+            self.relay.publish(user_id, event)
+
+    def _deliver(self, user_id, event):
+        with self._lock:
+            streams = list(self._subscribers.get(user_id, ()))
+        for events in streams:
+            self._put(events, event)
+
+    @staticmethod
+    def _put(events, event):
+        while True:
+            try:
+                events.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    events.get_nowait()  # Drop the oldest event for this slow client
+                except queue.Empty:
+                    pass
+
+    def close_all(self):
+        """End every open stream (used at shutdown and by ``configure``)."""
+        with self._lock:
+            streams = [events for user_streams in self._subscribers.values() for events in user_streams]
+            self._subscribers = defaultdict(set)
+            self._count = 0
+        for events in streams:
+            self._put(events, _CLOSE)
+
+    def stream(self, user_id, events):
+        """Yield a subscriber's events as Server-Sent Events until the client goes away."""
+        try:
+            yield f'retry: {self.heartbeat * 1000}\n\n'
+            while True:
+                try:
+                    event = events.get(timeout=self.heartbeat)
+                except queue.Empty:
+                    # Keeps proxies from timing the connection out, and fails
+                    # the write (ending the generator) once the client is gone
+                    yield ': heartbeat\n\n'
+                    continue
+                if event is _CLOSE:
+                    return
+                yield f'event: notification\ndata: {json.dumps(event)}\n\n'
+        finally:
+            self.unsubscribe(user_id, events)
+
+    def stats(self):
+        with self._lock:
+            return {'streams': self._count, 'users': len(self._subscribers), 'max_streams': self.max_streams}
+
+
+class RedisRelay:
+    """Fans notification events out to every worker over Redis pub/sub.
+
+    All workers subscribe to one channel and keep the events for the streams
+    they hold. A user counts as listening while some worker has refreshed
+    their presence key in the last ``ttl`` seconds, so writers on other
+    workers know to publish. Needs the ``redis`` package.
+    """
+
+    def __init__(self, url, ttl, prefix='notifications:'):
+        import redis  # Only needed when this backend is configured
+        self.ttl = ttl
+        self.channel = prefix + 'events'
+        self.presence_prefix = prefix + 'listening:'
+        self._client = redis.Redis.from_url(url)
+        self._thread = None
+
+    def start(self, deliver):
+        def on_message(message):
+            payload = json.loads(message['data'])
+            deliver(payload['user_id'], payload['event'])
+
+        pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{self.channel: on_message})
+        # After a lost connection, wait a moment and let the next read reconnect
+        self._thread = pubsub.run_in_thread(sleep_time=1, daemon=True,
+                                            exception_handler=lambda error, pubsub, thread: time.sleep(1))
+
+    def stop(self):
+        if self._thread is not None:
+            self._thread.stop()
+            self._thread = None
+
+    def publish(self, user_id, event):
+        self._client.publish(self.channel, json.dumps({'user_id': user_id, 'event': event}))
+
+    def touch(self, user_ids):
+        pipe = self._client.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.set(f'{self.presence_prefix}{user_id}', 1, ex=self.ttl)
+        pipe.execute()
+
+    def listening(self, user_ids):
+        user_ids = list(user_ids)
+        flags = self._client.mget([f'{self.presence_prefix}{user_id}' for user_id in user_ids])
+        return {user_id for user_id, flag in zip(user_ids, flags) if flag}
+
+
+notification_broker = NotificationBroker()
@@ -0,0 +1,107 @@
+# app/services/suggest_service.py
+
+import threading
+from app import db
+from app.models.post_models import Post
+from app.models.user_models import User
+from app.utils.sorted_list import SortedList
+
+
+def normalize(text):
+    """Key used for prefix matching: case-folded with surrounding spaces removed."""
+    return (text or '').strip().casefold()
+
+
+class PrefixIndex:
+    """In-memory type-ahead index over post titles and usernames.
+
+    Entries are ``(key, kind, id, label)`` tuples in a SortedList, so a prefix
+    lookup is a binary search followed by a short forward scan, and an
+    incremental update only shifts one short sublist.
+
+    ``load`` reads its entries without holding the lock, and every add or
+    removal made meanwhile is replayed onto the new contents before they
+    replace the old ones, so a reload never loses a concurrent change.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._entries = SortedList()
+        self._replay = None  # Changes made while a load is reading, or None
+        self.loaded = False
+
+    def clear(self):
+        with self._lock:
+            self._entries = SortedList()
+            self.loaded = False
+
+    def load(self, entries):
+        """Replace the contents with ``(kind, id, label)`` entries."""
+        with self._load_lock:
+            with self._lock:
+                self._replay = []
+            try:
+                new = SortedList((normalize(label), kind, ident, label) for kind, ident, label in entries if label)
+            except BaseException:
+                with self._lock:
+                    self._replay = None
+                raise
+            with self._lock:
+                for adding, entry in self._replay:
+                    self._apply(new, adding, entry)
+                self._replay = None
+                self._entries = new
+                self.loaded = True
+
+    @staticmethod
+    def _apply(entries, adding, entry):
+        if adding:
+            if entry not in entries:
+                entries.add(entry)
+        else:
+            entries.discard(entry)
+
+    def _change(self, adding, entry):
+        with self._lock:
+            self._apply(self._entries, adding, entry)
+            if self._replay is not None:
+                self._replay.append((adding, entry))
+
+    def add(self, kind, ident, label):
+        if label:
+            self._change(True, (normalize(label), kind, ident, label))
+
+    def remove(self, kind, ident, label):
+        self._change(False, (normalize(label), kind, ident, label))
+
+    def lookup(self, prefix, limit=10):
+        """Return up to ``limit`` distinct entries whose label starts with ``prefix``."""
+        key = normalize(prefix)
+        if not key:
+            return []
+        results, seen = [], set()
+        with self._lock:
+            for entry_key, kind, ident, label in self._entries.iter_from((key,)):
+                if len(results) >= limit or not entry_key.startswith(key):
+                    break
+                if (kind, entry_key) not in seen:
+                    seen.add((kind, entry_key))
+                    results.append({'type': kind, 'id': ident, 'label': label})
+        return results
+
+    def __len__(self):
+        return len(self._entries)
+
+
+suggest_index = PrefixIndex()
+
+
+def warm_suggest_index(batch_size=10000):
+    """Load every post title and username into ``suggest_index``."""
+    def entries():
+        for post_id, title in db.session.query(Post.id, Post.title).yield_per(batch_size):
+            yield 'post', post_id, title
+        for user_id, username in db.session.query(User.id, User.username).yield_per(batch_size):
+            yield 'user', user_id, username
+    suggest_index.load(entries())
@@ -0,0 +1,146 @@
+# app/services/timeline_service.py
+
+import heapq
+from itertools import islice
+from flask import current_app
+from sqlalchemy import literal, select, union_all
+from app import db
+from app.models.post_models import Post
+from app.models.timeline_models import TimelineEntry
+from app.models.user_models import Follow, User
+from app.utils.cache import TTLCache
+from app.utils.db_utils import insert_ignore_from_select
+from app.utils.pagination import keyset_page
+
+# Home timelines are materialized when a post is written: its id is copied into
+# the TimelineEntry rows of the author and every follower, so reading a page is
+# one range scan over the timeline's primary key. Authors with more than
+# TIMELINE_FANOUT_LIMIT followers would make every post write that many rows;
+# they are switched to fan-out on read instead, and their posts are merged
+# into followers' timelines when a page is read. The switch is sticky, so an
+# author whose follower count drops again never leaves a gap of unmaterialized
+# posts behind. Fan-out and follow backfill can write the same entry at the
+# same moment, so both skip entries that already exist.
+
+_TIMELINE_COLUMNS = [TimelineEntry.user_id, TimelineEntry.post_id, TimelineEntry.author_id]
+_MERGE_BATCH = 100  # Authors read per UNION ALL statement
+
+# The fan-out-on-read authors each user follows, so a timeline read doesn't
+# join Follow to User every time. Follow and unfollow invalidate the user's
+# entry and an author's switch bumps the whole cache, after committing; other
+# workers see the change once their entry expires (TIMELINE_PULL_CACHE_TTL).
+pulled_cache = TTLCache()
+
+
+def fan_out_post(post):
+    """Add a new post to its author's timeline and, unless the author is too
+    widely followed, to every follower's. The caller commits.
+
+    Returns True when this post switched the author to fan-out on read; the
+    caller then bumps ``pulled_cache`` once the switch is committed.
+    """
+    author_id = post.user_id
+    db.session.execute(TimelineEntry.__table__.insert().values(
+        user_id=author_id, post_id=post.id, author_id=author_id))
+
+    fanout_on_read, follower_count = db.session.query(
+        User.fanout_on_read, User.follower_count).filter_by(id=author_id).one()
+    if not fanout_on_read and follower_count > current_app.config['TIMELINE_FANOUT_LIMIT']:
+        User.query.filter_by(id=author_id).update({User.fanout_on_read: True}, synchronize_session=False)
+        return True
+    if fanout_on_read:
+        return False
+
+    followers = select(Follow.follower_id, literal(post.id), literal(author_id)).where(
+        Follow.followed_id == author_id, Follow.follower_id != author_id).distinct()
+    insert_ignore_from_select(TimelineEntry, _TIMELINE_COLUMNS, followers)
+    return False
+
+
+def backfill_follow(follower_id, author_id):
+    """Copy the latest TIMELINE_BACKFILL posts of a newly followed author into
+    the follower's timeline. The caller commits."""
+    if follower_id == author_id or db.session.query(User.fanout_on_read).filter_by(id=author_id).scalar():
+        return
+    latest = (select(literal(follower_id), Post.id, literal(author_id))
+              .where(Post.user_id == author_id)
+              .order_by(Post.id.desc())
+              .limit(current_app.config['TIMELINE_BACKFILL']))
+    insert_ignore_from_select(TimelineEntry, _TIMELINE_COLUMNS, latest)
+
+
+def remove_author(user_id, author_id):
+    """Drop an unfollowed author's posts from one timeline. The caller commits."""
+    TimelineEntry.query.filter_by(user_id=user_id, author_id=author_id).delete(synchronize_session=False)
+
+
+def remove_from_timelines(post_id):
+    """Drop a deleted post from every timeline. The caller commits."""
+    TimelineEntry.query.filter_by(post_id=post_id).delete(synchronize_session=False)
+
+
+def latest_posts_by_authors(author_ids, before=None, per_page=20):
+    """Newest posts across ``author_ids``, merged into one page.
+
+    Each author contributes at most ``per_page + 1`` ids, read by its own
+    range scan over the (user_id, id) index; the per-author lists are then
+    k-way merged with a heap. The cost depends on the page size and the
+    number of authors, not on how many posts they have written. Returns
+    ``(post_ids, next_cursor)`` with the same cursor as ``keyset_page``.
+    """
+    author_ids = sorted(set(author_ids))
+    limit = per_page + 1
+    per_author = {}
+    for i in range(0, len(author_ids), _MERGE_BATCH):
+        branches = []
+        for author_id in author_ids[i:i + _MERGE_BATCH]:
+            branch = select(Post.user_id, Post.id).where(Post.user_id == author_id)
+            if before is not None:
+                branch = branch.where(Post.id < before)
+            branches.append(select(branch.order_by(Post.id.desc()).limit(limit).subquery()))
+        for author_id, post_id in db.session.execute(union_all(*branches)):
+            per_author.setdefault(author_id, []).append(post_id)
+
+    feeds = [sorted(ids, reverse=True) for ids in per_author.values()]
+    merged = list(islice(heapq.merge(*feeds, reverse=True), limit))
+    next_cursor = merged[per_page - 1] if len(merged) > per_page else None
+    return merged[:per_page], next_cursor
+
+
+def pulled_authors(user_id):
+    """The fan-out-on-read authors ``user_id`` follows, from the cache when possible."""
+    authors = pulled_cache.get(user_id)
+    if authors is None:
+        token = pulled_cache.token(user_id)
+        authors = [author_id for author_id, in db.session.query(Follow.followed_id)
+                   .join(User, User.id == Follow.followed_id)
+                   .filter(Follow.follower_id == user_id, User.fanout_on_read.is_(True))
+                   .distinct()]
+        pulled_cache.set(user_id, authors, token)
+    return authors
+
+
+def timeline_page(user_id, before=None, per_page=20):
+    """One page of a user's home timeline, newest first.
+
+    Returns ``(post_ids, next_cursor)``, where the cursor is the last post id
+    shown. Posts of followed fan-out-on-read authors are merged in.
+    """
+    rows, next_cursor = keyset_page(
+        db.session.query(TimelineEntry.post_id).filter(TimelineEntry.user_id == user_id),
+        TimelineEntry.post_id, before=before, per_page=per_page)
+    post_ids = [row.post_id for row in rows]
+
+    pulled = pulled_authors(user_id)
+    if not pulled:
+        return post_ids, next_cursor
+
+    pulled_ids, pulled_cursor = latest_posts_by_authors(pulled, before=before, per_page=per_page)
+    # An author's posts from before the switch are in both lists
+    merged = []
+    for post_id in heapq.merge(post_ids, pulled_ids, reverse=True):
+        if not merged or merged[-1] != post_id:
+            merged.append(post_id)
+    post_ids = merged[:per_page]
+    more = len(merged) > per_page or next_cursor is not None or pulled_cursor is not None
+    return post_ids, (post_ids[-1] if more and post_ids else None)
@@ -0,0 +1,155 @@
+# app/services/user_service.py
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import islice
+from flask_login import UserMixin
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models.user_models import User
+from app.utils.cache import TTLCache
+from app.utils.db_utils import insert_ignore
+from app.utils.passwords import hash_settings, make_hash
+
+# Flask-Login loads the signed-in user on every request. Instead of a User
+# query each time, the loader returns a slim read-only record from this
+# process's cache. Code that changes one of the cached columns calls
+# invalidate_users() after committing; other workers see the change once
+# their entry expires (USER_CACHE_TTL).
+user_cache = TTLCache()
+
+
+class CachedUser(UserMixin):
+    """The columns of a signed-in user that requests and templates read."""
+
+    __slots__ = ('id', 'username', 'email', 'unread_notification_count', 'follower_count', 'following_count')
+
+    def __init__(self, **columns):
+        for name in self.__slots__:
+            setattr(self, name, columns[name])
+
+    def __repr__(self):
+        return f"<CachedUser {self.username}>"
+
+
+_COLUMNS = [getattr(User, name) for name in CachedUser.__slots__]
+_USERNAME_LENGTH = User.__table__.c.username.type.length
+_EMAIL_LENGTH = User.__table__.c.email.type.length
+
+
+def load_cached_user(user_id):
+    """The signed-in user's record, from the cache when possible."""
+    user = user_cache.get(user_id)
+    if user is None:
+        # Taken before the read, so an invalidation that lands in between
+        # keeps the row we read from being cached
+        token = user_cache.token(user_id)
+        row = db.session.query(*_COLUMNS).filter(User.id == user_id).first()
+        if row is None:
+            return None
+        user = CachedUser(**row._asdict())
+        user_cache.set(user_id, user, token)
+    return user
+
+
+def invalidate_users(*user_ids):
+    """Drop cached records after their row was committed."""
+    for user_id in user_ids:
+        user_cache.invalidate(user_id)
+
+
+def taken_field(username, email):
+    """'username' or 'email' when an existing user already has it, else None.
+
+    A cheap indexed read that registration runs before hashing, so a taken
+    name doesn't cost a hash. create_user() still relies on the constraints,
+    since someone may take the name in between.
+    """
+    row = db.session.query(User.username, User.email).filter(
+        or_(User.username == username, User.email == email)).first()
+    if row is None:
+        return None
+    return 'username' if row.username == username else 'email'
+
+
+def create_user(username, email, password_hash):
+    """Insert a user with a single INSERT.
+
+    The unique constraints on username and email decide, so concurrent
+    sign-ups can't both take a name. Returns ``(user_id, None)``, or
+    ``(None, field)`` with 'username' or 'email' when the row was rejected.
+    """
+    user = User(username=username, email=email, password_hash=password_hash)
+    db.session.add(user)
+    try:
+        db.session.flush()
+        user_id = user.id  # Read before the commit expires it
+        db.session.commit()
+    except IntegrityError as error:
+        db.session.rollback()
+        return None, _duplicate_field(error, username)
+    return user_id, None
+
+
+def _duplicate_field(error, username):
+    # MySQL, PostgreSQL and SQLite all end the first line of the message with
+    # the constraint's name; a value that merely contains "email" comes earlier
+    message = str(error.orig).lower().splitlines()[0]
+    positions = {field: message.rfind(field) for field in ('username', 'email')}
+    field = max(positions, key=positions.get)
+    if positions[field] >= 0:
+        return field
+    # A constraint named some other way: ask the database, on this failure path only
+    return 'username' if db.session.query(User.id).filter_by(username=username).first() else 'email'
+
+
+def import_users(rows, batch_size=1000, workers=None):
+    """Bulk-create users from ``rows`` of dicts with username, email and password.
+
+    Passwords are hashed with the configured method and cost on a pool of
+    ``workers`` processes, and each batch is inserted with one statement and
+    committed. Rows without all three fields, with a username or email too
+    long for its column, or whose username or email is already taken, are
+    skipped; the taken ones are found before hashing, so re-running an
+    interrupted import only hashes what is left. Returns
+    ``(imported, skipped)``.
+
+    The workers are spawned rather than forked, so they don't inherit this
+    process's background threads (dispatcher, hasher, write-behind) in
+    whatever state they were.
+    """
+    hash_one = partial(make_hash, *hash_settings())
+    rows = iter(rows)
+    imported = skipped = 0
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            valid = [row for row in batch if row.get('username') and row.get('email') and row.get('password')
+                     and len(row['username']) <= _USERNAME_LENGTH and len(row['email']) <= _EMAIL_LENGTH]
+            taken = db.session.query(User.username, User.email).filter(or_(
+                User.username.in_([row['username'] for row in valid]),
+                User.email.in_([row['email'] for row in valid]))).all()
+            taken_usernames = {username for username, _ in taken}
+            taken_emails = {email for _, email in taken}
+            valid = [row for row in valid
+                     if row['username'] not in taken_usernames and row['email'] not in taken_emails]
+
+            hashes = list(pool.map(hash_one, [row['password'] for row in valid],
+                                   chunksize=max(1, len(valid) // 32)))
+            # Duplicates within the file, or users registered meanwhile, are left out by the constraints
+            insert_ignore(User, [
+                {'username': row['username'], 'email': row['email'], 'password_hash': password_hash}
+                for row, password_hash in zip(valid, hashes)])
+            # MySQL counts the left-out rows too; every hash is salted, so the
+            # rows stored with one of this batch's hashes are the ones inserted
+            count = db.session.query(User.id).filter(
+                User.username.in_([row['username'] for row in valid]),
+                User.password_hash.in_(hashes)).count() if valid else 0
+            db.session.commit()
+            imported += count
+            skipped += len(batch) - count
+    return imported, skipped
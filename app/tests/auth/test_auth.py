@@ -0,0 +1,234 @@
+import os
+import threading
+import time
+import pytest
+from sqlalchemy import event
+from werkzeug.security import generate_password_hash
+from app import create_app, db
+from app.models.user_models import User
+from app.utils.passwords import password_hasher, needs_rehash
+from app.utils.rate_limit import rate_limiter, MemoryBackend
+
+@pytest.fixture
+def app():
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+        'WTF_CSRF_ENABLED': False,
+        'NOTIFICATION_ASYNC': False,
+        'PASSWORD_BCRYPT_ROUNDS': 4,  # Fast hashes for tests
+    })
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+@pytest.fixture
+def client(app):
+    with app.test_client() as client:
+        yield client
+
+def make_user(username='member', password='secret', password_hash=None):
+    user = User(username=username, email=f'{username}@example.com')
+    if password_hash:
+        user.password_hash = password_hash
+    else:
+        user.set_password(password)
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+def login(client, username='member', password='secret', ip='127.0.0.1'):
+    return client.post('/auth/login', data={'username': username, 'password': password},
+                       environ_base={'REMOTE_ADDR': ip})
+
+def test_passwords_use_the_configured_method_and_cost(app):
+    user = make_user()
+    assert user.password_hash.startswith('$2b$04$')
+    assert user.check_password('secret') and not user.check_password('wrong')
+
+    app.config.update(PASSWORD_HASH_METHOD='pbkdf2', PASSWORD_PBKDF2_ITERATIONS=1000)
+    user.set_password('secret')
+    assert user.password_hash.startswith('pbkdf2:sha256:1000$')
+    assert user.check_password('secret')
+
+def test_stale_hashes_are_upgraded_on_login(app, client):
+    user = make_user(password_hash=generate_password_hash('secret'))  # werkzeug's default pbkdf2
+    user_id = user.id
+    assert login(client).headers['Location'].endswith('/community/')
+    assert User.query.get(user_id).password_hash.startswith('$2b$04$')
+
+    app.config['PASSWORD_BCRYPT_ROUNDS'] = 5
+    client.get('/auth/logout')
+    login(client)
+    stored = User.query.get(user_id).password_hash
+    assert stored.startswith('$2b$05$') and not needs_rehash(stored)
+
+    client.get('/auth/logout')
+    login(client, password='wrong')
+    assert User.query.get(user_id).password_hash == stored  # Only a correct password triggers the upgrade
+
+def test_rehash_waits_for_an_idle_hasher(app, client, monkeypatch):
+    user = make_user(password_hash=generate_password_hash('secret'))
+    user_id, stale = user.id, user.password_hash
+    app.config.update(PASSWORD_HASH_WORKERS=1, PASSWORD_HASH_QUEUE=1)
+    password_hasher.init_app(app)
+    started, release = threading.Event(), threading.Event()
+    def slow_hash():
+        started.set()
+        release.wait()
+    busy = threading.Thread(target=password_hasher.run, args=(slow_hash,))
+    verify = password_hasher.verify
+    def verify_then_burst(*args):
+        valid = verify(*args)
+        busy.start()  # Another login takes the only worker
+        started.wait()
+        return valid
+    monkeypatch.setattr(password_hasher, 'verify', verify_then_burst)
+    try:
+        assert login(client).status_code == 302
+        assert User.query.get(user_id).password_hash == stale
+    finally:
+        release.set()
+        busy.join()
+
+    monkeypatch.setattr(password_hasher, 'verify', verify)
+    client.get('/auth/logout')
+    login(client)
+    assert User.query.get(user_id).password_hash.startswith('$2b$04$')
+
+def test_login_is_turned_away_when_hashing_is_saturated(app, client):
+    make_user()
+    app.config.update(PASSWORD_HASH_WORKERS=1, PASSWORD_HASH_QUEUE=0)
+    password_hasher.init_app(app)
+    started, release = threading.Event(), threading.Event()
+    def slow_hash():
+        started.set()
+        release.wait()
+    busy = threading.Thread(target=password_hasher.run, args=(slow_hash,))
+    busy.start()
+    started.wait()
+    try:
+        rv = login(client)
+        assert rv.status_code == 503 and rv.headers['Retry-After'] == '1'
+    finally:
+        release.set()
+        busy.join()
+    assert login(client).status_code == 302
+
+def test_login_is_throttled_per_username_and_ip(app, client):
+    make_user()
+    app.config['RATELIMIT_RULES'] = {'login': {'ip': (3, 60), 'username': (2, 0.2)}}
+    rate_limiter.init_app(app)
+    assert login(client, password='wrong', ip='10.0.0.1').status_code == 302
+    assert login(client, password='wrong', ip='10.0.0.2').status_code == 302
+
+    # The username is out of attempts, whichever address they come from
+    statements = []
+    event.listen(db.engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+    rv = login(client, ip='10.0.0.3')
+    assert rv.status_code == 429 and rv.headers['Retry-After'] == '1'
+    assert statements == []  # Turned away before any lookup or hash
+    assert login(client, 'Member', ip='10.0.0.3').status_code == 429  # Usernames are matched case-insensitively
+
+    # ...and the first address is out of attempts for any username
+    assert login(client, 'someone', ip='10.0.0.1').status_code == 302
+    assert login(client, 'else', ip='10.0.0.1').status_code == 302
+    assert login(client, 'other', ip='10.0.0.1').status_code == 429
+
+    time.sleep(0.15)  # The username bucket refills 10 attempts a second
+    assert login(client, ip='10.0.0.4').headers['Location'].endswith('/community/')
+
+def test_registration_is_throttled_per_ip_on_a_pluggable_backend(app, client):
+    backend = MemoryBackend()  # Stands in for a store shared by several workers
+    app.config.update(RATELIMIT_BACKEND=backend, RATELIMIT_RULES={'register': {'ip': (1, 3600)}})
+    rate_limiter.init_app(app)
+    assert register(client, 'first').status_code == 302
+    rv = register(client, 'second')
+    assert rv.status_code == 429 and int(rv.headers['Retry-After']) > 3500
+    assert User.query.filter_by(username='second').first() is None
+    assert len(backend) == 1
+
+def register(client, username, email=None):
+    return client.post('/auth/register', data={
+        'username': username, 'email': email or f'{username}@example.com',
+        'password': 'secret', 'password_confirm': 'secret'})
+
+def test_registration_checks_taken_names_before_hashing(app, client, monkeypatch):
+    make_user()
+    statements = []
+    event.listen(db.engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+    assert register(client, 'newcomer').headers['Location'].endswith('/auth/login')
+    assert [sql.split()[0] for sql in statements] == ['SELECT', 'INSERT']
+
+    hashes = []
+    hash_password = password_hasher.hash
+    monkeypatch.setattr(password_hasher, 'hash', lambda password: hashes.append(password) or hash_password(password))
+    for username, email in (('member', 'other@example.com'), ('other', 'member@example.com')):
+        register(client, username, email)
+    assert hashes == []
+    with client.session_transaction() as session:
+        assert [message for _, message in session['_flashes'][-2:]] == [
+            'Username already exists, please choose a different one.',
+            'Email already registered, please use a different one.']
+
+    # A name taken between the check and the insert is still caught by the constraints
+    monkeypatch.setattr('app.blueprints.auth.routes.taken_field', lambda username, email: None)
+    register(client, 'member', 'third@example.com')
+    with client.session_transaction() as session:
+        assert session['_flashes'][-1] == ('danger', 'Username already exists, please choose a different one.')
+    register(client, 'username', 'member@example.com')  # A name that mentions the other field
+    with client.session_transaction() as session:
+        assert session['_flashes'][-1] == ('danger', 'Email already registered, please use a different one.')
+    assert User.query.count() == 2
+
+def test_users_import_command_hashes_in_processes_and_skips_taken_names(app, tmp_path):
+    make_user()
+    path = tmp_path / 'users.csv'
+    path.write_text('username,email,password\n'
+                    'ada,ada@example.com,one\n'
+                    'member,new@example.com,two\n'      # Taken username
+                    'bob,bob@example.com,three\n'
+                    'bob,bob2@example.com,four\n'        # Repeated within the file
+                    'cy,,five\n'                         # Incomplete
+                    'dee,dee@example.com,six\n'
+                    f'{"e" * 121},eve@example.com,seven\n')  # Too long for the column
+    result = app.test_cli_runner().invoke(args=['users', 'import', str(path), '--batch-size', '2', '--workers', '2'])
+    assert result.exit_code == 0, result.output
+    assert 'Imported 3 users, skipped 4.' in result.output
+
+    users = {user.username: user for user in User.query.all()}
+    assert set(users) == {'member', 'ada', 'bob', 'dee'}
+    assert users['ada'].password_hash.startswith('$2b$04$') and users['ada'].check_password('one')
+    assert users['bob'].email == 'bob@example.com' and users['bob'].check_password('three')
+    assert users['dee'].follower_count == 0 and users['dee'].created_at is not None
+
+    # Re-running hashes and inserts nothing
+    result = app.test_cli_runner().invoke(args=['users', 'import', str(path)])
+    assert 'Imported 0 users, skipped 7.' in result.output
+
+def test_memory_backend_evicts_least_recently_used_buckets():
+    backend = MemoryBackend(max_keys=2)
+    assert backend.take('a', 1, 0.01) == 0
+    assert backend.take('b', 1, 0.01) == 0
+    assert backend.take('a', 1, 0.01) > 0  # Touches 'a', so 'b' is the oldest
+    assert backend.take('c', 1, 0.01) == 0
+    assert len(backend) == 2
+    assert backend.take('b', 1, 0.01) == 0  # Forgotten, so it starts full again
+    assert backend.take('a', 1, 0.01) == 0  # ...at the cost of evicting 'a'
+
+@pytest.mark.skipif(not os.environ.get('DAOPLUS_BENCHMARK'), reason='set DAOPLUS_BENCHMARK=1 to run')
+@pytest.mark.parametrize('method, cost', [('bcrypt', 10), ('pbkdf2', 260000)])
+def test_benchmark_logins_per_second_per_core(app, client, method, cost):
+    # One client on one thread keeps one core busy; run with -s to see the figure
+    app.config.update(PASSWORD_HASH_METHOD=method, PASSWORD_BCRYPT_ROUNDS=cost, PASSWORD_PBKDF2_ITERATIONS=cost)
+    rate_limiter.enabled = False
+    make_user()
+    logins = 20
+    start = time.perf_counter()
+    for _ in range(logins):
+        assert login(client).status_code == 302
+        client.get('/auth/logout')
+    elapsed = time.perf_counter() - start
+    print(f'\n{method} (cost {cost}): {logins / elapsed:.1f} logins/s per core')
@@ -1,12 +1,756 @@
+import threading
+import time
 import pytest
-from app import create_app
+from sqlalchemy import event, func
+from sqlalchemy.dialects import mysql
+from sqlalchemy.schema import CreateTable
+from app import create_app, init_worker, db
+from app.models.user_models import User, Like, Follow, RewardTransaction
+from app.models.post_models import Post, Comment
+from app.models.notification_models import Notification
+from app.models.timeline_models import TimelineEntry
+from app.models.search_models import SearchTerm, SearchStats
+from app.utils import helpers
+from app.utils.helpers import notification_dispatcher, notify_like, notify_follow, write_notifications
+from app.services import search_service
+from app.services.search_service import index_post, search_posts, tokenize, search_cache
+from app.services.stream_service import NotificationBroker, notification_broker
+from app.services.suggest_service import PrefixIndex
+from app.services.user_service import invalidate_users, load_cached_user, user_cache
+from app.services.timeline_service import fan_out_post, backfill_follow, latest_posts_by_authors, pulled_cache
+from app.services.counter_service import reconcile_counters
 
 @pytest.fixture
-def client():
-    app = create_app()
+def app():
+    app = create_app({
+        'TESTING': True,
+        'PASSWORD_BCRYPT_ROUNDS': 4,  # Fast hashes for tests
+        'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+        'WTF_CSRF_ENABLED': False,
+        'POSTS_PER_PAGE': 10,
+        'NOTIFICATION_ASYNC': False,
+    })
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+@pytest.fixture
+def client(app):
     with app.test_client() as client:
         yield client
 
+@pytest.fixture
+def author(app):
+    user = User(username='author', email='author@example.com')
+    user.set_password('secret')
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+def login(client, username='author', password='secret'):
+    return client.post('/auth/login', data={'username': username, 'password': password})
+
+def make_posts(author, count):
+    posts = [Post(title=f'Post {i}', content=f'Body {i}', user_id=author.id) for i in range(count)]
+    db.session.add_all(posts)
+    db.session.flush()
+    for post in posts:
+        index_post(post)
+    db.session.commit()
+    search_cache.bump()
+    return posts
+
 def test_community(client):
     rv = client.get('/community')
     assert rv.status_code == 200
+
+def test_home_is_keyset_paginated(client, author):
+    posts = make_posts(author, 25)
+
+    rv = client.get('/community/')
+    page = rv.get_data(as_text=True)
+    assert rv.status_code == 200
+    assert 'Post 24' in page and 'Post 15' in page
+    assert 'Post 14' not in page
+    assert f'before={posts[15].id}' in page
+
+    rv = client.get(f'/community/?before={posts[5].id}')
+    page = rv.get_data(as_text=True)
+    assert 'Post 4' in page and 'Post 0' in page
+    assert 'Post 5' not in page
+    assert 'Next page' not in page
+
+def test_post_list_is_keyset_paginated(client, author):
+    posts = make_posts(author, 12)
+
+    rv = client.get(f'/community/posts?before={posts[11].id}')
+    page = rv.get_data(as_text=True)
+    assert rv.status_code == 200
+    assert 'Post 10' in page and 'Post 1<' in page
+    assert 'Post 11' not in page
+    assert f'before={posts[1].id}' in page
+
+def count_statements(app, fn):
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        rv = fn()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+    assert rv.status_code == 200
+    return len(statements)
+
+@pytest.mark.parametrize('path', ['/community/', '/community/posts', '/community/search?q=Post'])
+def test_feed_loads_authors_in_fixed_number_of_queries(app, client, author, path):
+    make_posts(author, 2)
+    few = count_statements(app, lambda: client.get(path))
+
+    # Posts by many distinct authors must not add one query per author
+    for i in range(6):
+        user = User(username=f'user{i}', email=f'user{i}@example.com')
+        db.session.add(user)
+        db.session.flush()
+        post = Post(title=f'Post by user{i}', content='Body', user_id=user.id)
+        db.session.add(post)
+        db.session.flush()
+        index_post(post)
+    db.session.commit()
+    search_cache.bump()
+    many = count_statements(app, lambda: client.get(path))
+
+    assert few == many
+
+def test_feeds_render_stored_excerpt(client, author):
+    login(client)
+    body = 'a' * 300 + 'TAIL'
+    client.post('/community/posts/new', data={'title': 'Long read', 'content': body})
+    post = Post.query.filter_by(title='Long read').one()
+    assert post.excerpt == 'a' * 200
+
+    client.post(f'/community/posts/{post.id}/edit', data={'title': 'Long read', 'content': 'b' * 300})
+    assert Post.query.get(post.id).excerpt == 'b' * 200
+
+    page = client.get('/community/').get_data(as_text=True)
+    assert 'b' * 200 in page and 'b' * 201 not in page
+
+def test_tokenize_splits_cjk_into_bigrams():
+    assert tokenize('Hello, 道加社区! DaoPlus_2024') == ['hello', '道加', '加社', '社区', 'daoplus', '2024']
+    assert tokenize('好') == ['好']
+
+def test_search_ranks_with_bm25_and_follows_writes(client, author):
+    login(client)
+    client.post('/community/posts/new', data={'title': '社区货币', 'content': '积分奖励 社区 社区'})
+    client.post('/community/posts/new', data={'title': 'Gardening', 'content': '我们的社区花园'})
+    client.post('/community/posts/new', data={'title': 'Cooking', 'content': 'Nothing relevant'})
+    best, other = Post.query.filter_by(title='社区货币').one(), Post.query.filter_by(title='Gardening').one()
+
+    assert search_posts('社区')[0] == [best.id, other.id]
+    page = client.get('/community/search?q=社区').get_data(as_text=True)
+    assert page.index('社区货币') < page.index('Gardening')
+    assert 'Cooking' not in page
+
+    client.post(f'/community/posts/{other.id}/edit', data={'title': 'Gardening', 'content': 'tomatoes'})
+    assert search_posts('社区')[0] == [best.id]
+    assert search_posts('Tomatoes')[0] == [other.id]
+
+    client.post(f'/community/posts/{best.id}/delete')
+    assert search_posts('社区')[0] == []
+
+def test_accented_terms_are_distinct_index_keys(client, author):
+    login(client)
+    client.post('/community/posts/new', data={'title': 'Cafe', 'content': 'café culture'})
+    assert search_posts('café')[0] == search_posts('cafe')[0] == [Post.query.one().id]
+    # MySQL would otherwise compare the two terms as equal keys
+    ddl = str(CreateTable(SearchTerm.__table__).compile(dialect=mysql.dialect()))
+    assert 'COLLATE utf8mb4_bin' in ddl
+
+def test_search_is_paginated(app, client, author):
+    app.config['SEARCH_RESULTS_PER_PAGE'] = 4
+    make_posts(author, 10)
+
+    seen, cursor = [], None
+    for _ in range(3):
+        ids, cursor = search_posts('post', before=cursor, per_page=4)
+        seen += ids
+    assert cursor is None and len(seen) == len(set(seen)) == 10
+    assert 'before=' in client.get('/community/search?q=post').get_data(as_text=True)
+    # The collection statistics are spread over shard rows that add up
+    assert SearchStats.query.count() > 1
+    assert db.session.query(func.sum(SearchStats.doc_count)).scalar() == 10
+
+def test_search_results_are_cached_until_a_post_changes(client, author):
+    login(client)
+    client.post('/community/posts/new', data={'title': 'Tea', 'content': 'Green tea'})
+    misses = search_cache.stats()['misses']
+
+    client.get('/community/search?q=tea')
+    client.get('/community/search?q=TEA ')
+    stats = client.get('/community/cache/stats').get_json()['search']
+    assert stats['misses'] == misses + 1 and stats['hits'] >= 1
+
+    client.post('/community/posts/new', data={'title': 'More tea', 'content': 'Black tea'})
+    assert 'More tea' in client.get('/community/search?q=tea').get_data(as_text=True)
+
+def test_search_result_is_not_cached_across_a_concurrent_write(client, author, monkeypatch):
+    login(client)
+    client.post('/community/posts/new', data={'title': 'Tea', 'content': 'Green tea'})
+    rank = search_service.search_posts
+
+    def rank_during_write(*args):
+        result = rank(*args)
+        search_cache.bump()  # Another request writes a post before this one stores its result
+        return result
+    monkeypatch.setattr(search_service, 'search_posts', rank_during_write)
+    search_service.cached_search_posts('tea')
+    monkeypatch.setattr(search_service, 'search_posts', rank)
+
+    misses = search_cache.stats()['misses']
+    search_service.cached_search_posts('tea')
+    assert search_cache.stats()['misses'] == misses + 1
+
+def test_suggest_matches_titles_and_usernames_by_prefix(app, client, author):
+    make_posts(author, 2)
+    app.config['SUGGEST_REFRESH_INTERVAL'] = 0
+    init_worker(app)
+    login(client)
+    client.post('/community/posts/new', data={'title': 'Authentic tea', 'content': 'Body'})
+
+    suggestions = client.get('/community/search/suggest?q=AUTH').get_json()['suggestions']
+    assert {(s['type'], s['label']) for s in suggestions} == {('user', 'author'), ('post', 'Authentic tea')}
+
+    post = Post.query.filter_by(title='Authentic tea').one()
+    client.post(f'/community/posts/{post.id}/edit', data={'title': 'Oolong', 'content': 'Body'})
+    assert [s['label'] for s in client.get('/community/search/suggest?q=auth').get_json()['suggestions']] == ['author']
+    assert client.get('/community/search/suggest?q=oo').get_json()['suggestions'][0]['id'] == post.id
+
+def test_suggest_reload_keeps_changes_made_while_it_reads():
+    index = PrefixIndex()
+    index.load([('post', 1, 'Apple'), ('post', 2, 'Apricot')])
+
+    def entries():
+        yield 'post', 1, 'Apple'
+        index.add('post', 3, 'Avocado')  # Written by a request while the reload reads
+        index.remove('post', 1, 'Apple')
+        yield 'post', 2, 'Apricot'
+    index.load(entries())
+    assert [s['label'] for s in index.lookup('a')] == ['Apricot', 'Avocado']
+
+def test_notifications_are_written_in_the_background(tmp_path):
+    app = create_app({
+        'TESTING': True,
+        'PASSWORD_BCRYPT_ROUNDS': 4,  # Fast hashes for tests
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "notifications.db"}',
+        'WTF_CSRF_ENABLED': False,
+    })
+    with app.app_context():
+        db.create_all()
+        for name in ('fan', 'star'):
+            user = User(username=name, email=f'{name}@example.com')
+            user.set_password('secret')
+            db.session.add(user)
+        db.session.commit()
+        star_id = User.query.filter_by(username='star').one().id
+
+        client = app.test_client()
+        login(client, 'fan')
+        client.post(f'/community/follow_user/{star_id}')
+
+        notification_dispatcher.shutdown()  # Drains the queue
+        notification = Notification.query.one()
+        assert (notification.user_id, notification.action, notification.target_type) == (star_id, 'followed', 'user')
+
+def test_concurrent_events_for_one_user_coalesce_into_one_row(tmp_path, monkeypatch):
+    app = create_app({
+        'TESTING': True,
+        'PASSWORD_BCRYPT_ROUNDS': 4,  # Fast hashes for tests
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "notifications.db"}',
+        'SQLALCHEMY_ENGINE_OPTIONS': {'connect_args': {'timeout': 30}},
+        # Tiny queues and batches, so workers and overflowing producers all write at once
+        'NOTIFICATION_WORKERS': 2,
+        'NOTIFICATION_QUEUE_SIZE': 2,
+        'NOTIFICATION_QUEUE_TIMEOUT': 0,
+        'NOTIFICATION_BATCH_SIZE': 1,
+    })
+    with app.app_context():
+        db.create_all()
+        users = [User(username=f'user{i}', email=f'user{i}@example.com') for i in range(9)]
+        db.session.add_all(users)
+        db.session.commit()
+        author_id, fan_ids = users[0].id, [user.id for user in users[1:]]
+
+        # SQLite serializes the writes anyway, so watch for overlapping writers directly
+        writing, overlaps, guard = set(), [], threading.Lock()
+        def tracked_write(rows, session=None):
+            with guard:
+                overlaps.extend(writing & {row['user_id'] for row in rows})
+                writing.update(row['user_id'] for row in rows)
+            try:
+                time.sleep(0.001)
+                write_notifications(rows, session)
+            finally:
+                with guard:
+                    writing.difference_update(row['user_id'] for row in rows)
+        monkeypatch.setattr(helpers, 'write_notifications', tracked_write)
+
+        start = threading.Barrier(len(fan_ids))
+        def like(fan_id):
+            with app.app_context():
+                start.wait()
+                for _ in range(3):
+                    notify_like(author_id, 1, fan_id)
+                db.session.remove()
+        threads = [threading.Thread(target=like, args=(fan_id,)) for fan_id in fan_ids]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        notification_dispatcher.shutdown()  # Drains the queues
+
+        assert overlaps == []
+        notification = Notification.query.one()
+        assert notification.actor_count == 24
+        assert db.session.query(User.unread_notification_count).filter_by(id=author_id).scalar() == 1
+
+def test_notifications_coalesce_and_page_newest_first(app, client, author):
+    fans = [User(username=f'fan{i}', email=f'fan{i}@example.com') for i in range(3)]
+    db.session.add_all(fans)
+    db.session.commit()
+    post = make_posts(author, 1)[0]
+    for fan in fans:
+        notify_like(author.id, post.id, fan.id)
+    notify_follow(author.id, fans[0].id)
+    assert Notification.query.count() == 2
+
+    app.config['NOTIFICATIONS_PER_PAGE'] = 1
+    login(client)
+    page = client.get('/community/dashboard').get_data(as_text=True)
+    assert 'fan0' in page and 'followed you' in page and 'liked' not in page
+
+    cursor = page.split('before=')[1].split('"')[0]
+    page = client.get(f'/community/dashboard?before={cursor}').get_data(as_text=True)
+    assert 'fan2' in page and 'and 2 others' in page and 'liked your post "Post 0"' in page
+
+def test_inline_notification_writes_leave_the_request_session_alone(author):
+    fan = User(username='fan', email='fan@example.com')
+    db.session.add(fan)
+    db.session.commit()
+    author_id, fan_id = author.id, fan.id
+
+    author.username = 'renamed'  # Still pending in the request when the notification is written
+    notify_follow(author_id, fan_id)
+    db.session.rollback()
+    assert User.query.get(author_id).username == 'author'
+    assert Notification.query.filter_by(user_id=author_id).count() == 1
+
+def unread_count(user_id):
+    # Read the column, not a User the session may hold from before the write
+    return db.session.query(User.unread_notification_count).filter_by(id=user_id).scalar()
+
+def test_unread_counter_follows_writes_and_reads(client, author):
+    fans = [User(username=f'fan{i}', email=f'fan{i}@example.com') for i in range(2)]
+    db.session.add_all(fans)
+    db.session.commit()
+    post = make_posts(author, 1)[0]
+    author_id, post_id, fan_ids = author.id, post.id, [fan.id for fan in fans]
+
+    notify_like(author_id, post_id, fan_ids[0])
+    notify_like(author_id, post_id, fan_ids[1])  # Coalesced into the unread row
+    notify_follow(author_id, fan_ids[0])
+    assert unread_count(author_id) == 2
+
+    login(client)
+    assert 'id="notification-badge">2<' in client.get('/community/dashboard').get_data(as_text=True)
+    like = Notification.query.filter_by(action='liked').one()
+    client.post(f'/community/notifications/{like.id}/read')
+    client.post(f'/community/notifications/{like.id}/read')  # Already read, no double decrement
+    assert unread_count(author_id) == 1
+
+    # A like after the row was read starts a new unread row instead of reopening it
+    notify_like(author_id, post_id, fan_ids[0])
+    assert Notification.query.filter_by(action='liked', is_read=False).count() == 1
+    assert unread_count(author_id) == 2
+
+    client.post('/community/notifications/read_all')
+    assert unread_count(author_id) == 0
+    assert Notification.query.filter_by(is_read=False).count() == 0
+
+def test_read_all_clamps_a_drifted_unread_counter(client, author):
+    fans = [User(username=f'fan{i}', email=f'fan{i}@example.com') for i in range(3)]
+    db.session.add_all(fans)
+    db.session.commit()
+    author_id, fan_ids = author.id, [fan.id for fan in fans]
+    for post, fan_id in zip(make_posts(author, 3), fan_ids):
+        notify_like(author_id, post.id, fan_id)
+    User.query.filter_by(id=author_id).update({User.unread_notification_count: 1})
+    db.session.commit()
+
+    login(client)
+    client.post('/community/notifications/read_all')
+    assert unread_count(author_id) == 0
+
+def test_notification_stream_pushes_new_notifications(app, client, author):
+    notification_broker.configure(max_streams=1, buffer_size=2, heartbeat=15)
+    fan = User(username='fan', email='fan@example.com')
+    db.session.add(fan)
+    db.session.commit()
+    author_id, fan_id = author.id, fan.id
+    login(client)
+
+    # Off by default: pages don't open a stream and the endpoint doesn't exist
+    assert 'EventSource' not in client.get('/community/timeline').get_data(as_text=True)
+    assert client.get('/community/notifications/stream').status_code == 404
+    app.config['NOTIFICATION_STREAM_ENABLED'] = True
+    assert 'EventSource' in client.get('/community/timeline').get_data(as_text=True)
+
+    rv = client.get('/community/notifications/stream', buffered=False)
+    assert rv.status_code == 200 and rv.mimetype == 'text/event-stream'
+    chunks = iter(rv.response)
+    assert next(chunks).startswith(b'retry:')
+    assert client.get('/community/notifications/stream').status_code == 503  # One stream per worker here
+
+    notify_follow(author_id, fan_id)
+    event = next(chunks).decode()
+    assert event.startswith('event: notification') and '"unread": 1' in event
+
+    rv.close()
+    assert notification_broker.stats()['streams'] == 0
+
+def test_slow_stream_drops_oldest_events():
+    notification_broker.configure(max_streams=10, buffer_size=2, heartbeat=15)
+    events = notification_broker.subscribe(7)
+    for unread in range(1, 4):
+        notification_broker.publish(7, {'unread': unread})
+    assert [events.get_nowait()['unread'] for _ in range(2)] == [2, 3]
+    notification_broker.unsubscribe(7, events)
+
+class SharedRelay:
+    """Stands in for Redis between brokers that play separate workers."""
+
+    def __init__(self):
+        self.receivers = []
+        self.present = set()
+
+    def start(self, deliver):
+        self.receivers.append(deliver)
+
+    def stop(self):
+        pass
+
+    def publish(self, user_id, event):
+        for deliver in self.receivers:
+            deliver(user_id, event)
+
+    def touch(self, user_ids):
+        self.present |= user_ids
+
+    def listening(self, user_ids):
+        return user_ids & self.present
+
+def test_relay_delivers_events_written_by_another_worker(app):
+    relay = SharedRelay()
+    serving, writing = NotificationBroker(), NotificationBroker()
+    for broker in (serving, writing):
+        broker.configure(relay=relay)
+        broker.start(app)
+    events = serving.subscribe(7)
+
+    assert writing.has_subscribers({7, 8}) == {7}
+    writing.publish(7, {'unread': 1})
+    assert events.get_nowait() == {'unread': 1}
+    for broker in (serving, writing):
+        broker.stop()
+
+def test_timeline_fans_out_on_write_and_merges_big_authors_on_read(app, client, author):
+    reader = User(username='reader', email='reader@example.com')
+    reader.set_password('secret')
+    star = User(username='star', email='star@example.com')
+    db.session.add_all([reader, star])
+    db.session.commit()
+    author_id, star_id = author.id, star.id
+    old_post = make_posts(author, 1)[0]
+    old_post_id = old_post.id
+
+    login(client, 'reader')
+    client.post(f'/community/follow_user/{author_id}')  # Backfills the author's existing post
+    client.post(f'/community/follow_user/{star_id}')
+    db.session.add(Post(title='Star post', content='Body', user_id=star_id))
+    db.session.commit()
+
+    client.get('/auth/logout')
+    login(client)
+    client.post('/community/posts/new', data={'title': 'Fresh post', 'content': 'Body'})
+    fresh_id = Post.query.filter_by(title='Fresh post').one().id
+    assert TimelineEntry.query.filter_by(post_id=fresh_id).count() == 2  # Author and reader
+
+    # Once the star is over the limit their posts are merged in on read
+    app.config['TIMELINE_FANOUT_LIMIT'] = 0
+    star_post = Post(title='Big news', content='Body', user_id=star_id)
+    db.session.add(star_post)
+    db.session.flush()
+    fan_out_post(star_post)
+    db.session.commit()
+    assert User.query.get(star_id).fanout_on_read
+    assert TimelineEntry.query.filter_by(post_id=star_post.id).count() == 1  # Only the star's own
+
+    client.get('/auth/logout')
+    login(client, 'reader')
+    app.config['POSTS_PER_PAGE'] = 2
+    page = client.get('/community/timeline').get_data(as_text=True)
+    assert 'Big news' in page and 'Fresh post' in page and 'Post 0' not in page
+    page = client.get(f'/community/timeline?before={fresh_id}').get_data(as_text=True)
+    assert 'Star post' in page and 'Post 0' in page
+
+    # The pulled-author list is cached, and unfollowing drops it straight away
+    assert pulled_cache.get(User.query.filter_by(username='reader').one().id) == [star_id]
+    client.post(f'/community/unfollow_user/{star_id}')
+    assert 'Big news' not in client.get('/community/timeline').get_data(as_text=True)
+
+    client.get('/auth/logout')
+    login(client)
+    client.post(f'/community/posts/{old_post_id}/delete')
+    assert TimelineEntry.query.filter_by(post_id=old_post_id).count() == 0
+
+def test_backfill_skips_entries_fan_out_already_wrote(app, author):
+    reader = User(username='reader', email='reader@example.com')
+    db.session.add(reader)
+    db.session.commit()
+    posts = make_posts(author, 3)
+    # The follow is committed just as the newest post fans out to it
+    db.session.add(Follow(follower_id=reader.id, followed_id=author.id))
+    fan_out_post(posts[-1])
+    backfill_follow(reader.id, author.id)
+    db.session.commit()
+    assert TimelineEntry.query.filter_by(user_id=reader.id).count() == 3
+
+def test_latest_posts_by_authors_merges_pages_in_id_order(app, author):
+    users = [User(username=f'writer{i}', email=f'writer{i}@example.com') for i in range(3)]
+    db.session.add_all(users)
+    db.session.commit()
+    for i in range(17):
+        db.session.add(Post(title=f'Post {i}', content='Body', user_id=users[i * 7 % 3].id))
+    make_posts(author, 2)  # Not followed, never returned
+    expected = [post_id for post_id, in db.session.query(Post.id).filter(
+        Post.user_id.in_([user.id for user in users])).order_by(Post.id.desc())]
+
+    seen, cursor = [], None
+    while True:
+        post_ids, cursor = latest_posts_by_authors([user.id for user in users], before=cursor, per_page=5)
+        seen.extend(post_ids)
+        if cursor is None:
+            break
+    assert seen == expected
+
+def test_follow_counters_and_profile_cost_do_not_grow_with_the_graph(app, client, author):
+    fans = []
+    for i in range(3):
+        fan = User(username=f'fan{i}', email=f'fan{i}@example.com')
+        fan.set_password('secret')
+        fans.append(fan)
+    db.session.add_all(fans)
+    db.session.commit()
+    author_id = author.id
+    make_posts(author, 1)
+
+    login(client, 'fan0')
+    client.post(f'/community/follow_user/{author_id}')
+    page = client.get(f'/community/users/{author_id}').get_data(as_text=True)
+    one = count_statements(app, lambda: client.get(f'/community/users/{author_id}'))
+    assert '<strong>1</strong> followers' in page and 'Unfollow' in page
+
+    for fan in ('fan1', 'fan2'):
+        client.get('/auth/logout')
+        login(client, fan)
+        client.post(f'/community/follow_user/{author_id}')
+    client.get('/auth/logout')
+    login(client, 'fan0')
+    client.get(f'/community/users/{author_id}')
+    assert count_statements(app, lambda: client.get(f'/community/users/{author_id}')) == one
+    assert User.query.get(author_id).follower_count == 3
+    assert User.query.filter_by(username='fan0').one().following_count == 1
+
+    client.post(f'/community/unfollow_user/{author_id}')
+    fan0 = User.query.filter_by(username='fan0').one()
+    assert (User.query.get(author_id).follower_count, fan0.following_count) == (2, 0)
+    assert TimelineEntry.query.filter_by(user_id=fan0.id, author_id=author_id).count() == 0
+    assert 'Unfollow' not in client.get(f'/community/users/{author_id}').get_data(as_text=True)
+
+def test_concurrent_likes_insert_exactly_one_row(tmp_path):
+    app = create_app({
+        'TESTING': True,
+        'PASSWORD_BCRYPT_ROUNDS': 4,  # Fast hashes for tests
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "likes.db"}',
+        'SQLALCHEMY_ENGINE_OPTIONS': {'connect_args': {'timeout': 30}},
+        'WTF_CSRF_ENABLED': False,
+        'NOTIFICATION_ASYNC': False,
+    })
+    with app.app_context():
+        db.create_all()
+        fan = User(username='fan', email='fan@example.com')
+        fan.set_password('secret')
+        db.session.add(fan)
+        db.session.commit()
+        post = Post(title='Popular', content='Body', user_id=fan.id)
+        db.session.add(post)
+        db.session.commit()
+        post_id = post.id
+
+        clients = [app.test_client() for _ in range(8)]
+        for client in clients:
+            login(client, 'fan')
+        start = threading.Barrier(len(clients))
+        statuses = []
+        def hammer(client):
+            start.wait()
+            for _ in range(5):
+                statuses.append(client.post(f'/community/like_post/{post_id}').status_code)
+        threads = [threading.Thread(target=hammer, args=(client,)) for client in clients]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert statuses == [302] * 40
+        assert Like.query.filter_by(post_id=post_id).count() == 1
+        assert RewardTransaction.query.filter_by(reason='like').count() == 1
+
+def test_like_and_comment_counts_are_kept_and_reconciled(client, author):
+    post_id = make_posts(author, 1)[0].id
+    login(client)
+    client.post(f'/community/like_post/{post_id}')
+    client.post(f'/community/like_post/{post_id}')  # Not counted twice
+    for text in ('First', 'Second'):
+        client.post(f'/community/posts/{post_id}/comment', data={'content': text})
+    first = Comment.query.filter_by(content='First').one()
+    client.post(f'/community/comments/{first.id}/delete')
+
+    post = Post.query.get(post_id)
+    assert (post.like_count, post.comment_count) == (1, 1)
+    assert '1 likes &middot; 1 comments' in client.get('/community/posts').get_data(as_text=True)
+    assert 'Liked</button>' in client.get(f'/community/posts/{post_id}').get_data(as_text=True)
+
+    Post.query.filter_by(id=post_id).update({Post.like_count: 7})
+    db.session.commit()
+    assert reconcile_counters(batch_size=1) == {'post': 1, 'user': 0}
+    assert Post.query.get(post_id).like_count == 1
+
+def test_post_detail_pages_comments_with_batched_authors(app, client, author):
+    app.config['COMMENTS_PER_PAGE'] = 3
+    post_id = make_posts(author, 1)[0].id
+    db.session.add(Comment(content='Comment 0', user_id=author.id, post_id=post_id))
+    db.session.commit()
+    few = count_statements(app, lambda: client.get(f'/community/posts/{post_id}'))
+
+    for i in range(1, 8):
+        user = User(username=f'commenter{i}', email=f'commenter{i}@example.com')
+        db.session.add(user)
+        db.session.flush()
+        db.session.add(Comment(content=f'Comment {i}', user_id=user.id, post_id=post_id))
+    db.session.commit()
+    assert count_statements(app, lambda: client.get(f'/community/posts/{post_id}')) == few
+
+    page = client.get(f'/community/posts/{post_id}').get_data(as_text=True)
+    assert 'Comment 2' in page and 'Comment 3' not in page
+    cursor = page.split('data-after="')[1].split('"')[0]
+    more = client.get(f'/community/posts/{post_id}/comments?after={cursor}').get_json()
+    assert [c['content'] for c in more['comments']] == ['Comment 3', 'Comment 4', 'Comment 5']
+    assert more['comments'][0]['username'] == 'commenter3'
+    last = client.get(f'/community/posts/{post_id}/comments?after={more["next_cursor"]}').get_json()
+    assert [c['content'] for c in last['comments']] == ['Comment 6', 'Comment 7'] and last['next_cursor'] is None
+
+def test_threaded_comments_load_by_path_range(app, client, author):
+    app.config.update(COMMENTS_PER_PAGE=1, COMMENT_DISPLAY_DEPTH=1, COMMENT_MAX_DEPTH=2)
+    post_id = make_posts(author, 1)[0].id
+    login(client)
+    client.post(f'/community/posts/{post_id}/comment', data={'content': 'Root A'})
+    client.post(f'/community/posts/{post_id}/comment', data={'content': 'Root D'})
+    root = Comment.query.filter_by(content='Root A').one()
+    client.post(f'/community/comments/{root.id}/reply', data={'content': 'Reply B'})
+    reply = Comment.query.filter_by(content='Reply B').one()
+    client.post(f'/community/comments/{reply.id}/reply', data={'content': 'Reply C'})
+    deep = Comment.query.filter_by(content='Reply C').one()
+    client.post(f'/community/comments/{deep.id}/reply', data={'content': 'Reply E'})  # Too deep: goes next to C
+    assert (deep.depth, Comment.query.filter_by(content='Reply E').one().parent_id) == (2, reply.id)
+    assert Post.query.get(post_id).comment_count == 5
+
+    page = client.get(f'/community/posts/{post_id}/comments').get_json()
+    [a] = page['comments']
+    assert [r['content'] for r in a['replies']] == ['Reply B'] and a['replies'][0]['more_replies']
+    assert [c['content'] for c in client.get(
+        f'/community/posts/{post_id}/comments?after={page["next_cursor"]}').get_json()['comments']] == ['Root D']
+
+    thread = client.get(f'/community/comments/{reply.id}/thread').get_json()
+    assert [r['content'] for r in thread['comment']['replies']] == ['Reply C']
+    thread = client.get(f'/community/comments/{reply.id}/thread?after={thread["next_cursor"]}').get_json()
+    assert [r['content'] for r in thread['comment']['replies']] == ['Reply E'] and thread['next_cursor'] is None
+
+    html = client.get(f'/community/posts/{post_id}').get_data(as_text=True)
+    assert 'Reply B' in html and 'Reply C' not in html and 'Continue this thread' in html
+
+    client.post(f'/community/comments/{reply.id}/delete')  # Has replies: kept as a placeholder
+    thread = client.get(f'/community/comments/{reply.id}/thread').get_json()['comment']
+    assert thread['content'] == '[deleted]' and len(thread['replies']) == 1
+
+def test_comment_pages_stop_at_the_reply_limit(app, client, author):
+    app.config.update(COMMENT_REPLY_LIMIT=3, COMMENT_DISPLAY_DEPTH=2)
+    post_id = make_posts(author, 1)[0].id
+    login(client)
+    for content in ('Root A', 'Root B', 'Root C'):
+        client.post(f'/community/posts/{post_id}/comment', data={'content': content})
+    root_a, root_b, root_c = Comment.query.filter_by(parent_id=None).order_by(Comment.id).all()
+    for i in range(2):
+        client.post(f'/community/comments/{root_a.id}/reply', data={'content': f'A{i}'})
+    for i in range(4):
+        client.post(f'/community/comments/{root_b.id}/reply', data={'content': f'B{i}'})
+    b0 = Comment.query.filter_by(content='B0').one()
+    client.post(f'/community/comments/{b0.id}/reply', data={'content': 'B0 reply'})
+    a0 = Comment.query.filter_by(content='A0').one()
+    client.post(f'/community/comments/{a0.id}/reply', data={'content': 'A0 reply'})
+
+    # Root B's replies don't fit after Root A's, so the page ends before it
+    page = client.get(f'/community/posts/{post_id}/comments').get_json()
+    assert [c['content'] for c in page['comments']] == ['Root A'] and page['next_cursor'] == root_a.id
+    [a] = page['comments']
+    assert [r['content'] for r in a['replies']] == ['A0', 'A1'] and not a['more_replies']
+
+    # On its own page Root B is kept with the replies that fit, and flagged
+    page = client.get(f'/community/posts/{post_id}/comments?after={root_a.id}').get_json()
+    assert [c['content'] for c in page['comments']] == ['Root B'] and page['next_cursor'] == root_b.id
+    [b] = page['comments']
+    assert [r['content'] for r in b['replies']] == ['B0', 'B1', 'B2'] and b['more_replies']
+    assert [r['more_replies'] for r in b['replies']] == [True, False, False]  # B0's reply sorts after the cut
+
+    thread = client.get(f'/community/comments/{root_b.id}/thread?after={b["replies"][-1]["id"]}').get_json()
+    assert [r['content'] for r in thread['comment']['replies']] == ['B3']
+    assert [c['content'] for c in client.get(
+        f'/community/posts/{post_id}/comments?after={root_b.id}').get_json()['comments']] == ['Root C']
+
+def test_user_read_before_an_invalidation_is_not_cached(app, author, monkeypatch):
+    author_id = author.id
+    query = db.session.query
+
+    def query_during_write(*entities):
+        invalidate_users(author_id)  # Another request commits a change to this user meanwhile
+        return query(*entities)
+    monkeypatch.setattr(db.session, 'query', query_during_write)
+    assert load_cached_user(author_id).username == 'author'
+    monkeypatch.setattr(db.session, 'query', query)
+    assert user_cache.get(author_id) is None
+
+def test_login_loader_serves_users_from_cache(app, client, author):
+    fan = User(username='fan', email='fan@example.com')
+    db.session.add(fan)
+    db.session.commit()
+    author_id, fan_id = author.id, fan.id
+    login(client)
+    client.get('/community/cache/stats')
+    assert count_statements(app, lambda: client.get('/community/cache/stats')) == 0  # No user query at all
+
+    stats = client.get('/community/cache/stats').get_json()['users']
+    assert stats['hits'] >= 2 and stats['hit_rate'] > 0
+
+    # Changes to cached columns are visible on the next request
+    notify_follow(author_id, fan_id)
+    assert 'id="notification-badge">1<' in client.get('/community/dashboard').get_data(as_text=True)
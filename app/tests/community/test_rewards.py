@@ -0,0 +1,276 @@
+import bisect
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import pytest
+from app import create_app, init_worker, db
+from app.models.user_models import User, Reward, RewardTransaction
+from app.services.leaderboard_service import Leaderboard, leaderboard, warm_leaderboard
+from app.utils.periodic import run_periodically
+from app.utils.sorted_list import SortedList
+from app.services.ledger_service import seal_ledger, verify_ledger, inclusion_proof, verify_proof
+from app.services.reward_service import (add_reward_points, deduct_reward_points, get_user_rewards, snapshot_balances,
+                                         reward_buffer, RewardBuffer)
+
+@pytest.fixture
+def app(tmp_path):
+    # A file database, so every thread gets its own connection
+    app = create_app({
+        'TESTING': True,
+        'PASSWORD_BCRYPT_ROUNDS': 4,  # Fast hashes for tests
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "rewards.db"}',
+        'SQLALCHEMY_ENGINE_OPTIONS': {'connect_args': {'timeout': 30}},
+    })
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+@pytest.fixture
+def user(app):
+    user = User(username='member', email='member@example.com')
+    user.set_password('secret')
+    db.session.add(user)
+    db.session.commit()
+    return SimpleNamespace(id=user.id)
+
+def run_concurrently(app, count, fn):
+    results = []
+    def worker():
+        with app.app_context():
+            results.append(fn())
+            db.session.remove()
+    threads = [threading.Thread(target=worker) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def test_add_reward_points_loses_no_updates_under_concurrency(app, user):
+    def add_many():
+        for _ in range(25):
+            add_reward_points(user, 2)
+    run_concurrently(app, 8, add_many)
+    assert get_user_rewards(user) == 8 * 25 * 2
+
+def test_deduct_reward_points_never_overdraws(app, user):
+    add_reward_points(user, 100)
+    results = run_concurrently(app, 16, lambda: deduct_reward_points(user, 10))
+    assert results.count(True) == 10
+    assert get_user_rewards(user) == 0
+    assert deduct_reward_points(user, 1) is False
+
+def test_snapshot_folds_ledger_without_changing_balances(app, user):
+    add_reward_points(user, 10, 'post')
+    add_reward_points(user, 5, 'like')
+    assert deduct_reward_points(user, 3)
+
+    assert snapshot_balances() == 1
+    assert Reward.query.filter_by(user_id=user.id).one().points == 12
+    assert get_user_rewards(user) == 12
+
+    add_reward_points(user, 2, 'follow')
+    assert get_user_rewards(user) == 14
+    assert snapshot_balances() == 1
+    assert snapshot_balances() == 0
+    assert get_user_rewards(user) == 14
+    assert [t.delta for t in RewardTransaction.query.order_by(RewardTransaction.id)] == [10, 5, -3, 2]
+
+def test_snapshot_folds_an_entry_that_commits_after_a_higher_id(app, user):
+    db.session.add(RewardTransaction(id=100, user_id=user.id, delta=10, reason='post'))
+    db.session.commit()
+    assert snapshot_balances() == 1
+
+    # Its id was assigned before 100's, but its transaction committed after the snapshot
+    db.session.add(RewardTransaction(id=50, user_id=user.id, delta=5, reason='like'))
+    db.session.commit()
+    assert get_user_rewards(user) == 15
+    assert snapshot_balances() == 1
+    assert Reward.query.filter_by(user_id=user.id).one().points == 15
+    assert get_user_rewards(user) == 15
+
+def test_sealed_ledger_verifies_and_detects_tampering(app, user):
+    for points in range(1, 12):
+        add_reward_points(user, points, 'post')
+
+    assert seal_ledger(batch_size=4) == 2  # The last 3 entries wait for a full batch
+    assert verify_ledger(chunk_size=3) == (True, 'Verified 8 sealed transactions.')
+
+    transaction = RewardTransaction.query.get(6)
+    proof = inclusion_proof(transaction)
+    assert verify_proof(proof['entry_hash'], [(p['side'], p['hash']) for p in proof['path']], proof['merkle_root'])
+    assert inclusion_proof(RewardTransaction.query.get(10)) is None
+
+    client = app.test_client()
+    client.post('/auth/login', data={'username': 'member', 'password': 'secret'})
+    assert client.get('/community/rewards/transactions/6/proof').get_json() == proof
+    assert client.get('/community/rewards/transactions/10/proof').status_code == 409
+
+    transaction.delta = 1000
+    db.session.commit()
+    assert verify_ledger(chunk_size=3) == (False, 'Transaction 6 does not match the hash chain.')
+
+def test_seal_waits_for_a_lower_id_that_commits_late(app, user):
+    def commit_entries(ids, created_at=None):
+        for tx_id in ids:
+            db.session.add(RewardTransaction(id=tx_id, user_id=user.id, delta=tx_id, reason='post',
+                                             created_at=created_at or datetime.utcnow()))
+        db.session.commit()
+
+    commit_entries([1, 2, 4, 5])
+    assert seal_ledger(batch_size=2) == 1  # 3 has not committed yet, so 4 and 5 wait for it
+    commit_entries([3])
+    assert seal_ledger(batch_size=2) == 1
+    assert verify_ledger() == (True, 'Verified 4 sealed transactions.')
+
+    # An id missing for longer than the timeout was rolled back and is skipped
+    commit_entries([7, 8], created_at=datetime.utcnow() - timedelta(minutes=5))
+    assert seal_ledger(batch_size=2) == 1
+    assert verify_ledger() == (True, 'Verified 6 sealed transactions.')
+
+
+# A worker that queues five rewards and dies before flushing them
+CRASHING_WORKER = """
+import json, os, sys
+from types import SimpleNamespace
+from app import create_app, init_worker
+from app.services.reward_service import add_reward_points
+app = create_app(json.loads(sys.argv[1]))
+init_worker(app)
+with app.app_context():
+    for _ in range(5):
+        add_reward_points(SimpleNamespace(id=int(sys.argv[2])), 3, 'like')
+os._exit(0)
+"""
+
+def test_write_behind_journals_per_process_and_replays_crashed_ones(app, user, tmp_path):
+    journal_dir = tmp_path / 'journal'
+    config = {'TESTING': True, 'SQLALCHEMY_DATABASE_URI': app.config['SQLALCHEMY_DATABASE_URI'],
+              'REWARD_WRITE_BEHIND': True, 'REWARD_FLUSH_INTERVAL_MS': 60000,
+              'REWARD_DURABILITY': 'journal', 'REWARD_JOURNAL_DIR': str(journal_dir), 'SUGGEST_REFRESH_INTERVAL': 0}
+    subprocess.run([sys.executable, '-c', CRASHING_WORKER, json.dumps(config), str(user.id)], check=True,
+                   env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)), capture_output=True)
+    assert RewardTransaction.query.count() == 0
+    assert len(list(journal_dir.glob('*.jsonl'))) == 1
+
+    restarted = create_app(config)
+    init_worker(restarted)
+    with restarted.app_context():
+        assert get_user_rewards(user) == 15  # The dead worker's journal was adopted
+
+        # A second live worker leaves this one's journal alone
+        other = RewardBuffer()
+        other.init_app(restarted)
+        other.start()
+        assert other.pending_points(user.id) == 0
+        other.shutdown()
+
+        assert reward_buffer.flush() == 5
+        assert RewardTransaction.query.count() == 5
+    reward_buffer.init_app(app)  # A clean shutdown removes the worker's journal
+    assert list(journal_dir.iterdir()) == []
+    assert get_user_rewards(user) == 15
+
+def test_write_behind_starts_only_in_serving_workers(app, user):
+    app.config.update(REWARD_WRITE_BEHIND=True, SUGGEST_REFRESH_INTERVAL=0)
+    reward_buffer.init_app(app)  # As create_app does, e.g. for a `flask` command
+    add_reward_points(user, 5)
+    assert not reward_buffer.running and RewardTransaction.query.count() == 1
+
+    init_worker(app)
+    add_reward_points(user, 5)
+    assert reward_buffer.running and RewardTransaction.query.count() == 1
+    reward_buffer.shutdown()
+    assert RewardTransaction.query.count() == 2
+
+def test_deduction_waits_for_points_another_worker_has_queued(app, user):
+    app.config.update(REWARD_WRITE_BEHIND=True, REWARD_FLUSH_INTERVAL_MS=50)
+    reward_buffer.init_app(app)
+    other = RewardBuffer()  # Another worker's buffer: its queue is invisible to this one
+    other.init_app(app)
+    other.start()
+    try:
+        other.add({'user_id': user.id, 'delta': 10, 'reason': 'post', 'source_type': None, 'source_id': None})
+        assert reward_buffer.pending_points(user.id) == 0
+        assert deduct_reward_points(user, 10)
+        assert get_user_rewards(user) == 0
+    finally:
+        other.shutdown()
+
+def test_leaderboard_is_rebuilt_and_updated_incrementally(app, user):
+    others = [User(username=f'rival{i}', email=f'rival{i}@example.com') for i in range(2)]
+    db.session.add_all(others)
+    db.session.commit()
+    rivals = [SimpleNamespace(id=other.id) for other in others]
+    add_reward_points(user, 10)
+    add_reward_points(rivals[0], 30)
+    snapshot_balances()
+    add_reward_points(rivals[0], 5)
+
+    warm_leaderboard()
+    assert leaderboard.top(5) == [(1, rivals[0].id, 35), (2, user.id, 10)]
+    assert leaderboard.rank(rivals[1].id) is None
+
+    add_reward_points(rivals[1], 20)
+    add_reward_points(user, 40)
+    assert leaderboard.rank(user.id) == (1, 50)
+    assert leaderboard.rank(rivals[1].id) == (3, 20)
+
+    data = app.test_client().get('/community/api/leaderboard?limit=2').get_json()
+    assert [(e['username'], e['points']) for e in data['leaderboard']] == [('member', 50), ('rival0', 35)]
+
+def test_leaderboard_resync_shows_other_workers_changes(app, user):
+    warm_leaderboard()
+    stop = run_periodically(app, 0.05, warm_leaderboard, 'leaderboard-refresh')
+    try:
+        # Written by another worker, so this process's board is not told
+        db.session.add(RewardTransaction(user_id=user.id, delta=7, reason='post'))
+        db.session.commit()
+        assert leaderboard.rank(user.id) is None
+        deadline = time.monotonic() + 5
+        while leaderboard.rank(user.id) is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert leaderboard.rank(user.id) == (1, 7)
+    finally:
+        stop.set()
+
+def test_leaderboard_ranks_ties_the_same_in_top_and_rank():
+    board = Leaderboard()
+    board.load([(1, 50), (2, 30), (3, 30), (4, 30), (5, 10)])
+    top = board.top(5)
+    assert [rank for rank, _, _ in top] == [1, 2, 2, 2, 5]
+    assert all(board.rank(user_id) == (rank, points) for rank, user_id, points in top)
+
+    board.update(5, 20)
+    assert board.top(5)[1:] == [(2, 2, 30), (2, 3, 30), (2, 4, 30), (2, 5, 30)]
+
+def test_sorted_list_matches_a_plain_sorted_list():
+    rng = random.Random(7)
+    values, reference = SortedList(load=4), []
+    for _ in range(2000):
+        if reference and rng.random() < 0.4:
+            value = rng.choice(reference)
+            values.remove(value)
+            reference.remove(value)
+        else:
+            value = rng.randrange(100)
+            values.add(value)
+            reference.append(value)
+        reference.sort()
+        probe = rng.randrange(100)
+        assert values.bisect_left(probe) == bisect.bisect_left(reference, probe)
+        assert (probe in values) == (probe in reference)
+        assert list(values.iter_from(probe)) == reference[bisect.bisect_left(reference, probe):]
+    assert list(values) == reference and len(values) == len(reference)
+    assert values.head(10) == reference[:10]
+    with pytest.raises(ValueError):
+        values.remove(1000)
+    values.discard(1000)
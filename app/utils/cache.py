@@ -0,0 +1,88 @@
+# app/utils/cache.py
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Thread-safe, in-process LRU cache whose entries also expire after ``ttl`` seconds.
+
+    ``bump()`` advances a generation counter that is part of every key, so all
+    existing entries become unreachable at once without walking the cache;
+    they are evicted as the LRU fills up.
+
+    To fill an entry, take ``token(key)`` before computing the value and pass
+    it to ``set``: if the cache was bumped, or the key invalidated, in between,
+    the value may predate the change and is dropped instead of stored. Keys
+    share ``STRIPES`` invalidation counters, so an unrelated invalidation can
+    occasionally drop a fill too; that only costs a recomputation.
+    """
+
+    STRIPES = 64
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self._lock = threading.Lock()
+        self._versions = [0] * self.STRIPES
+        self.configure(maxsize, ttl)
+
+    def configure(self, maxsize, ttl):
+        """Set the size limit and TTL, dropping every entry and counter."""
+        with self._lock:
+            self.maxsize = maxsize
+            self.ttl = ttl
+            self.generation = 0
+            self.hits = 0
+            self.misses = 0
+            self._entries = OrderedDict()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get((self.generation, key))
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[(self.generation, key)]
+                self.misses += 1
+                return default
+            self._entries.move_to_end((self.generation, key))
+            self.hits += 1
+            return entry[1]
+
+    def _token(self, key):
+        return self.generation, self._versions[hash(key) % self.STRIPES]
+
+    def token(self, key):
+        with self._lock:
+            return self._token(key)
+
+    def set(self, key, value, token=None):
+        with self._lock:
+            if token is not None and token != self._token(key):
+                return
+            full_key = (self.generation, key)
+            self._entries[full_key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(full_key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop((self.generation, key), None)
+            self._versions[hash(key) % self.STRIPES] += 1
+
+    def bump(self):
+        """Invalidate every entry by moving to a new generation."""
+        with self._lock:
+            self.generation += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'generation': self.generation,
+            }
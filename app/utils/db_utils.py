@@ -0,0 +1,85 @@
+# app/utils/db_utils.py
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from app import db
+
+
+def _dialect_insert(table):
+    """Return an INSERT construct for ``table`` that supports conflict clauses."""
+    name = db.engine.dialect.name
+    if name == 'mysql':
+        return mysql.insert(table)
+    if name == 'postgresql':
+        return postgresql.insert(table)
+    if name == 'sqlite':
+        return sqlite.insert(table)
+    raise NotImplementedError(f'Upserts are not supported on {name}')
+
+
+def upsert_add(model, rows, index_elements, columns, replace=()):
+    """Insert ``rows`` into ``model``'s table in one statement.
+
+    When a row collides with an existing one on ``index_elements`` (which must
+    be covered by a unique constraint), the values of ``columns`` are added to
+    the stored ones instead, e.g. ``points = points + 5``, and the columns in
+    ``replace`` are overwritten. The database does the arithmetic, so
+    concurrent callers never lose each other's updates.
+    """
+    if not rows:
+        return
+    table = model.__table__
+    stmt = _dialect_insert(table).values(rows)
+    new = stmt.inserted if db.engine.dialect.name == 'mysql' else stmt.excluded
+    updates = {col: table.c[col] + new[col] for col in columns}
+    updates.update({col: new[col] for col in replace})
+    if db.engine.dialect.name == 'mysql':
+        stmt = stmt.on_duplicate_key_update(updates)
+    else:
+        stmt = stmt.on_conflict_do_update(index_elements=index_elements, set_=updates)
+    db.session.execute(stmt)
+
+
+def _ignore_conflicts(stmt, table):
+    # MySQL's INSERT IGNORE would also turn foreign key, NOT NULL and
+    # too-long-value errors into warnings; a no-op ON DUPLICATE KEY UPDATE
+    # only skips duplicate keys and lets every other error raise
+    if db.engine.dialect.name == 'mysql':
+        key = next(iter(table.primary_key.columns))
+        return stmt.on_duplicate_key_update({key.name: key})
+    return stmt.on_conflict_do_nothing()
+
+
+def insert_ignore(model, rows):
+    """Insert ``rows`` in one statement, skipping any that hit a unique constraint.
+
+    Returns the statement's row count. On MySQL, which counts a skipped row
+    as matched, that is every row; elsewhere it is the rows actually inserted.
+    """
+    if not rows:
+        return 0
+    table = model.__table__
+    return db.session.execute(_ignore_conflicts(_dialect_insert(table).values(rows), table)).rowcount
+
+
+def insert_ignore_from_select(model, columns, select):
+    """``INSERT INTO model (columns) SELECT ...``, skipping rows that hit a unique constraint.
+
+    Returns the statement's row count, as ``insert_ignore`` does.
+    """
+    table = model.__table__
+    stmt = _dialect_insert(table).from_select(columns, select)
+    return db.session.execute(_ignore_conflicts(stmt, table)).rowcount
+
+
+def insert_ignore_one(model, row):
+    """Insert a single row unless it hits a unique constraint.
+
+    Returns the new row's primary key, or None when an equal row already
+    existed. Concurrent callers race on the constraint, not on a prior
+    SELECT, so exactly one of them gets the key.
+    """
+    table = model.__table__
+    result = db.session.execute(_ignore_conflicts(_dialect_insert(table).values(**row), table))
+    if db.engine.dialect.name == 'mysql':
+        # A skipped row still counts as matched, but gets no insert id
+        return result.inserted_primary_key[0] or None
+    return result.inserted_primary_key[0] if result.rowcount else None
@@ -1,21 +1,277 @@
+import atexit
+import queue
+import threading
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import and_, case, or_
 from app.models.notification_models import Notification
+from app.models.user_models import User
+from app.services.stream_service import notification_broker
+from app.services.user_service import invalidate_users
 from app import db
 
+_STOP = object()
+
+
+# Write a batch of notification events and commit. Events for the same
+# (user, action, target) within NOTIFICATION_COALESCE_WINDOW are folded into
+# one unread row ("X and 41 others liked your post"), so the table grows with
+# distinct events rather than raw ones. Every new row bumps the recipient's
+# denormalized unread counter in the same transaction. Recipients with an
+# open event stream are told once the rows are committed. The update-then-
+# insert is not atomic: callers go through NotificationDispatcher, which
+# never writes one user's events from two threads at once.
+def write_notifications(rows, session=None):
+    session = session or db.session
+    window = timedelta(seconds=current_app.config['NOTIFICATION_COALESCE_WINDOW'])
+    groups = {}
+    for row in sorted(rows, key=lambda row: row['created_at']):
+        key = (row['user_id'], row['action'], row['target_id'], row['target_type'])
+        group = groups.get(key)
+        if group is None:
+            groups[key] = dict(row, actor_count=1, window_start=row['created_at'])
+        else:
+            group.update(actor_id=row['actor_id'], created_at=row['created_at'])
+            group['actor_count'] += 1
+
+    new_rows = []
+    unread = {}
+    for (user_id, action, target_id, target_type), group in groups.items():
+        updated = session.query(Notification).filter(
+            Notification.user_id == user_id,
+            Notification.action == action,
+            Notification.target_type == target_type,
+            Notification.target_id == target_id,
+            Notification.window_start >= group['created_at'] - window,
+            Notification.is_read.is_(False),
+        ).update({
+            Notification.actor_count: Notification.actor_count + group['actor_count'],
+            Notification.actor_id: group['actor_id'],
+            Notification.created_at: group['created_at'],
+        }, synchronize_session=False)
+        if not updated:
+            new_rows.append(group)
+    if new_rows:
+        session.execute(Notification.__table__.insert(), new_rows)
+        for row in new_rows:
+            unread[row['user_id']] = unread.get(row['user_id'], 0) + 1
+        for user_id, count in unread.items():
+            session.query(User).filter_by(id=user_id).update(
+                {User.unread_notification_count: User.unread_notification_count + count}, synchronize_session=False)
+    session.commit()
+    invalidate_users(*unread)
+    _publish(groups.values(), session)
+
+
+# Push committed notifications to the recipients' open streams, with their
+# current unread count. Nothing is queried when nobody is listening.
+def _publish(groups, session):
+    groups = list(groups)
+    listening = notification_broker.has_subscribers({group['user_id'] for group in groups})
+    if not listening:
+        return
+    unread = dict(session.query(User.id, User.unread_notification_count).filter(User.id.in_(listening)))
+    for group in groups:
+        if group['user_id'] in listening:
+            notification_broker.publish(group['user_id'], {
+                'action': group['action'],
+                'target_id': group['target_id'],
+                'target_type': group['target_type'],
+                'actor_id': group['actor_id'],
+                'actor_count': group['actor_count'],
+                'unread': unread.get(group['user_id'], 0),
+            })
+
+
+# Inline writes (dispatcher off or full) run in a session of their own, so
+# they never commit or roll back what the calling request has pending
+def _write_inline(rows):
+    session = db.create_session({})()
+    try:
+        write_notifications(rows, session)
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+class NotificationDispatcher:
+    """Writes notifications from background worker threads.
+
+    Requests only put a row on a bounded in-process queue; workers take
+    everything waiting (up to ``NOTIFICATION_BATCH_SIZE`` rows) and insert it
+    with one statement. When the queue is full, producers block for at most
+    ``NOTIFICATION_QUEUE_TIMEOUT`` seconds and then write the row themselves
+    (in a separate session, leaving the request's own untouched), so a burst
+    slows requests down instead of growing memory without limit.
+    ``shutdown`` drains the queue before the workers exit.
+
+    Coalescing is a read-modify-write, so events are sharded by recipient:
+    each of the ``NOTIFICATION_WORKERS`` workers owns one queue and one lock,
+    ``user_id`` picks the shard, and every write for a shard (the worker's,
+    a producer's overflow write, or a synchronous write when the dispatcher
+    is off) holds its lock. Two writers in one process can then never both
+    open a group for the same user. Separate processes can still race; the
+    worst case is two rows for one group.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.enabled = False
+        self._queues = []
+        self._locks = [threading.Lock()]
+        self._workers = []
+        atexit.register(self.shutdown)
+
+    def init_app(self, app):
+        self.shutdown()
+        self.app = app
+        self.enabled = app.config['NOTIFICATION_ASYNC']
+        self.batch_size = app.config['NOTIFICATION_BATCH_SIZE']
+        self.put_timeout = app.config['NOTIFICATION_QUEUE_TIMEOUT']
+        shards = max(1, app.config['NOTIFICATION_WORKERS'])
+        size = max(1, app.config['NOTIFICATION_QUEUE_SIZE'] // shards)
+        self._queues = [queue.Queue(maxsize=size) for _ in range(shards)]
+        self._locks = [threading.Lock() for _ in range(shards)]
+        if not self.enabled:
+            return
+        for shard in range(shards):
+            worker = threading.Thread(target=self._run, args=(shard,), name=f'notification-worker-{shard}', daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def _shard(self, user_id):
+        return user_id % len(self._locks)
+
+    def submit(self, row):
+        """Queue one notification row, or write it now when the dispatcher is off or full."""
+        shard = self._shard(row['user_id'])
+        if self.enabled:
+            try:
+                self._queues[shard].put(row, timeout=self.put_timeout)
+                return
+            except queue.Full:
+                pass
+        with self._locks[shard]:
+            _write_inline([row])
+
+    def _run(self, shard):
+        events = self._queues[shard]
+        stopping = False
+        while not stopping:
+            row = events.get()
+            if row is _STOP:
+                break
+            batch = [row]
+            while len(batch) < self.batch_size:
+                try:
+                    row = events.get_nowait()
+                except queue.Empty:
+                    break
+                if row is _STOP:
+                    stopping = True
+                    break
+                batch.append(row)
+            self._write(shard, batch)
+
+    def _write(self, shard, batch):
+        with self.app.app_context(), self._locks[shard]:
+            try:
+                write_notifications(batch)
+            except Exception:
+                db.session.rollback()
+                self.app.logger.exception('Dropped %d notifications that could not be written', len(batch))
+            finally:
+                db.session.remove()
+
+    def shutdown(self):
+        """Write everything still queued, then stop the workers."""
+        if not self._workers:
+            return
+        for events in self._queues:
+            events.put(_STOP)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+
+
+notification_dispatcher = NotificationDispatcher()
+
+
 # Function to create notifications for likes and follows
-def create_notification(user_id, action, target_id, target_type):
-    notification = Notification(
-        user_id=user_id,
-        action=action,
-        target_id=target_id,
-        target_type=target_type
-    )
-    db.session.add(notification)
-    db.session.commit()
+def create_notification(user_id, action, target_id, target_type, actor_id=None):
+    notification_dispatcher.submit({
+        'user_id': user_id,
+        'action': action,
+        'target_id': target_id,
+        'target_type': target_type,
+        'actor_id': actor_id,
+        'created_at': datetime.utcnow(),
+    })
 
 # Notify user when they get a like
-def notify_like(user_id, post_id):
-    create_notification(user_id, 'liked', post_id, 'post')
+def notify_like(user_id, post_id, liker_id=None):
+    create_notification(user_id, 'liked', post_id, 'post', actor_id=liker_id)
 
-# Notify user when they get a new follower
+# Notify user when they get a new follower (grouped per followed user, so
+# new followers coalesce into "X and N others followed you")
 def notify_follow(user_id, follower_id):
-    create_notification(user_id, 'followed', follower_id, 'user')
+    create_notification(user_id, 'followed', user_id, 'user', actor_id=follower_id)
+
+# Mark one of a user's notifications as read and decrement their unread counter
+def mark_notification_read(user_id, notification_id):
+    marked = Notification.query.filter_by(id=notification_id, user_id=user_id, is_read=False).update(
+        {Notification.is_read: True}, synchronize_session=False)
+    _decrement_unread(user_id, marked)
+    db.session.commit()
+    invalidate_users(user_id)
+    _publish_read(user_id, marked)
+    return bool(marked)
+
+# Mark all of a user's notifications as read in one statement
+def mark_all_notifications_read(user_id):
+    marked = Notification.query.filter_by(user_id=user_id, is_read=False).update(
+        {Notification.is_read: True}, synchronize_session=False)
+    _decrement_unread(user_id, marked)
+    db.session.commit()
+    invalidate_users(user_id)
+    _publish_read(user_id, marked)
+    return marked
+
+# Subtract exactly what was marked (not reset to zero), so notifications that
+# arrive concurrently stay counted. A counter that has drifted below the
+# number marked is clamped at zero rather than left where it was.
+def _decrement_unread(user_id, count):
+    if count:
+        unread = User.unread_notification_count
+        User.query.filter(User.id == user_id).update(
+            {unread: case((unread > count, unread - count), else_=0)}, synchronize_session=False)
+
+# Let the user's other open tabs update their badge
+def _publish_read(user_id, count):
+    if count and notification_broker.has_subscribers({user_id}):
+        unread = db.session.query(User.unread_notification_count).filter_by(id=user_id).scalar()
+        notification_broker.publish(user_id, {'action': 'read', 'unread': unread})
+
+# One page of a user's notifications, newest first. The cursor is
+# "<created_at>_<id>" of the last row shown, so paging is an index range scan.
+def notifications_page(user_id, before=None, per_page=20):
+    query = Notification.query.filter_by(user_id=user_id)
+    try:
+        created_at, notification_id = before.rsplit('_', 1)
+        created_at, notification_id = datetime.fromisoformat(created_at), int(notification_id)
+    except (AttributeError, ValueError):
+        before = None  # Missing or malformed cursor: start from the newest
+    if before:
+        query = query.filter(or_(
+            Notification.created_at < created_at,
+            and_(Notification.created_at == created_at, Notification.id < notification_id),
+        ))
+    items = query.order_by(Notification.created_at.desc(), Notification.id.desc()).limit(per_page + 1).all()
+
+    next_cursor = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        next_cursor = f'{items[-1].created_at.isoformat()}_{items[-1].id}'
+    return items, next_cursor
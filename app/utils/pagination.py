@@ -0,0 +1,33 @@
+# app/utils/pagination.py
+
+
+def keyset_page(query, column, before=None, per_page=20):
+    """Return one page of ``query`` ordered by ``column`` descending.
+
+    Instead of an OFFSET, the page starts just below the ``before`` cursor, so
+    every page is a single indexed range scan no matter how deep the reader
+    goes. Returns ``(items, next_cursor)``; ``next_cursor`` is None on the
+    last page.
+    """
+    if before is not None:
+        query = query.filter(column < before)
+    items = query.order_by(column.desc()).limit(per_page + 1).all()
+
+    next_cursor = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        next_cursor = getattr(items[-1], column.key)
+    return items, next_cursor
+
+
+def keyset_page_after(query, column, after=None, per_page=20):
+    """Like ``keyset_page``, but oldest first, starting just above ``after``."""
+    if after is not None:
+        query = query.filter(column > after)
+    items = query.order_by(column).limit(per_page + 1).all()
+
+    next_cursor = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        next_cursor = getattr(items[-1], column.key)
+    return items, next_cursor
@@ -0,0 +1,125 @@
+# app/utils/passwords.py
+import atexit
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import bcrypt
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# Password hashes are made with PASSWORD_HASH_METHOD ('bcrypt' or 'pbkdf2')
+# at the configured cost. Hashes made with another method or cost still
+# verify, and needs_rehash() tells the login route to replace them.
+
+
+def hash_settings():
+    """The configured ``(method, cost)``, for hashing outside the app context."""
+    config = current_app.config
+    if config['PASSWORD_HASH_METHOD'] == 'bcrypt':
+        return 'bcrypt', config['PASSWORD_BCRYPT_ROUNDS']
+    return 'pbkdf2', config['PASSWORD_PBKDF2_ITERATIONS']
+
+
+def make_hash(method, cost, password):
+    """Hash ``password`` with an explicit method and cost (safe to run in a worker process)."""
+    if method == 'bcrypt':
+        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=cost)).decode('ascii')
+    return generate_password_hash(password, method=f'pbkdf2:sha256:{cost}')
+
+
+def hash_password(password):
+    """Hash ``password`` with the configured method and cost."""
+    return make_hash(*hash_settings(), password)
+
+
+def verify_password(password_hash, password):
+    """Check ``password`` against a bcrypt or werkzeug hash."""
+    if not password_hash:
+        return False
+    if password_hash.startswith('$2'):
+        return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('ascii'))
+    return check_password_hash(password_hash, password)
+
+
+def needs_rehash(password_hash):
+    """Whether a hash was made with another method or cost than configured."""
+    config = current_app.config
+    if config['PASSWORD_HASH_METHOD'] == 'bcrypt':
+        # "$2b$<rounds>$<salt and hash>"
+        parts = password_hash.split('$')
+        return not password_hash.startswith('$2') or int(parts[2]) != config['PASSWORD_BCRYPT_ROUNDS']
+    return password_hash.split('$', 1)[0] != f"pbkdf2:sha256:{config['PASSWORD_PBKDF2_ITERATIONS']}"
+
+
+class HasherBusy(Exception):
+    """Raised when every password hashing slot is taken."""
+
+
+class PasswordHasher:
+    """Runs password hashing on a small, bounded thread pool.
+
+    At most ``PASSWORD_HASH_WORKERS`` hashes run at once (bcrypt and PBKDF2
+    release the GIL, so size it to the cores that may be spent on logins),
+    and at most ``PASSWORD_HASH_QUEUE`` more may wait. Anything beyond that
+    raises ``HasherBusy`` at once, so a burst of logins is turned away
+    instead of piling up threads and starving every other request.
+    """
+
+    def __init__(self):
+        self.app = None
+        self._executor = None
+        self._slots = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        atexit.register(self.shutdown)
+
+    def init_app(self, app):
+        self.shutdown()
+        self.app = app
+        self.workers = app.config['PASSWORD_HASH_WORKERS']
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password-hasher')
+        self._slots = threading.BoundedSemaphore(self.workers + app.config['PASSWORD_HASH_QUEUE'])
+
+    def run(self, fn, *args):
+        """Run ``fn(*args)`` on the pool and wait for its result."""
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy()
+        with self._lock:
+            self._in_flight += 1
+        try:
+            return self._executor.submit(self._call, fn, *args).result()
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            self._slots.release()
+
+    def _call(self, fn, *args):
+        with self.app.app_context():
+            return fn(*args)
+
+    def hash(self, password):
+        return self.run(hash_password, password)
+
+    def verify(self, password_hash, password):
+        return self.run(verify_password, password_hash, password)
+
+    def rehash(self, password):
+        """Hash ``password`` if a worker is idle right now, else return None.
+
+        Upgrading a stale hash can wait for a later login, so during a burst
+        it neither queues behind nor delays the logins that must be checked.
+        """
+        with self._lock:
+            if self._in_flight >= self.workers:
+                return None
+        try:
+            return self.hash(password)
+        except HasherBusy:
+            return None
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,24 @@
+# app/utils/periodic.py
+import threading
+
+
+def run_periodically(app, interval, func, name):
+    """Call ``func`` in an app context every ``interval`` seconds on a daemon thread.
+
+    Used to re-read per-process in-memory indexes from the database, which
+    bounds how far they drift from what other workers have written. A failed
+    run is logged and retried at the next interval. Returns an Event that
+    stops the thread when set.
+    """
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(interval):
+            try:
+                with app.app_context():
+                    func()
+            except Exception:
+                app.logger.exception('Periodic task %s failed', name)
+
+    threading.Thread(target=loop, name=name, daemon=True).start()
+    return stop
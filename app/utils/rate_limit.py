@@ -0,0 +1,122 @@
+# app/utils/rate_limit.py
+import math
+import threading
+import time
+from collections import OrderedDict
+
+# Token buckets for throttling login and registration attempts. A bucket holds
+# up to ``capacity`` tokens and refills at ``capacity / period`` tokens a
+# second; every attempt takes one, and an empty bucket means "retry after the
+# next token arrives". Buckets live in a backend: MemoryBackend for a single
+# process, RedisBackend to share them between workers.
+
+
+class MemoryBackend:
+    """Buckets in a bounded in-process LRU map.
+
+    Each bucket is a ``(tokens, last_refill)`` pair. When ``max_keys`` is
+    exceeded the least recently used bucket is dropped; an idle bucket has
+    usually refilled by then, so forgetting it loses nothing.
+    """
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+
+    def take(self, key, capacity, rate):
+        """Take a token; return 0 if one was available, else seconds until the next."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, stamp = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - stamp) * rate)
+            retry_after = 0 if tokens >= 1 else (1 - tokens) / rate
+            if not retry_after:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return retry_after
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class RedisBackend:
+    """Buckets in Redis, shared by every worker.
+
+    The refill and take run in one Lua script against the server's clock, so
+    concurrent workers never race or disagree on time. Buckets expire once
+    they would be full again. Needs the ``redis`` package.
+    """
+
+    SCRIPT = """
+    local capacity = tonumber(ARGV[1])
+    local rate = tonumber(ARGV[2])
+    local clock = redis.call('TIME')
+    local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'stamp')
+    local tokens = tonumber(state[1]) or capacity
+    local stamp = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + (now - stamp) * rate)
+    local retry_after = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+    else
+        retry_after = (1 - tokens) / rate
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'stamp', tostring(now))
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+    return tostring(retry_after)
+    """
+
+    def __init__(self, url, prefix='ratelimit:'):
+        import redis  # Only needed when this backend is configured
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+        self._take = self._client.register_script(self.SCRIPT)
+
+    def take(self, key, capacity, rate):
+        return float(self._take(keys=[self.prefix + key], args=[capacity, rate]))
+
+
+class RateLimiter:
+    """Checks request attempts against the buckets configured per action.
+
+    ``RATELIMIT_RULES`` maps an action (e.g. 'login') to ``{scope: (capacity,
+    period seconds)}``, where a scope is 'ip' or 'username'. ``check`` runs
+    before any database or hashing work and returns the seconds to wait, or
+    0 when the attempt may go ahead. Behind a reverse proxy, wrap the app in
+    werkzeug's ProxyFix so the 'ip' key is the client's address.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.rules = {}
+        self.backend = None
+
+    def init_app(self, app):
+        self.enabled = app.config['RATELIMIT_ENABLED']
+        self.rules = app.config['RATELIMIT_RULES']
+        backend = app.config['RATELIMIT_BACKEND']
+        if backend == 'memory':
+            self.backend = MemoryBackend(app.config['RATELIMIT_MAX_KEYS'])
+        elif backend == 'redis':
+            self.backend = RedisBackend(app.config['RATELIMIT_REDIS_URL'])
+        else:
+            self.backend = backend  # Any object with the MemoryBackend.take() signature
+
+    def check(self, action, **keys):
+        if not self.enabled:
+            return 0
+        for scope, (capacity, period) in self.rules.get(action, {}).items():
+            value = keys.get(scope)
+            if not value:
+                continue
+            retry_after = self.backend.take(f'{action}:{scope}:{value}', capacity, capacity / period)
+            if retry_after:
+                return math.ceil(retry_after)
+        return 0
+
+
+rate_limiter = RateLimiter()
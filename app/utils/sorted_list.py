@@ -0,0 +1,129 @@
+# app/utils/sorted_list.py
+from bisect import bisect_left, insort
+from itertools import chain, islice
+
+
+class SortedList:
+    """A sorted list of comparable values with cheap inserts and removals.
+
+    Values are kept in a list of short sorted sublists (at most
+    ``2 * load`` values each) plus the maximum of every sublist. Finding a
+    value is a binary search over the maxima and then one sublist, and an
+    insert or removal only shifts the values of that one sublist, so updates
+    stay cheap however many values there are. A Fenwick tree over the
+    sublist lengths gives the position of a sublist's first value in
+    O(log n), so ``bisect_left`` is O(log n) as well; it is rebuilt only
+    when a sublist is split or dropped. Not thread-safe; callers lock.
+    """
+
+    def __init__(self, values=(), load=500):
+        self.load = load
+        values = sorted(values)
+        self._lists = [values[i:i + load] for i in range(0, len(values), load)]
+        self._maxes = [sublist[-1] for sublist in self._lists]
+        self._len = len(values)
+        self._build_index()
+
+    def _build_index(self):
+        # 1-based Fenwick tree: _index[i] sums the lengths of a run of sublists ending at i - 1
+        index = [0] + [len(sublist) for sublist in self._lists]
+        for i in range(1, len(index)):
+            parent = i + (i & -i)
+            if parent < len(index):
+                index[parent] += index[i]
+        self._index = index
+
+    def _resize(self, pos, delta):
+        i = pos + 1
+        while i < len(self._index):
+            self._index[i] += delta
+            i += i & -i
+
+    def _offset(self, pos):
+        # Number of values in the sublists before ``pos``
+        total, i = 0, pos
+        while i:
+            total += self._index[i]
+            i -= i & -i
+        return total
+
+    def add(self, value):
+        if not self._lists:
+            self._lists.append([value])
+            self._maxes.append(value)
+            self._build_index()
+        else:
+            pos = bisect_left(self._maxes, value)
+            if pos == len(self._maxes):
+                pos -= 1
+                self._lists[pos].append(value)
+                self._maxes[pos] = value
+            else:
+                insort(self._lists[pos], value)
+            sublist = self._lists[pos]
+            if len(sublist) > 2 * self.load:
+                # Split in halves so no sublist grows without bound
+                self._lists[pos:pos + 1] = [sublist[:self.load], sublist[self.load:]]
+                self._maxes[pos:pos + 1] = [sublist[self.load - 1], sublist[-1]]
+                self._build_index()
+            else:
+                self._resize(pos, 1)
+        self._len += 1
+
+    def remove(self, value):
+        """Remove one occurrence of ``value``; raise ValueError if absent."""
+        pos = bisect_left(self._maxes, value)
+        if pos == len(self._maxes):
+            raise ValueError(f'{value!r} not in list')
+        sublist = self._lists[pos]
+        i = bisect_left(sublist, value)
+        if sublist[i] != value:
+            raise ValueError(f'{value!r} not in list')
+        del sublist[i]
+        if sublist:
+            self._maxes[pos] = sublist[-1]
+            self._resize(pos, -1)
+        else:
+            del self._lists[pos]
+            del self._maxes[pos]
+            self._build_index()
+        self._len -= 1
+
+    def discard(self, value):
+        """Remove one occurrence of ``value`` if there is one."""
+        try:
+            self.remove(value)
+        except ValueError:
+            pass
+
+    def bisect_left(self, value):
+        """Index at which ``value`` would be inserted before any equal values."""
+        pos = bisect_left(self._maxes, value)
+        if pos == len(self._maxes):
+            return self._len
+        return self._offset(pos) + bisect_left(self._lists[pos], value)
+
+    def head(self, n):
+        """The ``n`` smallest values, in order."""
+        return list(islice(chain.from_iterable(self._lists), n))
+
+    def iter_from(self, value):
+        """Iterate over the values >= ``value``, in order."""
+        pos = bisect_left(self._maxes, value)
+        if pos == len(self._maxes):
+            return iter(())
+        start = bisect_left(self._lists[pos], value)
+        return chain(islice(self._lists[pos], start, None), chain.from_iterable(islice(self._lists, pos + 1, None)))
+
+    def __contains__(self, value):
+        pos = bisect_left(self._maxes, value)
+        if pos == len(self._maxes):
+            return False
+        sublist = self._lists[pos]
+        return sublist[bisect_left(sublist, value)] == value
+
+    def __iter__(self):
+        return chain.from_iterable(self._lists)
+
+    def __len__(self):
+        return self._len
@@ -0,0 +1,74 @@
+"""Materialized home timelines
+
+Creates timeline_entry, adds User.fanout_on_read and the index on
+Follow.followed_id that fan-out selects followers by. Timelines are filled
+with what fan-out on write would have produced: every user's own posts plus
+the posts of everyone they follow. Authors with more than
+TIMELINE_FANOUT_LIMIT followers are switched to fan-out on read instead.
+
+Revision ID: 1c8d5f2a9e63
+Revises: 9f3b6c1e0a47
+Create Date: 2024-11-18 11:29:40.918265
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from flask import current_app
+
+
+# revision identifiers, used by Alembic.
+revision = '1c8d5f2a9e63'
+down_revision = '9f3b6c1e0a47'
+branch_labels = None
+depends_on = None
+
+
+user = sa.table('user', sa.column('id'), sa.column('fanout_on_read'))
+post = sa.table('post', sa.column('id'), sa.column('user_id'))
+follow = sa.table('follow', sa.column('follower_id'), sa.column('followed_id'))
+timeline_entry = sa.table('timeline_entry', sa.column('user_id'), sa.column('post_id'), sa.column('author_id'))
+
+
+def upgrade():
+    op.create_table(
+        'timeline_entry',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('post_id', sa.Integer(), nullable=False),
+        sa.Column('author_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['author_id'], ['user.id']),
+        sa.ForeignKeyConstraint(['post_id'], ['post.id']),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id']),
+        sa.PrimaryKeyConstraint('user_id', 'post_id'),
+    )
+    op.create_index('ix_timeline_entry_post_id', 'timeline_entry', ['post_id'])
+    op.create_index('ix_timeline_entry_user_id_author_id', 'timeline_entry', ['user_id', 'author_id'])
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.add_column(sa.Column('fanout_on_read', sa.Boolean(), nullable=False, server_default=sa.false()))
+    with op.batch_alter_table('follow') as batch_op:
+        batch_op.create_index('ix_follow_followed_id', ['followed_id'])
+
+    followers = (sa.select(sa.func.count(sa.distinct(follow.c.follower_id)))
+                 .where(follow.c.followed_id == user.c.id, follow.c.follower_id != user.c.id)
+                 .scalar_subquery())
+    op.execute(user.update().where(followers > current_app.config['TIMELINE_FANOUT_LIMIT'])
+               .values(fanout_on_read=sa.true()))
+
+    columns = ['user_id', 'post_id', 'author_id']
+    own = sa.select(post.c.user_id, post.c.id, post.c.user_id).where(post.c.user_id.isnot(None))
+    op.execute(timeline_entry.insert().from_select(columns, own))
+    # DISTINCT, because duplicate follows may still exist at this revision
+    followed = (sa.select(follow.c.follower_id, post.c.id, post.c.user_id).distinct()
+                .select_from(follow.join(post, post.c.user_id == follow.c.followed_id)
+                             .join(user, user.c.id == follow.c.followed_id))
+                .where(follow.c.follower_id != follow.c.followed_id, user.c.fanout_on_read == sa.false()))
+    op.execute(timeline_entry.insert().from_select(columns, followed))
+
+
+def downgrade():
+    with op.batch_alter_table('follow') as batch_op:
+        batch_op.drop_index('ix_follow_followed_id')
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.drop_column('fanout_on_read')
+    op.drop_index('ix_timeline_entry_user_id_author_id', table_name='timeline_entry')
+    op.drop_index('ix_timeline_entry_post_id', table_name='timeline_entry')
+    op.drop_table('timeline_entry')
@@ -0,0 +1,44 @@
+"""One reward balance row per user
+
+Merges the duplicate Reward rows that the old read-then-insert award path
+could create (each user keeps their oldest row, holding the sum of all their
+rows' points), then adds the unique constraint on Reward.user_id that the
+single-statement point updates rely on.
+
+Revision ID: 3b8e61d0c2f7
+Revises: 8c2e5b3f1a09
+Create Date: 2024-11-06 14:27:53.660418
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b8e61d0c2f7'
+down_revision = '8c2e5b3f1a09'
+branch_labels = None
+depends_on = None
+
+
+reward = sa.table('reward', sa.column('id'), sa.column('user_id'), sa.column('points'))
+
+
+def upgrade():
+    bind = op.get_bind()
+    duplicates = bind.execute(
+        sa.select(reward.c.user_id, sa.func.min(reward.c.id), sa.func.sum(sa.func.coalesce(reward.c.points, 0)))
+        .group_by(reward.c.user_id)
+        .having(sa.func.count() > 1)
+    ).all()
+    for user_id, keep_id, points in duplicates:
+        bind.execute(reward.update().where(reward.c.id == keep_id).values(points=points))
+        bind.execute(reward.delete().where(reward.c.user_id == user_id, reward.c.id != keep_id))
+
+    with op.batch_alter_table('reward') as batch_op:
+        batch_op.create_unique_constraint('uq_reward_user_id', ['user_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('reward') as batch_op:
+        batch_op.drop_constraint('uq_reward_user_id', type_='unique')
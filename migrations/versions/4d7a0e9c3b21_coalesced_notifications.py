@@ -0,0 +1,46 @@
+"""Coalesced notifications
+
+Adds Notification.actor_id, actor_count and window_start, and the indexes
+behind dashboard paging and coalescing. Every existing notification becomes
+a group of one event whose window opened when it was created.
+
+Revision ID: 4d7a0e9c3b21
+Revises: e2c94d1b6f58
+Create Date: 2024-11-14 09:47:12.380519
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4d7a0e9c3b21'
+down_revision = 'e2c94d1b6f58'
+branch_labels = None
+depends_on = None
+
+
+notification = sa.table('notification', sa.column('created_at'), sa.column('window_start'))
+
+
+def upgrade():
+    with op.batch_alter_table('notification') as batch_op:
+        batch_op.add_column(sa.Column('actor_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('actor_count', sa.Integer(), nullable=False, server_default='1'))
+        batch_op.add_column(sa.Column('window_start', sa.DateTime(), nullable=True))
+        batch_op.create_foreign_key('fk_notification_actor_id_user', 'user', ['actor_id'], ['id'])
+        batch_op.create_index('ix_notification_user_id_created_at', ['user_id', 'created_at'])
+        batch_op.create_index('ix_notification_coalesce',
+                              ['user_id', 'action', 'target_type', 'target_id', 'window_start'])
+
+    op.execute(notification.update().values(window_start=notification.c.created_at))
+
+
+def downgrade():
+    with op.batch_alter_table('notification') as batch_op:
+        batch_op.drop_index('ix_notification_coalesce')
+        batch_op.drop_index('ix_notification_user_id_created_at')
+        batch_op.drop_constraint('fk_notification_actor_id_user', type_='foreignkey')
+        batch_op.drop_column('window_start')
+        batch_op.drop_column('actor_count')
+        batch_op.drop_column('actor_id')
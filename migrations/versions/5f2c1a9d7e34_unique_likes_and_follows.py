@@ -0,0 +1,62 @@
+"""Unique likes and follows
+
+Removes duplicate Like and Follow rows left behind by the old
+check-then-insert routes, then adds the unique constraints that make liking
+and following single idempotent INSERTs. Follow counters are recomputed from
+the deduplicated rows.
+
+Revision ID: 5f2c1a9d7e34
+Revises: a6b2e8f4c175
+Create Date: 2024-11-20 10:12:41.318205
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5f2c1a9d7e34'
+down_revision = 'a6b2e8f4c175'
+branch_labels = None
+depends_on = None
+
+
+like = sa.table('like', sa.column('id'), sa.column('user_id'), sa.column('post_id'))
+follow = sa.table('follow', sa.column('id'), sa.column('follower_id'), sa.column('followed_id'))
+user = sa.table('user', sa.column('id'), sa.column('follower_count'), sa.column('following_count'))
+
+
+def _delete_duplicates(table, *key):
+    # Keep the oldest row of every group. The ids to keep are wrapped in a
+    # derived table because MySQL can't select from the table it deletes from.
+    keep = sa.select(sa.func.min(table.c.id).label('id')).group_by(*key).subquery('keep')
+    op.execute(table.delete().where(table.c.id.notin_(sa.select(keep.c.id))))
+
+
+def upgrade():
+    _delete_duplicates(like, like.c.user_id, like.c.post_id)
+    _delete_duplicates(follow, follow.c.follower_id, follow.c.followed_id)
+
+    op.execute(user.update().values(
+        follower_count=sa.select(sa.func.count(follow.c.id))
+        .where(follow.c.followed_id == user.c.id).scalar_subquery(),
+        following_count=sa.select(sa.func.count(follow.c.id))
+        .where(follow.c.follower_id == user.c.id).scalar_subquery(),
+    ))
+
+    with op.batch_alter_table('like') as batch_op:
+        batch_op.create_unique_constraint('uq_like_user_id_post_id', ['user_id', 'post_id'])
+
+    # The unique constraint replaces the plain lookup index
+    with op.batch_alter_table('follow') as batch_op:
+        batch_op.drop_index('ix_follow_follower_id_followed_id')
+        batch_op.create_unique_constraint('uq_follow_follower_id_followed_id', ['follower_id', 'followed_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('follow') as batch_op:
+        batch_op.drop_constraint('uq_follow_follower_id_followed_id', type_='unique')
+        batch_op.create_index('ix_follow_follower_id_followed_id', ['follower_id', 'followed_id'])
+
+    with op.batch_alter_table('like') as batch_op:
+        batch_op.drop_constraint('uq_like_user_id_post_id', type_='unique')
@@ -0,0 +1,54 @@
+"""Reward ledger
+
+Creates the append-only reward_transaction ledger and the reward_snapshot
+log, and adds Reward.last_transaction_id. Existing balances become the first
+snapshot: their points stay in Reward.points with a watermark of 0.
+
+Revision ID: 6a0d93e4b7c1
+Revises: 3b8e61d0c2f7
+Create Date: 2024-11-08 10:31:46.113892
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6a0d93e4b7c1'
+down_revision = '3b8e61d0c2f7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('reward') as batch_op:
+        batch_op.add_column(sa.Column('last_transaction_id', sa.Integer(), nullable=False, server_default='0'))
+
+    op.create_table(
+        'reward_transaction',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('delta', sa.Integer(), nullable=False),
+        sa.Column('reason', sa.String(length=50), nullable=False),
+        sa.Column('source_type', sa.String(length=50), nullable=True),
+        sa.Column('source_id', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_reward_transaction_user_id_id', 'reward_transaction', ['user_id', 'id'])
+    op.create_table(
+        'reward_snapshot',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('last_transaction_id', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+
+
+def downgrade():
+    op.drop_table('reward_snapshot')
+    op.drop_index('ix_reward_transaction_user_id_id', table_name='reward_transaction')
+    op.drop_table('reward_transaction')
+    with op.batch_alter_table('reward') as batch_op:
+        batch_op.drop_column('last_transaction_id')
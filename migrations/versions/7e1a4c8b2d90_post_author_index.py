@@ -0,0 +1,29 @@
+"""Post author index
+
+Adds the (user_id, id) index on Post that reads an author's newest posts
+when fan-out-on-read authors are merged into a timeline.
+
+Revision ID: 7e1a4c8b2d90
+Revises: 1c8d5f2a9e63
+Create Date: 2024-11-18 16:12:03.664107
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7e1a4c8b2d90'
+down_revision = '1c8d5f2a9e63'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('post') as batch_op:
+        batch_op.create_index('ix_post_user_id_id', ['user_id', 'id'])
+
+
+def downgrade():
+    with op.batch_alter_table('post') as batch_op:
+        batch_op.drop_index('ix_post_user_id_id')
@@ -0,0 +1,59 @@
+"""Inverted search index
+
+Creates the search_term, search_posting and search_stats tables behind the
+BM25 post search. Terms use a binary collation on MySQL, so tokens that only
+differ by accent or case stay distinct keys. The index starts empty: run
+`flask search reindex` once after upgrading.
+
+Revision ID: 8c2e5b3f1a09
+Revises: d41f0a7c9e12
+Create Date: 2024-10-30 15:42:08.871250
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+
+
+# revision identifiers, used by Alembic.
+revision = '8c2e5b3f1a09'
+down_revision = 'd41f0a7c9e12'
+branch_labels = None
+depends_on = None
+
+
+def _term():
+    return sa.String(length=64).with_variant(mysql.VARCHAR(64, collation='utf8mb4_bin'), 'mysql')
+
+
+def upgrade():
+    op.create_table(
+        'search_term',
+        sa.Column('term', _term(), nullable=False),
+        sa.Column('doc_freq', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('term'),
+    )
+    op.create_table(
+        'search_posting',
+        sa.Column('term', _term(), nullable=False),
+        sa.Column('post_id', sa.Integer(), nullable=False),
+        sa.Column('term_freq', sa.Integer(), nullable=False),
+        sa.Column('doc_length', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['post_id'], ['post.id']),
+        sa.PrimaryKeyConstraint('term', 'post_id'),
+    )
+    op.create_index('ix_search_posting_post_id', 'search_posting', ['post_id'])
+    op.create_table(
+        'search_stats',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('doc_count', sa.Integer(), nullable=False),
+        sa.Column('total_length', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+    )
+
+
+def downgrade():
+    op.drop_table('search_stats')
+    op.drop_index('ix_search_posting_post_id', table_name='search_posting')
+    op.drop_table('search_posting')
+    op.drop_table('search_term')
@@ -0,0 +1,42 @@
+"""Unread notification counter
+
+Adds Notification.is_read and the denormalized User.unread_notification_count.
+Existing notifications start unread, and every counter is computed from them.
+
+Revision ID: 9f3b6c1e0a47
+Revises: 4d7a0e9c3b21
+Create Date: 2024-11-15 14:06:55.731840
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9f3b6c1e0a47'
+down_revision = '4d7a0e9c3b21'
+branch_labels = None
+depends_on = None
+
+
+notification = sa.table('notification', sa.column('id'), sa.column('user_id'), sa.column('is_read'))
+user = sa.table('user', sa.column('id'), sa.column('unread_notification_count'))
+
+
+def upgrade():
+    with op.batch_alter_table('notification') as batch_op:
+        batch_op.add_column(sa.Column('is_read', sa.Boolean(), nullable=False, server_default=sa.false()))
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.add_column(sa.Column('unread_notification_count', sa.Integer(), nullable=False, server_default='0'))
+
+    op.execute(user.update().values(
+        unread_notification_count=sa.select(sa.func.count(notification.c.id))
+        .where(notification.c.user_id == user.c.id, notification.c.is_read == sa.false()).scalar_subquery(),
+    ))
+
+
+def downgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.drop_column('unread_notification_count')
+    with op.batch_alter_table('notification') as batch_op:
+        batch_op.drop_column('is_read')
@@ -0,0 +1,49 @@
+"""Follower and following counters
+
+Adds the denormalized User.follower_count and User.following_count,
+computed from the existing follows, User.created_at, and the
+(follower_id, followed_id) index that "am I following X?" is answered from.
+
+Revision ID: a6b2e8f4c175
+Revises: 7e1a4c8b2d90
+Create Date: 2024-11-19 10:58:27.405913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6b2e8f4c175'
+down_revision = '7e1a4c8b2d90'
+branch_labels = None
+depends_on = None
+
+
+follow = sa.table('follow', sa.column('id'), sa.column('follower_id'), sa.column('followed_id'))
+user = sa.table('user', sa.column('id'), sa.column('follower_count'), sa.column('following_count'))
+
+
+def upgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.add_column(sa.Column('follower_count', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('following_count', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('created_at', sa.DateTime(), nullable=True))
+    with op.batch_alter_table('follow') as batch_op:
+        batch_op.create_index('ix_follow_follower_id_followed_id', ['follower_id', 'followed_id'])
+
+    op.execute(user.update().values(
+        follower_count=sa.select(sa.func.count(follow.c.id))
+        .where(follow.c.followed_id == user.c.id).scalar_subquery(),
+        following_count=sa.select(sa.func.count(follow.c.id))
+        .where(follow.c.follower_id == user.c.id).scalar_subquery(),
+    ))
+
+
+def downgrade():
+    with op.batch_alter_table('follow') as batch_op:
+        batch_op.drop_index('ix_follow_follower_id_followed_id')
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.drop_column('created_at')
+        batch_op.drop_column('following_count')
+        batch_op.drop_column('follower_count')
@@ -0,0 +1,48 @@
+"""Post like and comment counters, comment paging index
+
+Adds Post.like_count and Post.comment_count, filled from the existing likes
+and comments, and Comment.created_at with the (post_id, id) index that
+comment pages are read from.
+
+Revision ID: a83d4e6b1c20
+Revises: 5f2c1a9d7e34
+Create Date: 2024-11-22 16:40:05.902114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a83d4e6b1c20'
+down_revision = '5f2c1a9d7e34'
+branch_labels = None
+depends_on = None
+
+
+post = sa.table('post', sa.column('id'), sa.column('like_count'), sa.column('comment_count'))
+like = sa.table('like', sa.column('post_id'))
+comment = sa.table('comment', sa.column('post_id'))
+
+
+def upgrade():
+    with op.batch_alter_table('post') as batch_op:
+        batch_op.add_column(sa.Column('like_count', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('comment_count', sa.Integer(), nullable=False, server_default='0'))
+    with op.batch_alter_table('comment') as batch_op:
+        batch_op.add_column(sa.Column('created_at', sa.DateTime(), nullable=True))
+        batch_op.create_index('ix_comment_post_id_id', ['post_id', 'id'])
+
+    op.execute(post.update().values(
+        like_count=sa.select(sa.func.count()).where(like.c.post_id == post.c.id).scalar_subquery(),
+        comment_count=sa.select(sa.func.count()).where(comment.c.post_id == post.c.id).scalar_subquery(),
+    ))
+
+
+def downgrade():
+    with op.batch_alter_table('comment') as batch_op:
+        batch_op.drop_index('ix_comment_post_id_id')
+        batch_op.drop_column('created_at')
+    with op.batch_alter_table('post') as batch_op:
+        batch_op.drop_column('comment_count')
+        batch_op.drop_column('like_count')
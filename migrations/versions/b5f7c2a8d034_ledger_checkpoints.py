@@ -0,0 +1,43 @@
+"""Hash-chained ledger and Merkle checkpoints
+
+Adds RewardTransaction.entry_hash and the ledger_checkpoint table. Entries
+are chained and checkpointed by `flask rewards seal`.
+
+Revision ID: b5f7c2a8d034
+Revises: 6a0d93e4b7c1
+Create Date: 2024-11-11 13:18:02.547361
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5f7c2a8d034'
+down_revision = '6a0d93e4b7c1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('reward_transaction') as batch_op:
+        batch_op.add_column(sa.Column('entry_hash', sa.String(length=64), nullable=True))
+
+    op.create_table(
+        'ledger_checkpoint',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('first_transaction_id', sa.Integer(), nullable=False),
+        sa.Column('last_transaction_id', sa.Integer(), nullable=False),
+        sa.Column('size', sa.Integer(), nullable=False),
+        sa.Column('merkle_root', sa.String(length=64), nullable=False),
+        sa.Column('chain_hash', sa.String(length=64), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('last_transaction_id', name='uq_ledger_checkpoint_last_transaction_id'),
+    )
+
+
+def downgrade():
+    op.drop_table('ledger_checkpoint')
+    with op.batch_alter_table('reward_transaction') as batch_op:
+        batch_op.drop_column('entry_hash')
@@ -0,0 +1,38 @@
+"""Threaded comments
+
+Adds Comment.parent_id, the materialized Comment.path and Comment.depth, and
+the (post_id, path) index subtrees are read from. Existing comments become
+top-level comments, which is what the defaults describe.
+
+Revision ID: c1e7f09b5a46
+Revises: a83d4e6b1c20
+Create Date: 2024-11-25 09:03:27.551873
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c1e7f09b5a46'
+down_revision = 'a83d4e6b1c20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('comment') as batch_op:
+        batch_op.add_column(sa.Column('parent_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('path', sa.String(length=255), nullable=False, server_default=''))
+        batch_op.add_column(sa.Column('depth', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.create_foreign_key('fk_comment_parent_id_comment', 'comment', ['parent_id'], ['id'])
+        batch_op.create_index('ix_comment_post_id_path', ['post_id', 'path'])
+
+
+def downgrade():
+    with op.batch_alter_table('comment') as batch_op:
+        batch_op.drop_index('ix_comment_post_id_path')
+        batch_op.drop_constraint('fk_comment_parent_id_comment', type_='foreignkey')
+        batch_op.drop_column('depth')
+        batch_op.drop_column('path')
+        batch_op.drop_column('parent_id')
@@ -0,0 +1,38 @@
+"""Post excerpts and creation times
+
+Adds the stored Post.excerpt that list views read instead of the full body,
+filled from the existing posts, and Post.created_at.
+
+Revision ID: d41f0a7c9e12
+Revises: 0b3a9e57d21c
+Create Date: 2024-10-28 11:05:19.204713
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd41f0a7c9e12'
+down_revision = '0b3a9e57d21c'
+branch_labels = None
+depends_on = None
+
+
+EXCERPT_LENGTH = 200  # app.models.post_models.EXCERPT_LENGTH when this revision was written
+
+post = sa.table('post', sa.column('content'), sa.column('excerpt'))
+
+
+def upgrade():
+    with op.batch_alter_table('post') as batch_op:
+        batch_op.add_column(sa.Column('excerpt', sa.String(length=EXCERPT_LENGTH), nullable=True))
+        batch_op.add_column(sa.Column('created_at', sa.DateTime(), nullable=True))
+
+    op.execute(post.update().values(excerpt=sa.func.substr(post.c.content, 1, EXCERPT_LENGTH)))
+
+
+def downgrade():
+    with op.batch_alter_table('post') as batch_op:
+        batch_op.drop_column('created_at')
+        batch_op.drop_column('excerpt')
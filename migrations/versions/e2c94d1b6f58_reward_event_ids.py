@@ -0,0 +1,31 @@
+"""Reward event ids
+
+Adds the unique RewardTransaction.event_id that keeps a replayed write-behind
+journal from applying an entry twice. Existing entries have none.
+
+Revision ID: e2c94d1b6f58
+Revises: b5f7c2a8d034
+Create Date: 2024-11-12 17:54:31.026448
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2c94d1b6f58'
+down_revision = 'b5f7c2a8d034'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('reward_transaction') as batch_op:
+        batch_op.add_column(sa.Column('event_id', sa.String(length=32), nullable=True))
+        batch_op.create_unique_constraint('uq_reward_transaction_event_id', ['event_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('reward_transaction') as batch_op:
+        batch_op.drop_constraint('uq_reward_transaction_event_id', type_='unique')
+        batch_op.drop_column('event_id')
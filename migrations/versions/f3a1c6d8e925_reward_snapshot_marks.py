@@ -0,0 +1,63 @@
+"""Reward snapshot marks
+
+Adds RewardTransaction.snapshot_id, the snapshot that folded the entry into
+Reward.points, with the (snapshot_id, user_id) index balance reads use, and
+drops the Reward.last_transaction_id watermark it replaces. Entries at or
+below their user's watermark are marked with the first snapshot that covered
+them, so every balance reads the same as before.
+
+Revision ID: f3a1c6d8e925
+Revises: c1e7f09b5a46
+Create Date: 2024-11-27 10:41:16.208337
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a1c6d8e925'
+down_revision = 'c1e7f09b5a46'
+branch_labels = None
+depends_on = None
+
+
+reward = sa.table('reward', sa.column('user_id'), sa.column('last_transaction_id'))
+reward_transaction = sa.table('reward_transaction', sa.column('id'), sa.column('user_id'), sa.column('snapshot_id'))
+reward_snapshot = sa.table('reward_snapshot', sa.column('id'), sa.column('last_transaction_id'))
+
+
+def upgrade():
+    with op.batch_alter_table('reward_transaction') as batch_op:
+        batch_op.add_column(sa.Column('snapshot_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_reward_transaction_snapshot_id_reward_snapshot',
+                                    'reward_snapshot', ['snapshot_id'], ['id'])
+        batch_op.create_index('ix_reward_transaction_snapshot_id_user_id', ['snapshot_id', 'user_id'])
+
+    op.execute(reward_transaction.update().where(
+        reward_transaction.c.id <= sa.select(reward.c.last_transaction_id)
+        .where(reward.c.user_id == reward_transaction.c.user_id).scalar_subquery(),
+    ).values(
+        snapshot_id=sa.select(sa.func.min(reward_snapshot.c.id))
+        .where(reward_snapshot.c.last_transaction_id >= reward_transaction.c.id).scalar_subquery(),
+    ))
+
+    with op.batch_alter_table('reward') as batch_op:
+        batch_op.drop_column('last_transaction_id')
+
+
+def downgrade():
+    with op.batch_alter_table('reward') as batch_op:
+        batch_op.add_column(sa.Column('last_transaction_id', sa.Integer(), nullable=False, server_default='0'))
+
+    op.execute(reward.update().values(
+        last_transaction_id=sa.func.coalesce(
+            sa.select(sa.func.max(reward_transaction.c.id))
+            .where(reward_transaction.c.user_id == reward.c.user_id,
+                   reward_transaction.c.snapshot_id.isnot(None)).scalar_subquery(), 0),
+    ))
+
+    with op.batch_alter_table('reward_transaction') as batch_op:
+        batch_op.drop_index('ix_reward_transaction_snapshot_id_user_id')
+        batch_op.drop_constraint('fk_reward_transaction_snapshot_id_reward_snapshot', type_='foreignkey')
+        batch_op.drop_column('snapshot_id')
@@ -1,4 +1,4 @@
-from app import create_app
+from app import create_app, init_worker
 from flask_migrate import Migrate
 from app import db
 # At the start of your run.py
@@ -11,4 +11,5 @@ app = create_app()
 migrate = Migrate(app, db)
   
 if __name__ == '__main__':
+    init_worker(app)
     app.run(debug=True, port=5002)